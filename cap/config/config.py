@@ -1,13 +1,22 @@
+import atexit
 import configparser
+import contextvars
 import os
 import logging
 from logging.config import fileConfig
+from logging.handlers import QueueHandler, QueueListener
+import queue
+import shutil
+import tempfile
+import threading
+import uuid
 
 
 CONFIG_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
 LOGGING_CONFIGURATION_FILE = os.path.join(CONFIG_DIRECTORY, 'logging.ini')
 ENV_CONFIGURATION_FILE = os.path.join(CONFIG_DIRECTORY, 'local.ini')
-LOG_FILE = os.path.join(os.path.dirname(CONFIG_DIRECTORY), 'model', 'log.log')  # Will be created/overwritten
+RUN_LOG_FILE_NAME = 'log.log'
+FLUSH_TIMEOUT = 30  # Seconds to wait for queued log records to be written
 DO_NOT_LOG_MODULES = ['matplotlib', 's3transfer.utils', 's3transfer.futures', 's3transfer.tasks']  # Put noisy module names here if they are unneccessarily cluttering the logs
 
 
@@ -31,12 +40,95 @@ def _loadAll(config_file, overwrite=True):
         _loadSection(config, section, overwrite)
 
 
-def configureLogger(log_level=None, config_file=LOGGING_CONFIGURATION_FILE, log_file=LOG_FILE):
+_current_run_id = contextvars.ContextVar('run_id', default=None)
+_listener = None
+_run_log_format = None
+_run_log_level = logging.DEBUG
+
+
+class _RunIdFilter(logging.Filter):
+    """Tag records with the run ID of the context they were logged from"""
+    def filter(self, record):
+        record.run_id = _current_run_id.get()
+        return True
+
+
+class _RunAwareQueueListener(QueueListener):
+    """Writes queued records to the global handlers, and to the log file of the run that logged them"""
+
+    def __init__(self, log_queue, *handlers):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.run_handlers = {}
+        self.running = False
+
+    def start(self):
+        super().start()
+        self.running = True
+
+    def stop(self):
+        self.running = False  # Records queued before stopping are still written by QueueListener.stop
+        super().stop()
+
+    def handle(self, record):
+        flush_event = getattr(record, 'flush_event', None)
+        if flush_event is not None:
+            flush_event.set()
+            return
+        super().handle(record)
+        run_handler = self.run_handlers.get(getattr(record, 'run_id', None))
+        if run_handler is not None and record.levelno >= run_handler.level:
+            run_handler.handle(record)
+
+
+class _FlushingQueueHandler(QueueHandler):
+    """Queue handler whose flush() blocks until records queued so far have been written"""
+
+    def __init__(self, log_queue, listener):
+        super().__init__(log_queue)
+        self.listener = listener
+
+    def flush(self):
+        if not self.listener.running:
+            return
+        flush_event = threading.Event()
+        self.queue.put_nowait(logging.makeLogRecord({'flush_event': flush_event}))
+        flush_event.wait(FLUSH_TIMEOUT)
+
+
+def _readFormat(config_file, formatter='formatter_file'):
+    config = configparser.RawConfigParser()
+    config.read(config_file)
+    return config.get(formatter, 'format', fallback=None)
+
+
+def stopLogger():
+    """Write any queued log records and stop the background log writer"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def configureLogger(log_level=None, config_file=LOGGING_CONFIGURATION_FILE, log_file=None):
+    """
+    Configure root logger from config_file, moving handler I/O to a background thread
+
+    :param log_level: log level for root logger and its handlers (or DISABLED)
+    :param config_file: logging configuration file
+    :param log_file: optional file receiving all records (per-run logs are created with RunLogContext)
+    """
+    global _listener, _run_log_format, _run_log_level
+    stopLogger()
     [logging.getLogger(logger).addFilter(lambda rec: False) for logger in DO_NOT_LOG_MODULES]
-    log_file = os.path.abspath(log_file).replace('\\', '/')  # logging.config.fileConfig is particular about escape chars (unavoidable on Windows)
-    logging.config.fileConfig(config_file, defaults={'logfilename': log_file})
+    log_file_default = os.path.abspath(log_file or os.devnull).replace('\\', '/')  # logging.config.fileConfig is particular about escape chars (unavoidable on Windows)
+    logging.config.fileConfig(config_file, defaults={'logfilename': log_file_default})
     logging.captureWarnings(True)
     root_logger = logging.getLogger()
+    _run_log_format = _readFormat(config_file)
+    if log_file:
+        file_handler = logging.FileHandler(log_file, 'w')
+        file_handler.setFormatter(logging.Formatter(_run_log_format))
+        root_logger.addHandler(file_handler)
     if log_level:
         if log_level == 'DISABLED':
             logging.captureWarnings(False)
@@ -45,6 +137,68 @@ def configureLogger(log_level=None, config_file=LOGGING_CONFIGURATION_FILE, log_
             root_logger.setLevel(log_level)
             for handler in root_logger.handlers:
                 handler.setLevel(log_level)
+    _run_log_level = logging.DEBUG if not log_level or log_level == 'DISABLED' else log_level
+
+    # Handlers are served from a queue so that logging I/O happens off the calling thread
+    log_queue = queue.Queue()
+    _listener = _RunAwareQueueListener(log_queue, *root_logger.handlers)
+    queue_handler = _FlushingQueueHandler(log_queue, _listener)
+    queue_handler.addFilter(_RunIdFilter())
+    root_logger.handlers = [queue_handler]
+    _listener.start()
+
+
+class RunLogContext:
+    """
+    Context manager routing records logged from the current context (thread or asyncio task) to a run-specific log file
+
+    :param run_id: ID tagging records of this run (default: random)
+    :param directory: directory for the run's log file (default: new temp directory, removed on exit)
+    :param file_name: log file name
+    :note: configureLogger must be called first; records are written by the background log writer
+    :note: threads inherit no context, so work started in other threads must run in a copy of the caller's context
+           (e.g., executor.submit(contextvars.copy_context().run, function)) for its records to reach the run's log file
+    """
+
+    def __init__(self, run_id=None, directory=None, file_name=RUN_LOG_FILE_NAME):
+        self.run_id = run_id or uuid.uuid4().hex
+        self._owns_directory = directory is None
+        self.directory = directory or tempfile.mkdtemp(prefix=f'{self.run_id}-')
+        self.log_file = os.path.join(self.directory, file_name)
+        self._handler = None
+        self._token = None
+
+    def __enter__(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._handler = logging.FileHandler(self.log_file, 'w')
+        self._handler.setFormatter(logging.Formatter(_run_log_format))
+        self._handler.setLevel(_run_log_level)
+        if _listener is not None:
+            _listener.run_handlers[self.run_id] = self._handler
+        else:
+            run_id = self.run_id
+            self._handler.addFilter(lambda record: _current_run_id.get() == run_id)
+            logging.getLogger().addHandler(self._handler)
+        self._token = _current_run_id.set(self.run_id)
+        return self
+
+    def flush(self):
+        """Block until records logged so far have been written to the log file"""
+        for handler in logging.getLogger().handlers:
+            handler.flush()
+
+    def __exit__(self, *exc_info):
+        self.flush()
+        _current_run_id.reset(self._token)
+        if _listener is not None:
+            _listener.run_handlers.pop(self.run_id, None)
+        logging.getLogger().removeHandler(self._handler)
+        self._handler.close()
+        if self._owns_directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+atexit.register(stopLogger)
 
 
 def processConfigurations(optional_config=None, optional_additions=None, overwrite_existing=None):
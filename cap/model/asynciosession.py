@@ -0,0 +1,73 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import functools
+import iosession
+from mapping import mapping
+
+
+DEFAULT_MAX_CONCURRENCY = 8
+
+
+class AsyncIOSession(iosession.IOSession):
+    """
+    IOSession whose getSourceInputFiles, uploadFiles and writeFileObjectToDisk are coroutines, so that model code can
+    await inputs and uploads while other stages compute. Blocking Cappy and file calls run in an executor, at most
+    max_concurrency at a time. Local-mode and S3-mode path conventions are those of IOSession.
+
+    :param max_concurrency: maximum number of transfers in progress at once
+    :param executor: optional concurrent.futures executor to run blocking calls in (default: thread pool owned by session)
+    :note: construction fetches modelRunParameter.json and blocks, like IOSession
+    """
+
+    def __init__(self, cap_session, mrp_json_path, local_mode, session_pool=None, model_metadata_path=iosession.MODEL_METADATA_PATH,
+                 temp_directory=None, max_concurrency=DEFAULT_MAX_CONCURRENCY, executor=None):
+        super().__init__(cap_session, mrp_json_path, local_mode, session_pool=session_pool, model_metadata_path=model_metadata_path,
+                         temp_directory=temp_directory)
+        self.max_concurrency = max_concurrency
+        self._executor = executor or ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='AsyncIOSession')
+        self._owns_executor = executor is None
+        self._semaphore = None
+
+    async def _run(self, function, *args, **kwargs):
+        """
+        Run a blocking call in the executor, waiting for a free slot if max_concurrency calls are in progress
+        :note: the call runs in a copy of the task's context, so that its records reach the run's log (see config.RunLogContext)
+        """
+        if self._semaphore is None:  # Created lazily, so that it belongs to the running event loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(contextvars.copy_context().run, function, *args, **kwargs))
+
+    async def getSourceInputFiles(self, require=[], optional=[], project=False):
+        """
+        Fetch model input files specified in MRP concurrently (see IOSession.getSourceInputFiles)
+        :return: dictionary of form {file_name_wo_ext: local_file_path}
+        """
+        input_specs = self.inputSpecs(require, optional)
+        fetched = await asyncio.gather(*[self._run(self._fetchInput, *input_spec) for input_spec in input_specs])
+        input_files = {}
+        for file in fetched:
+            input_files.update(file)
+        if project:
+            names = self.projectedInputs(input_files)
+            await asyncio.gather(*[self._run(mapping.projectCsv, input_files[name], self.required_columns[name]) for name in names])
+        for file_path in input_files.values():
+            self.manifest.record(file_path, 'staged')
+        return input_files
+
+    async def uploadFiles(self, files, scenario_name=None, on_error='log', skip_unchanged=False):
+        """Upload files concurrently (see IOSession.uploadFiles)"""
+        upload = super().uploadFiles
+        await asyncio.gather(*[self._run(upload, {file: file_path}, scenario_name, on_error, skip_unchanged)
+                               for file, file_path in files.items()])
+
+    async def writeFileObjectToDisk(self, file_object, file_name, directory=None):
+        """Write a file object to disk in the executor (see IOSession.writeFileObjectToDisk). :return: full file path"""
+        return await self._run(super().writeFileObjectToDisk, file_object, file_name, directory)
+
+    def close(self):
+        """Shut down the executor, if owned by this session"""
+        if self._owns_executor:
+            self._executor.shutdown()
@@ -0,0 +1,140 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import fnmatch
+import glob
+import logging
+import os
+import queue
+import sys
+import tempfile
+import run  # Also adds package directories to sys.path
+from config import config
+
+
+GLOB_CHARACTERS = '*?['
+
+
+def _parseInputArguments():
+    parser = argparse.ArgumentParser(description='Run model for many model run parameter files in one process')
+    run._addRunArguments(parser)
+    parser.add_argument('-n', '--workers', help='Number of model runs to execute in parallel', type=int, default=1)
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('-s', '--s3', help='Run model with data hosted on S3 (keys or glob patterns)', nargs='+', metavar=('MODEL_PARAMS_S3_KEY'))
+    mode.add_argument('-L', '--local', help='Run model with data from local test folders (paths or glob patterns)', nargs='+', metavar=('TEST_FOLDER_PATH'))
+    run._addCredentialArguments(parser)
+    return parser.parse_args()
+
+
+def _isPattern(path):
+    return any(char in path for char in GLOB_CHARACTERS)
+
+
+def expandLocalPaths(patterns):
+    """Expand local paths and glob patterns into a sorted, de-duplicated list of model run parameter files"""
+    logger = logging.getLogger(__name__)
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if _isPattern(pattern) else [pattern]
+        if not matches:
+            logger.warning(f'No model run parameter files match: {pattern}')
+        paths.extend(path for path in matches if path not in paths)
+    return paths
+
+
+def expandS3Keys(patterns, s3_client, bucket):
+    """Expand S3 keys and glob patterns into a sorted, de-duplicated list of model run parameter keys"""
+    import s3prefix
+    logger = logging.getLogger(__name__)
+    keys = []
+    for pattern in patterns:
+        if _isPattern(pattern):
+            prefix = pattern[:min(pattern.find(char) for char in GLOB_CHARACTERS if char in pattern)]
+            matches = sorted(key for key in s3prefix.iterKeys(s3_client, bucket, prefix) if fnmatch.fnmatchcase(key, pattern))
+        else:
+            matches = [pattern]
+        if not matches:
+            logger.warning(f'No model run parameter keys match: {pattern}')
+        keys.extend(key for key in matches if key not in keys)
+    return keys
+
+
+def _runOne(run_id, model_run_parameters_path, local_mode, credentials, proxy_credentials, keep_temp, session_pool, temp_directories=None,
+            resume=False):
+    """
+    Run one model run parameter file with its own log.log and instrumentError handler
+    :param temp_directories: optional queue of temp directories to reuse. One is taken for the duration of the run
+    :return: exit code
+    """
+    temp_directory = temp_directories.get() if temp_directories is not None else None
+    with config.RunLogContext(run_id) as run_log:
+        try:
+            logging.getLogger(__name__).info(f'Starting run {run_id}: {model_run_parameters_path}')
+            return run.runModel(model_run_parameters_path, local_mode, credentials, proxy_credentials, keep_temp=keep_temp,
+                                log_file=run_log.log_file, session_pool=session_pool, run_id=run_id, temp_directory=temp_directory,
+                                resume=resume)
+        except Exception as e:
+            logging.getLogger(__name__).error(f'Run {run_id} failed with exception: {e}', exc_info=True)
+            return 1
+        finally:
+            if temp_directory is not None:
+                temp_directories.put(temp_directory)
+
+
+def runBatch(model_run_parameters_paths, local_mode, credentials, proxy_credentials, keep_temp=False, workers=1, session_pool=None, resume=False):
+    """
+    Run many model run parameter files in this process, sharing configuration, logging setup and authenticated sessions
+    :param resume: If True, resume each run from the checkpoint of an earlier failed run of the same model run parameters
+    :return: list of tuples (run_id, model_run_parameters_path, exit_code), in input order
+    """
+    import sessionpool
+    import trash
+    session_pool = session_pool or sessionpool.getSessionPool()
+    run_ids = [f'run{index:04}' for index in range(len(model_run_parameters_paths))]
+    workers = max(workers, 1)
+    temp_directories = None
+    if not keep_temp:  # Runs on the same worker reuse one temp directory, rather than each creating (and deleting) their own
+        temp_directories = queue.Queue()
+        for _ in range(min(workers, len(model_run_parameters_paths))):
+            temp_directories.put(tempfile.mkdtemp(prefix='cap-batch-'))
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_runOne, run_id, path, local_mode, credentials, proxy_credentials, keep_temp, session_pool, temp_directories,
+                                       resume)
+                       for run_id, path in zip(run_ids, model_run_parameters_paths)]
+    finally:
+        if temp_directories is not None:
+            trash.trash(list(temp_directories.queue))
+    return [(run_id, path, future.result()) for run_id, path, future in zip(run_ids, model_run_parameters_paths, futures)]
+
+
+def printSummary(results):
+    """Print exit code of every run and return the batch exit code (0 only if every run succeeded)"""
+    failed = [result for result in results if result[2] != 0]
+    print(f'{"run":<8} {"exit":<5} model run parameters')
+    for run_id, path, exit_code in results:
+        print(f'{run_id:<8} {exit_code:<5} {path}')
+    print(f'{len(results) - len(failed)} of {len(results)} runs succeeded')
+    return 1 if failed or not results else 0
+
+
+def main():
+    args = _parseInputArguments()
+    config.configureLogger(args.loglevel)
+    config.processConfigurations(args.overwrite, args.config, args.usedefaults)
+    credentials, proxy_credentials = run._getCredentials(args)
+    local_mode = bool(args.local)
+    if local_mode:
+        paths = expandLocalPaths(args.local)
+    else:
+        import sessionpool
+        session_pool = sessionpool.getSessionPool()
+        cap_session = session_pool.getSession(credentials, errors='raise')
+        paths = expandS3Keys(args.s3, session_pool.getS3Client(cap_session), cap_session.context['s3_bucket'])
+    results = runBatch(paths, local_mode, credentials, proxy_credentials, keep_temp=args.keeptemp, workers=args.workers, resume=args.resume)
+    exit_code = printSummary(results)
+    logging.shutdown()
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
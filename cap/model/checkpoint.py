@@ -0,0 +1,214 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import trash
+
+
+CHECKPOINT_DIRECTORY_VARIABLE = 'MOODYS_CHECKPOINT_DIRECTORY'
+CHECKPOINT_KEEP_VARIABLE = 'MOODYS_CHECKPOINT_KEEP'
+DEFAULT_CHECKPOINT_KEEP = 3  # Checkpoints of failed runs kept per checkpoint directory, older ones are removed
+MANIFEST_FILE = 'checkpoint.json'
+LOCK_SUFFIX = '.lock'
+
+
+def _lock(lock_path):
+    """:return: open file holding an exclusive lock on lock_path, or None if another process holds it"""
+    lock_file = open(lock_path, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def pruneCheckpoints(root, keep=None, exclude=()):
+    """
+    Remove all but the keep most recently updated checkpoints in root, skipping checkpoints of runs in progress
+    :param keep: number of checkpoints to keep (default: MOODYS_CHECKPOINT_KEEP environment variable, else DEFAULT_CHECKPOINT_KEEP)
+    :param exclude: checkpoint ids never removed (e.g., of the current run), not counted in keep
+    :return: list of removed checkpoint directories
+    """
+    keep = int(keep if keep is not None else os.environ.get(CHECKPOINT_KEEP_VARIABLE) or DEFAULT_CHECKPOINT_KEEP)
+    try:
+        with os.scandir(root) as entries:
+            directories = [entry.path for entry in entries if entry.is_dir() and entry.name not in exclude]
+    except FileNotFoundError:
+        return []
+    directories.sort(key=lambda directory: os.path.getmtime(directory), reverse=True)
+    removed = []
+    for directory in directories[keep:]:
+        lock_file = _lock(f'{directory}{LOCK_SUFFIX}')
+        if lock_file is None:
+            continue  # Run in progress
+        try:
+            trash.trash([directory])
+            removed.append(directory)
+        finally:
+            lock_file.close()
+    return removed
+
+
+def checkpointId(model_run_parameters_path, run_id=None):
+    """:return: stable name of a run's checkpoint: run_id if given, else derived from the model run parameters S3 key or local path"""
+    if run_id:
+        return run_id
+    path = model_run_parameters_path if '://' in model_run_parameters_path or not os.path.exists(model_run_parameters_path) \
+        else os.path.abspath(model_run_parameters_path)
+    return hashlib.sha256(path.encode('utf-8')).hexdigest()[:16]
+
+
+class RunCheckpoint:
+    """
+    Progress of a model run (completed steps, scoring shards and uploads), persisted as an atomic JSON manifest, so that a failed
+    run can be resumed without redoing finished work. The run's local temp files are kept in work_directory until the run succeeds
+
+    :param checkpoint_id: name of the checkpoint (see checkpointId)
+    :param directory: directory to keep checkpoints in (default: MOODYS_CHECKPOINT_DIRECTORY environment variable). If neither
+                      is set, progress is tracked in memory only and nothing can be resumed
+    :param resume: If True, continue from the persisted manifest (if any), else start over
+    :note: call verify() with a fingerprint of the run's inputs before relying on resumed progress
+    :note: a persisted checkpoint is locked until close(). A run whose checkpoint is locked by another run in progress (e.g., of the
+           same model run parameters) tracks its progress in memory only, so that the other run's work files are left alone
+    :note: older checkpoints beyond MOODYS_CHECKPOINT_KEEP are removed when a checkpoint is persisted (see pruneCheckpoints)
+    """
+
+    def __init__(self, checkpoint_id, directory=None, resume=False):
+        self.logger = logging.getLogger(__name__)
+        self.checkpoint_id = checkpoint_id
+        root = directory or os.environ.get(CHECKPOINT_DIRECTORY_VARIABLE)
+        self.directory = os.path.join(os.path.abspath(root), checkpoint_id) if root else None
+        self._lock_file = None
+        if self.directory:
+            os.makedirs(root, exist_ok=True)
+            self._lock_file = _lock(f'{self.directory}{LOCK_SUFFIX}')
+            if self._lock_file is None:
+                self.logger.warning(f'Checkpoint {self.directory} is in use by another run. Tracking progress in memory only')
+                self.directory = None
+            else:
+                pruneCheckpoints(root, exclude=(checkpoint_id,))
+        self.work_directory = os.path.join(self.directory, 'work') if self.directory else None
+        self._lock = threading.RLock()
+        self._manifest = self._load() if resume else None
+        self.resumed = self._manifest is not None
+        if self.resumed:
+            self.logger.info(f'Resuming from checkpoint {self.directory}: steps {[*self._manifest["steps"]]} completed')
+        else:
+            if resume:
+                self.logger.info(f'No checkpoint to resume for {checkpoint_id}. Starting over')
+            self.clear()
+            self._reset(None)
+
+    def _reset(self, fingerprint):
+        self._manifest = {'checkpointId': self.checkpoint_id, 'fingerprint': fingerprint, 'steps': {}, 'shards': {}, 'uploads': {}}
+
+    @property
+    def persistent(self):
+        return self.directory is not None
+
+    def _path(self):
+        return os.path.join(self.directory, MANIFEST_FILE)
+
+    def _load(self):
+        if not self.persistent:
+            return None
+        try:
+            with open(self._path(), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self):
+        if not self.persistent:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            temp_path = f'{self._path()}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump(self._manifest, f, indent=2)
+            os.replace(temp_path, self._path())  # Atomic, so a crash never leaves a partial manifest
+        except OSError as e:
+            self.logger.warning(f'Unable to persist checkpoint {self._path()}: {e}')
+
+    def verify(self, fingerprint):
+        """
+        Check that resumed progress was made for the same inputs, starting over if not
+        :param fingerprint: fingerprint of the run's inputs (e.g., md5 of modelRunParameter.json)
+        :return: True if progress can be resumed
+        """
+        with self._lock:
+            if self.resumed and self._manifest.get('fingerprint') != fingerprint:
+                self.logger.warning(f'Checkpoint {self.checkpoint_id} was made for different model run parameters. Starting over')
+                self.resumed = False
+            if not self.resumed:
+                self._reset(fingerprint)
+                self._save()
+            return self.resumed
+
+    def clear(self):
+        """Discard persisted progress and kept work files (e.g., once the run has succeeded)"""
+        with self._lock:
+            if self.persistent and os.path.exists(self.directory):
+                trash.trash([self.directory])
+
+    def close(self):
+        """Release the checkpoint's lock, so that a later run can resume it"""
+        with self._lock:
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+
+    def resumable(self, final_step):
+        """:return: True if progress is persisted and a resumed run would have work left, i.e., some steps completed but not final_step"""
+        with self._lock:
+            return self.persistent and bool(self._manifest['steps']) and final_step not in self._manifest['steps']
+
+    def isComplete(self, step):
+        with self._lock:
+            return step in self._manifest['steps']
+
+    def complete(self, step, **details):
+        """Record a step as completed, with optional JSON-serializable details (e.g., paths of files it produced)"""
+        with self._lock:
+            self._manifest['steps'][step] = details
+            self._save()
+
+    def details(self, step):
+        """:return: details recorded with a completed step, or None if the step is not complete"""
+        with self._lock:
+            return self._manifest['steps'].get(step)
+
+    def isShardComplete(self, stage, shard):
+        with self._lock:
+            return str(shard) in self._manifest['shards'].get(stage, {})
+
+    def completeShard(self, stage, shard, **details):
+        with self._lock:
+            self._manifest['shards'].setdefault(stage, {})[str(shard)] = details
+            self._save()
+
+    def shards(self, stage):
+        """:return: dictionary of form {shard: details} of completed shards of a stage"""
+        with self._lock:
+            return dict(self._manifest['shards'].get(stage, {}))
+
+    def isUploaded(self, destination, file_path):
+        """Whether file_path was uploaded to destination by this run (or the run resumed) and has not changed since"""
+        with self._lock:
+            prior = self._manifest['uploads'].get(destination)
+        if prior is None:
+            return False
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return False
+        return prior['path'] == os.path.abspath(file_path) and prior['size'] == stat.st_size and prior['mtime'] == stat.st_mtime_ns
+
+    def recordUpload(self, destination, file_path):
+        stat = os.stat(file_path)
+        with self._lock:
+            self._manifest['uploads'][destination] = {'path': os.path.abspath(file_path), 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+            self._save()
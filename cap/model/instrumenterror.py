@@ -1,8 +1,15 @@
+import csv
+import glob
 import logging
 import os
 import pandas as pd
+import shutil
 import sys
+import tempfile
+import threading
+import time
 import warnings
+from mapping import mapping
 
 
 DEFAULT_COLUMNS = [
@@ -26,14 +33,46 @@ DEFAULT_PORTFOLIO_ID = None
 DEFAULT_INSTRUMENT_ID = None
 DEFAULT_ERROR_MESSAGE = 'An unknown exception has occurred'
 
+ORDER_COLUMNS = ['_shard', '_row', '_sequence']  # Sort keys of spilled entries (see InstrumentErrorHandler.enableSpill)
+
+_order_lock = threading.Lock()
+_last_order = 0
+
+
+def _nextOrders(count=1):
+    """
+    Reserve sequence numbers for count entries: a counter increasing monotonically within the process, started from the system-wide
+    monotonic clock so that entries of different processes with the same position sort by when they were made
+    :return: range of sequence numbers
+    """
+    global _last_order
+    with _order_lock:
+        start = max(time.monotonic_ns(), _last_order + 1)
+        _last_order = start + count - 1
+    return range(start, start + count)
+
 
 class InstrumentErrorHandler:
-    """Handler for creating and managing instrumentError.csv files"""
+    """
+    Handler for creating and managing instrumentError.csv files
+
+    :note: entries are buffered and appended to the data frame in one go when _df is next accessed
+    :note: in spill mode (see enableSpill), every process appends entries to its own spill file instead, so that errors of
+           worker processes are not lost. createInstrumentErrorFile merges them in one pass, in instrument order: by the position
+           (shard, row) given with each entry, then in the order entries were made. Entries without a position come last
+    """
     _error_handlers = {}
+    _registry_lock = threading.RLock()
 
     def __init__(self, name=DEFAULT_NAME, columns=DEFAULT_COLUMNS, **kwargs):
         self._name = name
-        self._df = pd.DataFrame(columns=columns)
+        self._frame = pd.DataFrame(columns=columns)
+        self._pending = []
+        self._lock = threading.RLock()
+        self._spill_directory = None
+        self._owns_spill_directory = False
+        self._spill_columns = None
+        self._spill_file = None
         self._logger = logging.getLogger(__name__)
         DEFAULT_MODEL_NAME = os.environ.get('MOODYS_MODEL_NAME')
         self.err_msg = kwargs.get('err_msg', DEFAULT_ERROR_MESSAGE)
@@ -46,6 +85,100 @@ class InstrumentErrorHandler:
         self.allowed_kwargs = [kw for kw in vars(self) if kw[0] != '_']
 
 
+    @property
+    def _df(self):
+        """Data frame of entries made in this process (excluding spilled entries)"""
+        with self._lock:
+            if self._pending:
+                self._frame = pd.concat([self._frame, pd.DataFrame(self._pending)], sort=False, ignore_index=True)
+                self._pending = []
+            return self._frame
+
+
+    @_df.setter
+    def _df(self, data_frame):
+        with self._lock:
+            self._pending = []
+            self._frame = data_frame
+
+
+    def enableSpill(self, directory=None):
+        """
+        Append subsequent entries to a spill file per process (e.g., for errors of forked worker processes)
+
+        :param directory: directory shared by all processes (default: new temp directory, removed by close())
+        :note: entries made before enabling spill mode stay in _df and come first in the merged output
+        :note: spilled rows hold this handler's current columns only (extra columns of joined data frames are dropped)
+        :return: spill directory
+        """
+        with self._lock:
+            if self._spill_directory is None:
+                self._owns_spill_directory = directory is None
+                self._spill_directory = directory or tempfile.mkdtemp(prefix=f'instrumentError-{self._name}-')
+                os.makedirs(self._spill_directory, exist_ok=True)
+                self._spill_columns = [*self._df.columns]
+            return self._spill_directory
+
+
+    def _spillPath(self):
+        return os.path.join(self._spill_directory, f'{self._name}.{os.getpid()}.csv')
+
+
+    def _spillRows(self, rows):
+        """Append rows (lists of values in spill column order, followed by ORDER_COLUMNS) to this process's spill file"""
+        with self._lock:
+            if self._spill_file is None:
+                path = self._spillPath()
+                write_header = not os.path.exists(path)
+                self._spill_file = open(path, 'a', newline='', encoding='utf-8')
+                if write_header:
+                    csv.writer(self._spill_file).writerow([*self._spill_columns, *ORDER_COLUMNS])
+            csv.writer(self._spill_file).writerows(rows)
+            self._spill_file.flush()  # Worker processes may exit without running finalizers
+
+
+    def _readSpill(self):
+        """Read all spill files in one pass. :return: data frame of spilled entries sorted by ORDER_COLUMNS, or None"""
+        with self._lock:
+            if self._spill_directory is None:
+                return None
+            if self._spill_file is not None:
+                self._spill_file.flush()
+        paths = sorted(glob.glob(os.path.join(glob.escape(self._spill_directory), f'{glob.escape(self._name)}.*.csv')))
+        frames = [pd.read_csv(path, dtype=str, keep_default_na=False) for path in paths]
+        if not frames:
+            return None
+        spilled = pd.concat(frames, ignore_index=True, sort=False)
+        keys = spilled[ORDER_COLUMNS].apply(pd.to_numeric)
+        order = keys.sort_values(ORDER_COLUMNS, na_position='last').index  # Entries without a position after those with one
+        spilled = spilled.drop(columns=ORDER_COLUMNS).loc[order].reset_index(drop=True)
+        return spilled.replace('', None)
+
+
+    def collect(self):
+        """:return: data frame of all entries: those made in this process followed by spilled entries of all processes"""
+        spilled = self._readSpill()
+        if spilled is None or len(spilled.index) == 0:
+            return self._df.copy()
+        return pd.concat([self._df, spilled], ignore_index=True, sort=False)
+
+
+    def close(self):
+        """Close this process's spill file, removing the spill directory if it was created by enableSpill"""
+        with self._lock:
+            if self._spill_file is not None:
+                self._spill_file.close()
+                self._spill_file = None
+            if self._owns_spill_directory and self._spill_directory:
+                shutil.rmtree(self._spill_directory, ignore_errors=True)
+                self._spill_directory = None
+
+
+    def _afterFork(self):
+        self._lock = threading.RLock()
+        self._spill_file = None  # Child processes write to their own spill file
+
+
     def entry(self, err_msg, log=False, **kwargs):
         """
         Create an entry in instrumentError data frame
@@ -58,6 +191,7 @@ class InstrumentErrorHandler:
         :param kwargs.analysis_id: analysis ID where the error was generated
         :param kwargs.scenario_id: scenario ID where the error was generated
         :param kwargs.portfolio_id: portfolio ID where the error was generated
+        :param kwargs.order: in spill mode, position of the instrument as (shard, row) or (shard,), see InstrumentErrorHandler
         """
         entry = {
             'errorMessage': err_msg,
@@ -68,7 +202,12 @@ class InstrumentErrorHandler:
             'portfolioIdentifier': kwargs.get('portfolio_id', self.portfolio_id),
             'instrumentIdentifier': kwargs.get('instrument_id', self.instrument_id)
         }
-        self._df = self._df.append(entry, sort=False, ignore_index=True)
+        with self._lock:
+            if self._spill_directory is not None:
+                shard, row = (*kwargs.get('order', ()), None, None)[:2]
+                self._spillRows([[entry.get(column) for column in self._spill_columns] + [shard, row, _nextOrders()[0]]])
+            else:
+                self._pending.append(entry)
         self._logger.error(err_msg) if log else None
 
 
@@ -80,27 +219,32 @@ class InstrumentErrorHandler:
         :param columns: columns to output
         :return: dictionary {'instrumentError': file_path} or empty dictionary if no entries in data frame
         """
-        df = self._df.copy()
+        df = self.collect()
         if len(df.index) == 0:
             return {}
-        column_mapper = {column.lower(): column for column in self._df.columns}
+        column_mapper = {column.lower(): column for column in df.columns}
         mapped_columns = [column_mapper.get(column.lower(), column) for column in columns]
         df = df.reindex(columns=mapped_columns)
         os.makedirs(directory, exist_ok=True)
         # TODO: Make more fault tolerant. What happens if directory not provided (present in MRP)?
         file_path = os.path.join(directory, 'instrumentError.csv')
-        df.to_csv(file_path, index=False, date_format='%Y-%m-%d')
+        mapping.writeCsv(df, file_path, index=False, date_format='%Y-%m-%d')
         self._logger.error('One or more error files have been generated')
         return {'instrumentError': file_path}
 
 
-    def joinDataFrame(self, data_frame, keep_alt_cols=False, prepend=False):
+    def joinDataFrame(self, data_frame, keep_alt_cols=False, prepend=False, order=None):
         """
         Join another data frame to self._df case-insensitively, optionally keeping non-mathcing columns
         :param data_frame: data frame to be appended
         :param keep_alt_cols: Don't discard columns that do not match default columns
+        :param prepend: put rows of data frame before existing entries (not supported in spill mode)
+        :param order: in spill mode, columns of data frame holding each row's instrument position as [shard, row] or [shard]
+                      (see InstrumentErrorHandler). Rows are otherwise spilled without a position, in row order
         :return: calling InstrumentErrorHandler
         """
+        if self._spill_directory is not None:
+            return self._spillDataFrame(data_frame, order or [])
         data_frame = data_frame.copy()
         df_column_map = {column: column.lower() for column in data_frame.columns}
         self_column_map = {column.lower(): column for column in self._df.columns}
@@ -114,6 +258,19 @@ class InstrumentErrorHandler:
         return self
 
 
+    def _spillDataFrame(self, data_frame, order):
+        columns = {column.lower(): column for column in data_frame.columns}
+        values = data_frame.reindex(columns=[columns.get(column.lower(), column) for column in self._spill_columns])
+        values = values.astype(object).where(values.notna(), None)
+        positions = pd.DataFrame({key: data_frame[column] if column in data_frame else None
+                                  for key, column in zip(ORDER_COLUMNS[:2], [*order, None, None])}, index=data_frame.index)
+        positions = positions.astype(object).where(positions.notna(), None)
+        sequence = _nextOrders(len(data_frame.index))  # In row order
+        self._spillRows([[*row, *position, number] for row, position, number in
+                         zip(values.itertuples(index=False, name=None), positions.itertuples(index=False, name=None), sequence)])
+        return self
+
+
     # def join(self):
     #     pass
 
@@ -155,11 +312,39 @@ def getErrorHandler(name=DEFAULT_NAME, columns=DEFAULT_COLUMNS, **kwargs):
     :param columns: default columns to instantiate data frame with
     :return: error handler with given name, defaulting to root handler if name ommitted
     """
-    if name in InstrumentErrorHandler._error_handlers:
-        return InstrumentErrorHandler._error_handlers[name]
-    else:
-        InstrumentErrorHandler._error_handlers[name] = InstrumentErrorHandler(name, columns=columns, **kwargs)
-        return InstrumentErrorHandler._error_handlers[name]
+    with InstrumentErrorHandler._registry_lock:
+        if name in InstrumentErrorHandler._error_handlers:
+            return InstrumentErrorHandler._error_handlers[name]
+        else:
+            InstrumentErrorHandler._error_handlers[name] = InstrumentErrorHandler(name, columns=columns, **kwargs)
+            return InstrumentErrorHandler._error_handlers[name]
+
+
+def removeErrorHandler(name):
+    """
+    Remove an error handler from the registry (e.g., once a run in a long-lived process is finished)
+
+    :param name: name of error handler to remove
+    :return: removed error handler, or None if no handler with given name exists
+    """
+    with InstrumentErrorHandler._registry_lock:
+        handler = InstrumentErrorHandler._error_handlers.pop(name, None)
+    if handler is not None:
+        handler.close()
+    return handler
+
+
+def _afterForkInChild():
+    """Locks held by other threads at fork time would never be released in the child, so replace them"""
+    global _order_lock
+    _order_lock = threading.Lock()
+    InstrumentErrorHandler._registry_lock = threading.RLock()
+    for handler in InstrumentErrorHandler._error_handlers.values():
+        handler._afterFork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_afterForkInChild)
 
 
 def warnOnMultipleImports():
@@ -1,10 +1,41 @@
-from glob import glob as gg
+import contextlib
+import hashlib
 import json
 import logging
+from mapping import mapping
 import os
 import pandas as pd
+import s3prefix
 import shutil
 import tempfile
+import threading
+import transfer
+import trash
+
+
+UPLOAD_MANIFEST_VARIABLE = 'MOODYS_UPLOAD_MANIFEST_PATH'
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+DATA_FILE_NAME = 'data'  # Name (without extension) outputs are uploaded as, see uploadDestination
+MODEL_METADATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'meta', 'model.json')
+
+
+def readRequiredColumns(model_metadata_path=MODEL_METADATA_PATH):
+    """
+    Read the input columns the model needs from model metadata (version.datasets.inputData in meta/model.json)
+    :return: dictionary of form {input_category: [attributes]}, empty if metadata is missing
+    """
+    try:
+        with open(model_metadata_path, 'r') as f:
+            model_metadata = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.getLogger(__name__).warning(f'Unable to read model metadata {model_metadata_path}: {e}')
+        return {}
+    input_data = model_metadata.get('version', {}).get('datasets', {}).get('inputData', [])
+    return {data['category']: data['attributes'] for data in input_data if data.get('attributes')}
+
+
+def _fileSize(path):
+    return os.path.getsize(path) if os.path.isfile(path) else None
 
 
 class Scenario:
@@ -34,52 +65,223 @@ class ModelRunParameters:
         self.reporting_date = pd.to_datetime(model_run_parameter_json['settings']['reportingDate'])
 
 
+class FileManifest:
+    """
+    Record of local files staged, written and uploaded by an IOSession, with the size and mtime each had at the time
+
+    :note: kinds are 'staged' (inputs fetched for the model), 'written' (found in or written to the temp tree) and 'uploaded'
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def record(self, file_path, kind, stat=None):
+        """Record a file's current size and mtime under the given kind. :return: the recorded entry, or None if file is missing"""
+        try:
+            stat = stat or os.stat(file_path)
+        except OSError:
+            return None
+        entry = {'kind': kind, 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+        with self._lock:
+            self._entries[os.path.abspath(file_path)] = entry
+        return entry
+
+    def get(self, file_path):
+        with self._lock:
+            return self._entries.get(os.path.abspath(file_path))
+
+    def isUnchanged(self, file_path, kinds=('staged', 'uploaded'), stat=None):
+        """:return: True if file was recorded as one of the given kinds and its size and mtime have not changed since"""
+        entry = self.get(file_path)
+        if entry is None or entry['kind'] not in kinds:
+            return False
+        try:
+            stat = stat or os.stat(file_path)
+        except OSError:
+            return False
+        return entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns
+
+    def entries(self, kind=None):
+        """:return: dictionary of form {file_path: {'kind', 'size', 'mtime'}}, optionally only of the given kind"""
+        with self._lock:
+            return {path: dict(entry) for path, entry in self._entries.items() if kind is None or entry['kind'] == kind}
+
+
+def fileMd5(file_path, chunk_size=HASH_CHUNK_SIZE):
+    """Streaming md5 of a file's content. :return: hex digest"""
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class UploadManifest:
+    """
+    Checksums of prior uploads, persisted as JSON so that reruns can skip identical uploads without asking S3
+
+    :param path: JSON file path (default: MOODYS_UPLOAD_MANIFEST_PATH environment variable). None or empty disables persistence
+    """
+
+    def __init__(self, path=None):
+        self.logger = logging.getLogger(__name__)
+        self.path = path if path is not None else os.environ.get(UPLOAD_MANIFEST_VARIABLE)
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path, 'r') as f:
+                    self._entries = json.load(f)
+            except (OSError, TypeError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def get(self, destination):
+        """:return: dictionary of form {'md5', 'size'} of the last upload to destination, or None"""
+        with self._lock:
+            return self._load().get(destination)
+
+    def put(self, destination, md5, size):
+        with self._lock:
+            self._load()[destination] = {'md5': md5, 'size': size}
+            if not self.path:
+                return
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                temp_path = f'{self.path}.{os.getpid()}.tmp'
+                with open(temp_path, 'w') as f:
+                    json.dump(self._entries, f)
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                self.logger.warning(f'Unable to persist upload manifest {self.path}: {e}')
+
+
+def _scanFiles(directory):
+    """Walk a directory tree depth-first with os.scandir. :return: generator of (file_path, os.stat_result)"""
+    try:
+        with os.scandir(directory) as entries:
+            entries = list(entries)
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if entry.is_file():
+            yield entry.path, entry.stat()
+        elif entry.is_dir(follow_symlinks=False):
+            yield from _scanFiles(entry.path)
+
+
 class IOSession:
-    def __init__(self, cap_session, mrp_json_path, local_mode):
+    def __init__(self, cap_session, mrp_json_path, local_mode, session_pool=None, model_metadata_path=MODEL_METADATA_PATH, temp_directory=None,
+                 checkpoint=None):
         self.logger = logging.getLogger(__name__)
         self.local_mode = local_mode
         self.cap_session = cap_session
+        self.session_pool = session_pool
+        self._s3_client = None
+        self.required_columns = readRequiredColumns(model_metadata_path)
+        self.manifest = FileManifest()
+        self.upload_manifest = UploadManifest()
+        self.metrics = {'uploaded_files': 0, 'uploaded_bytes': 0, 'skipped_files': 0, 'skipped_bytes': 0}
+        self._metrics_lock = threading.Lock()
+        self._quiet_lock = threading.Lock()
+        self._quiet_transfers = 0
+        self.transfers = transfer.TransferScheduler()
 
-        self.local_temp_directory = os.path.abspath(tempfile.mkdtemp())
-        self.logger.debug(f'Created local temp directory: {self.local_temp_directory}')
+        # A persistent checkpoint keeps the temp directory (its work directory) for resumed runs, see checkpoint.RunCheckpoint
+        self.checkpoint = checkpoint
+        self.resumed = checkpoint is not None and checkpoint.resumed
+        if checkpoint is not None and checkpoint.persistent:
+            temp_directory = checkpoint.work_directory
+        self._owns_temp_directory = temp_directory is None
+        if temp_directory:
+            self.local_temp_directory = os.path.abspath(temp_directory)
+            os.makedirs(self.local_temp_directory, exist_ok=True)
+            if not self.resumed:
+                trash.trash(self._tempEntries())  # Leftovers of an earlier run using the same directory
+            self.logger.debug(f'Reusing local temp directory: {self.local_temp_directory}')
+        else:
+            self.local_temp_directory = os.path.abspath(tempfile.mkdtemp())
+            self.logger.debug(f'Created local temp directory: {self.local_temp_directory}')
         self.model_run_parameters = self.getModelRunParameters(mrp_json_path)
+        if checkpoint is not None:
+            model_run_parameters_path = os.path.join(self.local_temp_directory, os.path.basename(mrp_json_path))
+            resumed, self.resumed = self.resumed, checkpoint.verify(fileMd5(model_run_parameters_path))
+            if resumed and not self.resumed:  # Checkpoint was made for other model run parameters
+                trash.trash([path for path in self._tempEntries() if path != model_run_parameters_path])
         self.local_directories = self.create_io_directories()
 
         if local_mode:
             test_folder = os.path.abspath(os.path.dirname(mrp_json_path))
             self.input_path = os.path.join(test_folder, 'input_csv')
             self.test_folder_output = os.path.join(test_folder, 'output')
-            self.initializeDirectory(self.test_folder_output)
+            self._prepareDirectory(self.test_folder_output)
         else:
             self.input_path = self.model_run_parameters.input_s3_path
 
     def create_io_directories(self):
         """Create local directories for every input/output/log directory in modelRunParameter.json settings"""
         local_directories = {'outputPaths': {}}
-        local_directories['logPath'] = self.initializeDirectory(os.path.join(self.local_temp_directory, 'logPath'))
-        local_directories['inputPath'] = self.initializeDirectory(os.path.join(self.local_temp_directory, 'inputPath'))
+        local_directories['logPath'] = self._prepareDirectory(os.path.join(self.local_temp_directory, 'logPath'))
+        local_directories['inputPath'] = self._prepareDirectory(os.path.join(self.local_temp_directory, 'inputPath'))
         for file in self.model_run_parameters.output_s3_paths:
-            path = self.initializeDirectory(os.path.join(self.local_temp_directory, 'outputPaths', file))
+            path = self._prepareDirectory(os.path.join(self.local_temp_directory, 'outputPaths', file))
             local_directories['outputPaths'].update({file: path})
         return local_directories
 
+    @contextlib.contextmanager
+    def _quietCapSession(self, on_error):
+        """
+        Disable cap_session logging while on_error='ignore' transfers are in progress
+        :note: counts overlapping transfers, so that concurrent calls restore the logger's original state exactly once
+        """
+        if on_error != 'ignore':
+            yield
+            return
+        logger = self.cap_session.logger
+        with self._quiet_lock:
+            if self._quiet_transfers == 0:
+                self._cap_session_logger_disabled = logger.disabled
+            self._quiet_transfers += 1
+            logger.disabled = True
+        try:
+            yield
+        finally:
+            with self._quiet_lock:
+                self._quiet_transfers -= 1
+                if self._quiet_transfers == 0:
+                    logger.disabled = self._cap_session_logger_disabled  # Reset cap_session.logger
+
     def _downloadObject(self, download_key, local_file_path, on_error='log', is_multipart=False):
-        """Fetch object or multipart objects from S3 key"""
+        """
+        Fetch object or multipart objects from S3 key
+        :note: with deadlines, retries and hedging (see transfer.TransferScheduler). Every attempt downloads to a file of its own, the
+               first to succeed is moved to local_file_path
+        """
         download_key_string = f'part files in {download_key}' if is_multipart else download_key
         file_name = os.path.splitext(os.path.basename(local_file_path))[0]
+
+        def download(attempt):
+            attempt_path = f'{local_file_path}.{attempt}.part'
+            try:
+                if is_multipart:
+                    self.cap_session.s3_download_part_files(download_key, attempt_path)
+                else:
+                    self.cap_session.s3_download_file(download_key, attempt_path)
+            except Exception:
+                self._removeFile(attempt_path)
+                raise
+            return attempt_path
+
         try:
-            # Disable cap_session logging if on_error='ignore'
-            cap_session_logger_disabled = self.cap_session.logger.disabled
-            self.cap_session.logger.disabled = on_error == 'ignore' or cap_session_logger_disabled
-            if is_multipart:
-                self.cap_session.s3_download_part_files(download_key, local_file_path)
-            else:
-                self.cap_session.s3_download_file(download_key, local_file_path)
-            self.cap_session.logger.disabled = cap_session_logger_disabled  # Reset cap_session.logger
+            with self._quietCapSession(on_error):  # Disable cap_session logging if on_error='ignore'
+                attempt_path = self.transfers.run(download_key, download, size=_fileSize, direction='download', discard=self._removeFile)
+            os.replace(attempt_path, local_file_path)
             self.logger.info(f'Successfully downloaded {download_key_string} to {local_file_path}')
             return {file_name: local_file_path}
         except Exception as e:
-            self.cap_session.logger.disabled = cap_session_logger_disabled  # Reset cap_session.logger
             self.logger.debug(e, exc_info=True)
             if on_error == 'raise':
                 self.logger.error(f'Error downloading {download_key_string} to {local_file_path}')
@@ -90,10 +292,24 @@ class IOSession:
                 self.logger.warning(f'Error downloading {download_key_string} to {local_file_path}')
             return {}
 
-    def deleteTempDirectories(self, on_error='log'):
-        """Remove top level temp directory"""
+    def _removeFile(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _tempEntries(self):
+        with os.scandir(self.local_temp_directory) as entries:
+            return [entry.path for entry in entries]
+
+    def deleteTempDirectories(self, on_error='log', mode=None):
+        """
+        Remove top level temp directory (or only its contents, if it was given to be reused), off the critical path:
+        the directory is renamed into a trash directory and deleted in the background
+        :param mode: 'process', 'thread' or 'sync' (see trash.deletePaths)
+        """
         try:
-            shutil.rmtree(self.local_temp_directory)
+            trash.trash([self.local_temp_directory] if self._owns_temp_directory else self._tempEntries(), mode=mode)
             self.logger.info(f'Successfuly deleted temporary directory: {self.local_temp_directory}')
         except Exception as e:
             self.logger.debug(e, exc_info=True)
@@ -106,16 +322,17 @@ class IOSession:
                 self.logger.warning(f'Error deleting temporary directory: {self.local_temp_directory}')
 
     def _uploadFile(self, local_file_path, upload_key, on_error='log'):
-        """Upload local file object to S3 bucket associated with cap_session tenant"""
+        """
+        Upload local file object to S3 bucket associated with cap_session tenant
+        :note: with deadlines, retries and hedging (see transfer.TransferScheduler). Attempts upload the same content to the same key
+        """
         try:
-            # Disable cap_session logging if on_error='ignore'
-            cap_session_logger_disabled = self.cap_session.logger.disabled
-            self.cap_session.logger.disabled = on_error == 'ignore' or cap_session_logger_disabled
-            self.cap_session.s3_upload_file(local_file_path, upload_key)
-            self.cap_session.logger.disabled = cap_session_logger_disabled  # Reset cap_session.logger
+            with self._quietCapSession(on_error):  # Disable cap_session logging if on_error='ignore'
+                self.transfers.run(upload_key, lambda attempt: self.cap_session.s3_upload_file(local_file_path, upload_key),
+                                   size=os.path.getsize(local_file_path), direction='upload')
             self.logger.info(f'Successfully uploaded {os.path.basename(local_file_path)} to {upload_key}')
+            return True
         except Exception as e:
-            self.cap_session.logger.disabled = cap_session_logger_disabled  # Reset cap_session.logger
             self.logger.debug(e, exc_info=True)
             if on_error == 'raise':
                 self.logger.error(f'Error uploading {local_file_path} to {upload_key}')
@@ -124,14 +341,28 @@ class IOSession:
                 pass
             else:
                 self.logger.warning(f'Error uploading {local_file_path} to {upload_key}')
+            return False
 
     def initializeDirectory(self, directory):
-        """Create or overwrite (clear) specified directory"""
+        """Create or overwrite (clear) specified directory, moving any existing contents to trash to be deleted in the background"""
+        try:
+            with os.scandir(directory) as entries:
+                if next(entries, None) is None:
+                    return directory  # Already exists and is empty
+        except (FileNotFoundError, NotADirectoryError):
+            pass
         self.logger.debug(f'Clearing directory {directory}')
-        shutil.rmtree(directory, ignore_errors=True)
+        trash.trash([directory])
         os.makedirs(directory, exist_ok=True)
         return directory
 
+    def _prepareDirectory(self, directory):
+        """Initialize directory (see initializeDirectory), keeping its contents if the run is resumed from a checkpoint"""
+        if self.resumed:
+            os.makedirs(directory, exist_ok=True)
+            return directory
+        return self.initializeDirectory(directory)
+
     def _safeCopyFile(self, from_file, to_file, on_error='log'):
         """
         Copy a local file to a new directory, regardless whether given directory exists
@@ -162,36 +393,43 @@ class IOSession:
         """
         file_dict = {}
         try:
-            for file in os.listdir(directory):
-                file_name = os.path.splitext(file)[0]
-                file_path = os.path.join(directory, file)
-                if os.path.isfile(file_path):
-                    file_dict.update({file_name: file_path})
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        file_dict.update({os.path.splitext(entry.name)[0]: entry.path})
         except FileNotFoundError as e:
             self.logger.warning(f'Not found: {directory}')
             self.logger.debug(e, exc_info=True)
         return file_dict
 
-    def createFileDicts(self, directory):
+    def createFileDicts(self, directory, changed_only=False):
         """
         Creates a list of dictionaries of files in a given directory
         :param directory: path to a directory to create dictionaries from
+        :param changed_only: If True, skip files staged or uploaded by this session that have not changed since (per manifest)
         :return: list of one or more dictionaries of form {file_name_wo_ext: file_path}
         :rtype: list(dict)
         """
         file_dicts = [{}]
-        all_paths = gg(os.path.join(os.path.abspath(directory), '**'), recursive=True)
-        all_files = [path for path in all_paths if os.path.isfile(path)]
-        for file in all_files:
+        for file_path, stat in _scanFiles(os.path.abspath(directory)):
+            if changed_only and self.manifest.isUnchanged(file_path, stat=stat):
+                self.logger.debug(f'Skipping unchanged file: {file_path}')
+                continue
+            if self.manifest.get(file_path) is None:
+                self.manifest.record(file_path, 'written', stat)
             file_dict = file_dicts[-1]
-            file_name = os.path.splitext(os.path.basename(file))[0]
-            file_path = os.path.abspath(file)
+            file_name = os.path.splitext(os.path.basename(file_path))[0]
             if file_name in file_dict:
                 file_dicts.append({})
                 file_dict = file_dicts[-1]
             file_dict[file_name] = file_path
         return file_dicts if file_dicts != [{}] else []
 
+    def stageDirectory(self, directory):
+        """Record all files in a directory tree as staged, so that createFileDicts(changed_only=True) skips them (e.g., intermediate files)"""
+        for file_path, stat in _scanFiles(os.path.abspath(directory)):
+            self.manifest.record(file_path, 'staged', stat)
+
     def getModelRunParameters(self, mrp_json_path):
         """
         Fetch modelRunParameter.json (named whatever) from given local path or S3 key
@@ -203,23 +441,40 @@ class IOSession:
             file = self._safeCopyFile(mrp_json_path, model_run_parameters_path, on_error='raise')
         else:
             file = self._downloadObject(mrp_json_path, model_run_parameters_path, on_error='raise')
+        self.manifest.record(model_run_parameters_path, 'staged')
         with open(model_run_parameters_path, 'r') as f:
             model_run_parameters_json = json.load(f)
         self.logger.debug(f'Contents of {os.path.basename(mrp_json_path)}:\n{model_run_parameters_json}')
         return ModelRunParameters(model_run_parameters_json, file)
 
-    def getSourceInputFiles(self, require=[], optional=[]):
+    def getSourceInputFiles(self, require=[], optional=[], project=False):
         """
         Fetch model input files specified in MRP from given local path or S3 bucket
         :param require: List of files that will raise an error if missing
         :param optional: List of files that will not raise or log an error if missing
+        :param project: If True, staged files are cut down to the columns in self.required_columns (from model metadata)
         :note: args are optional. Errors will by default be logged only
         :return: dictionary of form {file_name_wo_ext: local_file_path}
         """
+        input_files = {}
+        for remote_file_path, local_file_path, on_error in self.inputSpecs(require, optional):
+            input_files.update(self._fetchInput(remote_file_path, local_file_path, on_error))
+        if project:
+            for name in self.projectedInputs(input_files):
+                mapping.projectCsv(input_files[name], self.required_columns[name])
+        for file_path in input_files.values():
+            self.manifest.record(file_path, 'staged')
+        return input_files
+
+    def inputSpecs(self, require=[], optional=[]):
+        """
+        Source and local paths of the model input files specified in MRP (see getSourceInputFiles)
+        :return: list of tuples (remote_file_path, local_file_path, on_error), where remote_file_path is a local path in local mode
+        """
         source_input_directory = self.local_directories.get('inputPath')
         os.makedirs(source_input_directory, exist_ok=True)
         file_names = [f'{fn}.csv' for fn in {**self.model_run_parameters.input_data, **self.model_run_parameters.supporting_data}]
-        input_files = {}
+        input_specs = []
         for file_name in file_names:
             local_file_path = os.path.join(source_input_directory, file_name)
             if file_name in require:
@@ -230,40 +485,105 @@ class IOSession:
                 on_error = 'log'
             if self.local_mode:
                 remote_file_path = os.path.join(self.input_path, file_name)
-                file = self._safeCopyFile(remote_file_path, local_file_path, on_error=on_error)
             else:
                 remote_file_path = f'{self.input_path}/{file_name}'
-                file = self._downloadObject(remote_file_path, local_file_path, on_error=on_error)
-            input_files.update(file)
-        return input_files
+            input_specs.append((remote_file_path, local_file_path, on_error))
+        return input_specs
+
+    def _fetchInput(self, remote_file_path, local_file_path, on_error='log'):
+        """Copy (local mode) or download one input file. :return: dictionary of form {file_name_wo_ext: local_file_path}"""
+        if self.local_mode:
+            return self._safeCopyFile(remote_file_path, local_file_path, on_error=on_error)
+        return self._downloadObject(remote_file_path, local_file_path, on_error=on_error)
+
+    def projectedInputs(self, input_files):
+        """:return: names of input files that have required columns in model metadata (see getSourceInputFiles project flag)"""
+        names = [name for name in input_files if name in self.required_columns]
+        for name in names:
+            self.logger.info(f'Projecting {name} to columns required by model: {self.required_columns[name]}')
+        return names
+
+    def uploadDestination(self, file, file_path, scenario_name=None):
+        """
+        Destination of an uploaded file, consistent with ImpairmentStudio expectations (see uploadFiles)
+        :return: local file path in test folder output if run in local mode, else S3 key
+        """
+        ext = os.path.splitext(file_path)[1]
+        out_path = self.model_run_parameters.output_s3_paths.get(file)
+        if self.local_mode:
+            if out_path and scenario_name:
+                return os.path.join(self.test_folder_output, file, f'scenarioPartition={scenario_name}', f'{DATA_FILE_NAME}{ext}')
+            elif out_path:
+                return os.path.join(self.test_folder_output, file, f'{DATA_FILE_NAME}{ext}')
+            return os.path.join(self.test_folder_output, 'log', os.path.basename(file_path))
+        if out_path and scenario_name:
+            return f'{out_path}/scenarioPartition={scenario_name}/{DATA_FILE_NAME}{ext}'
+        elif out_path:
+            return f'{out_path}/{DATA_FILE_NAME}{ext}'
+        return f'{self.model_run_parameters.log_s3_path}/{os.path.basename(file_path)}'
+
+    def _remoteMd5(self, s3_key):
+        """:return: md5 of an S3 object from its ETag, or None if object is missing or was uploaded in parts"""
+        try:
+            etag = self.s3_client.head_object(Bucket=self.cap_session.context['s3_bucket'], Key=s3_key)['ETag'].strip('"')
+        except Exception as e:
+            self.logger.debug(f'No checksum for {s3_key}: {e}')
+            return None
+        return None if '-' in etag else etag  # Multipart ETags are not a hash of the content
 
-    def uploadFiles(self, files, scenario_name=None, on_error='log'):
+    def _isUploaded(self, destination, md5, size):
+        """Whether destination already holds content with the given md5, per upload manifest, remote checksum or local copy"""
+        if self.local_mode:
+            return os.path.isfile(destination) and os.path.getsize(destination) == size and fileMd5(destination) == md5
+        prior = self.upload_manifest.get(self._manifestKey(destination))
+        if prior is not None and prior['md5'] == md5 and prior['size'] == size:
+            return True
+        return self._remoteMd5(destination) == md5
+
+    def _manifestKey(self, destination):
+        return destination if self.local_mode else f's3://{self.cap_session.context["s3_bucket"]}/{destination}'
+
+    def _addMetrics(self, **counts):
+        with self._metrics_lock:
+            for name, count in counts.items():
+                self.metrics[name] += count
+
+    def uploadFiles(self, files, scenario_name=None, on_error='log', skip_unchanged=False):
         """
         Upload files in a manner consistent with ImpairmentStudio expectations
+        :param skip_unchanged: If True, skip files whose content (md5) is already at the destination
         :note: if file name is found in MRP outputPaths, the correct outputPath will be used
         :note: if scenario is given, scenarioPartition will be added to the output path
         :note: if file name is not found in MRP outputPaths, file will be uploaded to logPath
         :note: if run in local mode, will upload to local test folder output in similar manner to above
+        :note: skipped and uploaded files and bytes are counted in self.metrics
+        :note: with a checkpoint, uploads are recorded in it, and files uploaded before resuming are skipped if unchanged
         """
         for file, file_path in files.items():
-            ext = os.path.splitext(file_path)[1]
-            out_path = self.model_run_parameters.output_s3_paths.get(file)
+            destination = self.uploadDestination(file, file_path, scenario_name)
+            size = os.path.getsize(file_path) if os.path.isfile(file_path) else 0
+            if self.checkpoint is not None and self.checkpoint.isUploaded(destination, file_path):
+                self.logger.info(f'Skipping upload of {os.path.basename(file_path)} to {destination}, completed before resuming')
+                self.manifest.record(file_path, 'uploaded')
+                self._addMetrics(skipped_files=1, skipped_bytes=size)
+                continue
+            md5 = fileMd5(file_path) if skip_unchanged and size else None
+            if md5 and self._isUploaded(destination, md5, size):
+                self.logger.info(f'Skipping upload of unchanged {os.path.basename(file_path)} to {destination}')
+                self.manifest.record(file_path, 'uploaded')
+                self._addMetrics(skipped_files=1, skipped_bytes=size)
+                continue
             if self.local_mode:
-                if out_path and scenario_name:
-                    dest_path = os.path.join(self.test_folder_output, file, f'scenarioPartition={scenario_name}', f'data{ext}')
-                elif out_path:
-                    dest_path = os.path.join(self.test_folder_output, file, f'data{ext}')
-                else:
-                    dest_path = os.path.join(self.test_folder_output, 'log', os.path.basename(file_path))
-                self._safeCopyFile(file_path, dest_path, on_error=on_error)
+                uploaded = bool(self._safeCopyFile(file_path, destination, on_error=on_error))
             else:
-                if out_path and scenario_name:
-                    s3_key = f'{out_path}/scenarioPartition={scenario_name}/data{ext}'
-                elif out_path:
-                    s3_key = f'{out_path}/data{ext}'
-                else:
-                    s3_key = f'{self.model_run_parameters.log_s3_path}/{os.path.basename(file_path)}'
-                self._uploadFile(file_path, s3_key, on_error=on_error)
+                uploaded = self._uploadFile(file_path, destination, on_error=on_error)
+            if uploaded:
+                self.manifest.record(file_path, 'uploaded')
+                self._addMetrics(uploaded_files=1, uploaded_bytes=size)
+                if self.checkpoint is not None:
+                    self.checkpoint.recordUpload(destination, file_path)
+                if md5:
+                    self.upload_manifest.put(self._manifestKey(destination), md5, size)
 
     def writeFileObjectToDisk(self, file_object, file_name, directory=None):
         """
@@ -279,8 +599,43 @@ class IOSession:
         with open(file_path, 'wb') as f:
             self.logger.info(f'Writing file: {file_name}')
             f.write(file_object)
+        self.manifest.record(file_path, 'written')
         return file_path
 
+    @property
+    def s3_client(self):
+        """S3 client associated with cap_session tenant, created on first use"""
+        if self._s3_client is None and self.session_pool is not None:
+            self._s3_client = self.session_pool.getS3Client(self.cap_session)
+        elif self._s3_client is None:
+            self._s3_client = self.cap_session.init_s3_client()
+        return self._s3_client
+
+    def listRemoteKeys(self, prefix):
+        """
+        Lazily list all S3 keys under a prefix in the cap_session tenant bucket (not limited to 1000 keys)
+        :return: generator of keys
+        """
+        return s3prefix.iterKeys(self.s3_client, self.cap_session.context['s3_bucket'], prefix)
+
+    def clearRemotePrefixes(self, prefixes, on_error='log'):
+        """
+        Delete all S3 objects under the given prefixes, clearing prefixes in parallel
+        :return: dictionary of form {prefix: [deleted keys]}
+        """
+        try:
+            return s3prefix.clearPrefixes(self.s3_client, self.cap_session.context['s3_bucket'], prefixes)
+        except Exception as e:
+            self.logger.debug(e, exc_info=True)
+            if on_error == 'raise':
+                self.logger.error(f'Error clearing S3 prefixes: {prefixes}')
+                raise
+            elif on_error == 'ignore':
+                pass
+            else:
+                self.logger.warning(f'Error clearing S3 prefixes: {prefixes}')
+            return {}
+
     def copyTempFilesToDominoWorkSpace(self):
         # TODO: Create this method
         pass
@@ -0,0 +1,110 @@
+import logging
+import os
+
+
+MEMORY_BUDGET_VARIABLE = 'MOODYS_MEMORY_BUDGET_MB'
+AUTO = 'auto'
+AUTO_FRACTION = 0.8  # Of the container (or machine) memory, leaving headroom for the interpreter, page cache and child processes
+CGROUP_LIMIT_PATHS = ['/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes']  # cgroup v2, v1
+MEGABYTE = 1024 * 1024
+SAMPLE_ROWS = 1000
+MINIMUM_ROWS = 1000  # Smaller chunks cost more in per-chunk overhead (and engine start-up) than they save in memory
+
+
+def systemMemoryLimit():
+    """:return: memory available to this process in bytes: the container (cgroup) limit if set, else physical memory, or None if unknown"""
+    limits = []
+    for path in CGROUP_LIMIT_PATHS:
+        try:
+            with open(path) as f:
+                limits.append(int(f.read().strip()))  # 'max' (no limit) raises ValueError
+        except (OSError, ValueError):
+            pass
+    try:
+        limits.append(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES'))  # cgroup v1 reports 'no limit' as a huge number
+    except (AttributeError, OSError, ValueError):
+        pass
+    return min(limits) if limits else None
+
+
+def residentMemory():
+    """:return: resident memory of this process in bytes (peak resident memory where current is unknown), or None if unknown"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource  # Unix only
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Kilobytes on Linux
+    except (ImportError, OSError):
+        return None
+
+
+class MemoryBudget:
+    """
+    Memory a model run may use, for sizing chunks and shards so that large inputs run slower instead of being OOM-killed
+
+    :param limit_mb: budget in megabytes, 'auto' (AUTO_FRACTION of systemMemoryLimit()) or 0 (no budget)
+                     (default: MOODYS_MEMORY_BUDGET_MB environment variable, else 'auto')
+    """
+
+    def __init__(self, limit_mb=None):
+        self.logger = logging.getLogger(__name__)
+        limit_mb = limit_mb if limit_mb is not None else os.environ.get(MEMORY_BUDGET_VARIABLE) or AUTO
+        if str(limit_mb).strip().lower() == AUTO:
+            system_limit = systemMemoryLimit()
+            self.limit = int(system_limit * AUTO_FRACTION) if system_limit else None
+        else:
+            self.limit = int(float(limit_mb) * MEGABYTE) or None
+        self.logger.debug(f'Memory budget: {self.limit // MEGABYTE if self.limit else "unlimited"} MB')
+
+    def used(self):
+        """:return: resident memory of this process in bytes (0 if unknown)"""
+        return residentMemory() or 0
+
+    def available(self):
+        """:return: bytes left in the budget (None if there is no budget)"""
+        return max(self.limit - self.used(), 0) if self.limit else None
+
+    def exceeded(self):
+        return self.limit is not None and self.used() > self.limit
+
+    def fits(self, n_bytes, fraction=1.0):
+        """:return: True if n_bytes fit in a fraction of the bytes left in the budget"""
+        available = self.available()
+        return available is None or n_bytes <= available * fraction
+
+    def rowsWithin(self, bytes_per_row, maximum, fraction=0.25, minimum=MINIMUM_ROWS):
+        """
+        :param bytes_per_row: memory used per row (e.g., from estimateCsvMemory)
+        :param maximum: number of rows to return if there is no budget (e.g., configured shard rows)
+        :param fraction: fraction of the bytes left in the budget that the rows may use (copies made while converting and writing
+                         them come out of the rest)
+        :param minimum: number of rows to return however little is left
+        :return: number of rows that fit in the budget, between minimum and maximum
+        """
+        available = self.available()
+        if available is None or bytes_per_row <= 0:
+            return maximum
+        return max(min(int(available * fraction / bytes_per_row), maximum), min(minimum, maximum))
+
+
+def estimateCsvMemory(csv_path, read_sample, sample_rows=SAMPLE_ROWS):
+    """
+    Estimate the memory a .csv file takes once read, from a sample of rows at its start
+    :param read_sample: function reading nrows rows of csv_path to a data frame (with the dtypes the full read will use)
+    :return: tuple of (bytes_per_row, estimated_rows)
+    """
+    sample = read_sample(nrows=sample_rows)
+    n_sample = len(sample.index)
+    if n_sample == 0:
+        return 0, 0
+    bytes_per_row = sample.memory_usage(index=True, deep=True).sum() / n_sample
+    with open(csv_path, 'rb') as f:
+        f.readline()  # Header
+        data_start = f.tell()
+        sample_bytes = sum(len(f.readline()) for _ in range(n_sample))
+    rows = (os.path.getsize(csv_path) - data_start) * n_sample / max(sample_bytes, 1)
+    return bytes_per_row, int(round(rows))
+
@@ -1,13 +1,34 @@
+from mapping import dtypeplan
+from mapping import handoff
+from mapping import indexedcsv
 from mapping import mapping
-from moodyscappy import Cappy
+from mapping import validation
+import checkpoint
+import functools
 import instrumenterror
 import iosession
 import json
 import logging
+import memorybudget
 import os
+import pandas as pd
+import sessionpool
+import shutil
 import subprocess
 
 
+SCORING_CACHE_PATH_VARIABLE = 'MOODYS_SCORING_CACHE_PATH'
+SCORING_CACHE_SIZE_VARIABLE = 'MOODYS_SCORING_CACHE_SIZE'
+DEFAULT_SCORING_CACHE_SIZE = 100000
+DATA_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'data')
+INDEXED_OUTPUTS_VARIABLE = 'MOODYS_INDEXED_OUTPUTS'  # Comma-separated output categories to write sorted and indexed by instrumentidentifier
+SHARD_ROWS_VARIABLE = 'MOODYS_SHARD_ROWS'
+DEFAULT_SHARD_ROWS = 100000
+SHARD_COLUMN = '_shard'  # Shard number of joined instrumentError rows, their position if spilled
+FINAL_STEP = 'uploads'  # Checkpointed step after which a failed run is not worth resuming (see cleanUp)
+ENGINE_OUTPUTS = ['instrumentRiskMetric']  # Output categories written by run_model.R, written header-only if no shard reached the engine
+
+
 class Model:
     """
     Main model class.
@@ -16,18 +37,31 @@ class Model:
     :param proxy_credentials: Dictionary with valid javaScript web token or username and password
     :param model_run_parameters_path: S3 key or local path to model run parameters configuration file (e.g., modelRunParameter.json)
     :param local_mode: (Boolean) True if model_run_parameters_path is stored in an s3 bucket, else False if a file stored locally
+    :param session_pool: sessionpool.SessionPool to reuse authenticated sessions from (default: process-wide pool)
+    :param run_id: optional name isolating this run's instrumentError handler from other runs in the same process
+    :param temp_directory: optional local temp directory to reuse (e.g., across batch runs), instead of creating one
+    :param resume: If True, resume from the checkpoint of an earlier failed run of the same model run parameters (see checkpoint.py)
     """
 
-    def __init__(self, credentials, proxy_credentials, model_run_parameters_path, local_mode=False):
+    def __init__(self, credentials, proxy_credentials, model_run_parameters_path, local_mode=False, session_pool=None, run_id=None,
+                 temp_directory=None, resume=False):
         # Create module's logger and session managers
         self.logger = logging.getLogger(__name__)
         self.logger.info(f'Running in local mode: {local_mode}')
-        self.cap_session = Cappy(**credentials, errors='raise')
-        self.io_session = iosession.IOSession(self.cap_session, model_run_parameters_path, local_mode)
+        self.session_pool = session_pool or sessionpool.getSessionPool()
+        self.cap_session = self.session_pool.getSession(credentials, errors='raise')
+        self.checkpoint = checkpoint.RunCheckpoint(checkpoint.checkpointId(model_run_parameters_path), resume=resume)
+        self.io_session = iosession.IOSession(self.cap_session, model_run_parameters_path, local_mode, session_pool=self.session_pool,
+                                              temp_directory=temp_directory, checkpoint=self.checkpoint)
+        self.failed = False
+        self.memory_budget = memorybudget.MemoryBudget()
         self.model_run_parameters = self.io_session.model_run_parameters
-        self.instrument_error = instrumenterror.getErrorHandler()
+        self.run_id = run_id
+        self.instrument_error = instrumenterror.getErrorHandler(run_id or instrumenterror.DEFAULT_NAME)
+        analysis_date = min(self.model_run_parameters.reporting_date, self.model_run_parameters.run_date)  # As in TransformData
+        self.validator = validation.loadInstrumentValidator(DATA_DIRECTORY, analysis_date)
         if proxy_credentials:
-            self.proxy_cap_session = Cappy(**proxy_credentials, errors='log')
+            self.proxy_cap_session = self.session_pool.getSession(proxy_credentials, errors='log')
 
     def run(self):
         ################## DELETE BELOW THIS LINE AND WRITE YOUR OWN MODEL RUN SCRIPT ##################
@@ -36,32 +70,62 @@ class Model:
             self.logger.info(f'Running model: {self.model_run_parameters.name}')
 
             # Fetch the input files specified in model run parameters from S3 and store in a temp directory
-            input_files = self.io_session.getSourceInputFiles(require=['instrumentReference.csv'], optional=['portfolioReference.csv'])
+            # A resumed run reuses the inputs staged before it failed (see self.checkpoint)
+            staged = self.checkpoint.details('inputs') if self.io_session.resumed else None
+            if staged and all(os.path.isfile(file_path) for file_path in staged['files'].values()):
+                input_files = staged['files']
+                for file_path in input_files.values():
+                    self.io_session.manifest.record(file_path, 'staged')
+            else:
+                input_files = self.io_session.getSourceInputFiles(require=['instrumentReference.csv'], optional=['portfolioReference.csv'])
+                self.checkpoint.complete('inputs', files=input_files)
             instrument_reference_path = input_files.get('instrumentReference')
 
-            # Read a CSV using mapping helper function (helpfully handles dtypes that pandas struggles with, and is case-insensitive)
-            dtypes = {'reportingdate': 'datetime64[ns]', 'foreclosed': 'bool'}
-            instrument_reference = mapping.readCsvWithCorrectDtypes(instrument_reference_path, dtypes)
+            # Score instruments in shards of at most shard_rows rows, read one at a time. Shards are made smaller if they would not fit
+            # the memory budget (MOODYS_MEMORY_BUDGET_MB). Each completed shard is checkpointed, so a resumed run only scores the rest
+            sharding = self.checkpoint.details('sharding') if self.io_session.resumed else None
+            if sharding is None or sharding.get('shards') is None or len(self.checkpoint.shards('scoring')) < sharding['shards']:
+                # Read a CSV using mapping helper function (helpfully handles dtypes that pandas struggles with, and is case-insensitive)
+                # Dtypes of other inputData attributes are planned from a sample of the file (and persisted for later runs)
+                # Only columns the model needs (inputData attributes in meta/model.json) are read, if listed there, plus the
+                # identifiers validation errors are reported with
+                dtypes = {'reportingdate': 'datetime64[ns]', 'foreclosed': 'bool'}
+                columns = self.io_session.required_columns.get('instrumentReference')
+                if columns:
+                    columns = [*columns, *(column for column in validation.ERROR_ATTRIBUTES if column not in {name.lower() for name in columns})]
+                attributes = columns or self.model_run_parameters.input_data.get('instrumentReference')
+                read = functools.partial(dtypeplan.readCsvWithPlannedDtypes, instrument_reference_path, 'instrumentReference', attributes, dtypes,
+                                         usecols=columns)
+                shard_rows = sharding['rows'] if sharding else self.shardRows(instrument_reference_path, read)
+                self.checkpoint.complete('sharding', rows=shard_rows, shards=None)
+                shards = dtypeplan.readCsvChunksWithPlannedDtypes(instrument_reference_path, 'instrumentReference', shard_rows, attributes, dtypes,
+                                                                  usecols=columns)
+                shard = -1
+                for shard, instrument_reference in enumerate(shards):
+                    if self.checkpoint.isShardComplete('scoring', shard):
+                        self.logger.info(f'Skipping shard {shard}, scored before resuming')
+                        continue
+                    self.scoreShard(shard, instrument_reference)
+                    del instrument_reference  # Release the shard before reading the next one
+                    self.checkMemory()
+                self.checkpoint.complete('sharding', rows=shard_rows, shards=shard + 1)
 
-            # Create a new modelRunParameter.json file with local directories in settings
-            # It is strongly recommended to not do this unless your model code actually needs it
-            new_mrp = self.createLocalModelRunParameters()
+            # Merge shard outputs into the local outputPaths (engine errors are joined to instrumentError)
+            self.mergeShards(input_files)
 
-            # Run PIT Converter script
-            this_directory_path = os.path.abspath(os.path.dirname(__file__))
-            r_script_path = os.path.join(this_directory_path, '..', '..', 'bin', 'run_model.R')
-            subprocess.run(['Rscript', r_script_path, '-p', new_mrp, '-l', os.path.dirname(os.path.dirname(r_script_path))], stdout=subprocess.PIPE)
-
-            # Upload input, output, and intermediate files back to S3 (or test folder if running in local mode)
-            all_files = self.io_session.createFileDicts(self.io_session.local_temp_directory)
+            # Upload new or changed output and intermediate files back to S3 (or test folder if running in local mode)
+            # Staged inputs that were not modified are skipped (see io_session.manifest)
+            all_files = self.io_session.createFileDicts(self.io_session.local_temp_directory, changed_only=True)
             for file_dict in all_files:
-                self.io_session.uploadFiles(file_dict)
+                self.io_session.uploadFiles(file_dict, skip_unchanged=True)
+            self.checkpoint.complete(FINAL_STEP)  # Nothing left to resume from here on
 
             # By example, raise an exception and see it in instrumentError output
             raise Exception('Oops something went wrong!')
 
         except Exception as e:
             # Log exception and add a row in instrumentError mapping
+            self.failed = True
             self.logger.error('An exception occurred while running the model')
             self.logger.error(e, exc_info=True)
             self.instrument_error.entry(e)
@@ -75,19 +139,206 @@ class Model:
 
         ################## DELETE ABOVE THIS LINE AND WRITE YOUR OWN MODEL RUN SCRIPT ##################
 
-    def createLocalModelRunParameters(self): # TODO: Delete this function if you are not going to use it
-        """Copy modelRunParameter.json, replacing input/output/log paths with local temp directories"""
+    def scoreShard(self, shard, instrument_reference):
+        """
+        Run the model engine (run_model.R) on one shard of instruments, in a shard directory of its own, and checkpoint it
+        :param shard: shard number
+        :param instrument_reference: data frame of the shard's instruments
+        """
+        shard_directory = self.io_session.initializeDirectory(self.shardDirectory(shard))  # Clears output of an interrupted attempt
+
+        # Report instruments that would fail required attribute, model code or DD date range checks without handing them to the engine
+        # Errors are written with the shard's outputs, and joined to instrumentError in one go by mergeShards
+        instrument_reference, errors = self.validator.validate(instrument_reference)
+        if len(errors.index) > 0:
+            self.logger.info(f'{len(errors.index)} instruments of shard {shard} failed validation')
+            error_path = os.path.join(shard_directory, 'outputPaths', 'instrumentError')
+            os.makedirs(error_path, exist_ok=True)
+            mapping.writeCsv(errors, os.path.join(error_path, 'validationError.csv'), max_workers=1)
+        if instrument_reference.empty:
+            self.checkpoint.completeShard('scoring', shard)
+            return
+        self.logger.info(f'Scoring shard {shard} ({len(instrument_reference.index)} instruments)')
+
+        # Hand the typed frame to the R script (as feather if pyarrow is installed), so the input is parsed only once
+        handoff_settings = self.handOffFrames({'instrumentReference': instrument_reference}, directory=os.path.join(shard_directory, 'handoff'))
+
+        # Create a new modelRunParameter.json file with the shard's output directories in settings
+        # inputPath stays on the staged inputs, the shard's instruments are read from settings.handoff
+        # It is strongly recommended to not do this unless your model code actually needs it
+        output_paths = {name: os.path.join(shard_directory, 'outputPaths', name) for name in self.io_session.local_directories['outputPaths']}
+        local_directories = {**self.io_session.local_directories, 'outputPaths': output_paths}
+        new_mrp = self.createLocalModelRunParameters(handoff_settings, local_directories=local_directories, directory=shard_directory)
+
+        # Run PIT Converter script
+        this_directory_path = os.path.abspath(os.path.dirname(__file__))
+        r_script_path = os.path.join(this_directory_path, '..', '..', 'bin', 'run_model.R')
+        result = subprocess.run(['Rscript', r_script_path, '-p', new_mrp, '-l', os.path.dirname(os.path.dirname(r_script_path))], stdout=subprocess.PIPE)
+        if result.returncode != 0:
+            raise RuntimeError(f'Model engine failed on shard {shard} with exit code {result.returncode}')
+
+        # Results handed back as feather are written to the shard's outputPaths as csv
+        self.collectHandedOffFrames(handoff_settings, output_paths=output_paths)
+        self.checkpoint.completeShard('scoring', shard)
+
+    def shardDirectory(self, shard):
+        return os.path.join(self.io_session.local_temp_directory, 'shards', str(shard))
+
+    def shardRows(self, csv_path, read_sample):
+        """
+        Choose the number of rows per shard: MOODYS_SHARD_ROWS, or fewer if a shard of that many rows would not fit the memory budget
+        :param read_sample: function reading nrows rows of csv_path to a data frame
+        :note: if the whole file would not fit the memory budget, instrumentError entries are spilled to disk (see checkMemory)
+        """
+        shard_rows = int(os.environ.get(SHARD_ROWS_VARIABLE) or DEFAULT_SHARD_ROWS)
+        bytes_per_row, rows = memorybudget.estimateCsvMemory(csv_path, read_sample)
+        budget_rows = self.memory_budget.rowsWithin(bytes_per_row, shard_rows)
+        if budget_rows < shard_rows:
+            self.logger.info(f'Scoring in shards of {budget_rows} rows ({bytes_per_row:.0f} bytes per row) to fit memory budget of '
+                             f'{self.memory_budget.limit // memorybudget.MEGABYTE} MB')
+        if not self.memory_budget.fits(bytes_per_row * rows):
+            self.spillErrors()
+        return budget_rows
+
+    def checkMemory(self):
+        """Spill instrumentError entries to disk if the memory budget is exceeded, so that the rest of the run holds less in memory"""
+        if self.memory_budget.exceeded():
+            self.logger.warning(f'Memory budget exceeded ({self.memory_budget.used() // memorybudget.MEGABYTE} MB used of '
+                                f'{self.memory_budget.limit // memorybudget.MEGABYTE} MB)')
+            self.spillErrors()
+
+    def spillErrors(self):
+        if self.instrument_error.enableSpill():  # No-op if already spilling
+            self.logger.info('Spilling instrumentError entries to disk')
+
+    def mergeShards(self, input_files):
+        """
+        Merge the outputs of all shards into the local outputPaths, in shard order
+        :param input_files: staged input files. Inputs in outputPaths (e.g., instrumentReference) are copied from the staged input, whether
+                            or not the engine ran (e.g., if all instruments failed validation)
+        :note: instrumentError outputs (engine and validation errors) are joined to self.instrument_error in one go, which writes
+               instrumentError.csv on completion. If it spills, their shard numbers keep them in instrument order (see spillErrors)
+        :note: categories in MOODYS_INDEXED_OUTPUTS are sorted by instrumentidentifier, with an index for random access (see indexedcsv)
+        :note: ENGINE_OUTPUTS without shard outputs are written header-only, with their outputData attributes
+        :note: shard files are recorded as staged in io_session.manifest, so that they are not uploaded
+        """
+        shard_directories = {shard: self.shardDirectory(shard) for shard in sorted(map(int, self.checkpoint.shards('scoring')))}
+        merged = self.checkpoint.isComplete('merge')
+        errors = []
+        indexed_outputs = {name.strip() for name in os.environ.get(INDEXED_OUTPUTS_VARIABLE, '').split(',') if name.strip()}
+        for name, output_path in self.io_session.local_directories['outputPaths'].items():
+            shard_files = {}
+            shard_numbers = {}
+            for shard, shard_directory in shard_directories.items():
+                shard_output_path = os.path.join(shard_directory, 'outputPaths', name)
+                for file_name in sorted(os.listdir(shard_output_path)) if os.path.isdir(shard_output_path) else []:
+                    shard_files.setdefault(file_name, []).append(os.path.join(shard_output_path, file_name))
+                    shard_numbers[os.path.join(shard_output_path, file_name)] = shard
+            if name in input_files and name != 'instrumentError':
+                if not merged:  # Else merged before resuming (and possibly uploaded)
+                    shutil.copyfile(input_files[name], os.path.join(output_path, os.path.basename(input_files[name])))
+                continue
+            if not shard_files and name in ENGINE_OUTPUTS and not merged:
+                columns = self.model_run_parameters.output_data.get(name, [])
+                mapping.writeCsv(pd.DataFrame(columns=columns), os.path.join(output_path, f'{name}.csv'), max_workers=1)
+            for file_name, file_paths in shard_files.items():
+                if name == 'instrumentError':
+                    errors.extend(mapping.readCsvWithCorrectDtypes(file_path).assign(**{SHARD_COLUMN: shard_numbers[file_path]})
+                                  for file_path in file_paths)
+                elif merged:
+                    continue  # Merged before resuming (and possibly uploaded)
+                elif name in indexed_outputs and file_name.endswith('.csv'):
+                    indexedcsv.writeIndexedCsv(file_paths, os.path.join(output_path, file_name))  # Uploaded with its index (data.idx)
+                else:
+                    mapping.concatenateCsv(file_paths, os.path.join(output_path, file_name))
+        if errors:
+            # One bulk write for all shards
+            self.instrument_error.joinDataFrame(pd.concat(errors, ignore_index=True, sort=False), order=[SHARD_COLUMN])
+        for shard_directory in shard_directories.values():
+            self.io_session.stageDirectory(shard_directory)
+        self.checkpoint.complete('merge')
+
+    def createLocalModelRunParameters(self, handoff_settings=None, local_directories=None, directory=None): # TODO: Delete this function if you are not going to use it
+        """
+        Copy modelRunParameter.json, replacing input/output/log paths with local temp directories
+        :param handoff_settings: optional handoff settings (see handOffFrames), stored in settings.handoff
+        :param local_directories: optional directories overriding io_session.local_directories (e.g., of a shard)
+        :param directory: directory to write localModelRunParameters.json to (default: temp directory)
+        """
         new_mrp = self.model_run_parameters.json.copy()
-        new_mrp['settings'] = new_mrp.get('settings', {})
-        new_mrp['settings'].update(self.io_session.local_directories)
-        new_mrp_path = os.path.join(self.io_session.local_temp_directory, 'localModelRunParameters.json')
+        new_mrp['settings'] = dict(new_mrp.get('settings', {}))
+        new_mrp['settings'].update(local_directories or self.io_session.local_directories)
+        new_mrp['settings']['inputColumns'] = self.io_session.required_columns  # Columns the R side needs to read
+        if handoff_settings:
+            new_mrp['settings']['handoff'] = handoff_settings
+        if os.environ.get(SCORING_CACHE_PATH_VARIABLE):
+            # Scores of distinct scoring tuples, kept by the R side across runs (least recently used evicted beyond size)
+            new_mrp['settings']['scoringCache'] = {'path': os.environ[SCORING_CACHE_PATH_VARIABLE],
+                                                   'size': int(os.environ.get(SCORING_CACHE_SIZE_VARIABLE) or DEFAULT_SCORING_CACHE_SIZE)}
+        new_mrp_path = os.path.join(directory or self.io_session.local_temp_directory, 'localModelRunParameters.json')
         with open(new_mrp_path, 'w') as f:
             json.dump(new_mrp, f)
         return new_mrp_path
 
+    def handOffFrames(self, data_frames, format=None, directory=None):
+        """
+        Write typed data frames to a handoff directory in the temp directory, for the model engine to read instead of the input csv files
+        :param data_frames: dictionary of form {input_category: data_frame}
+        :param format: 'feather' or 'csv' (default: feather if pyarrow is available)
+        :param directory: handoff directory (default: handoff in temp directory)
+        :note: handoff files are recorded as staged in io_session.manifest, so that they are not uploaded
+        :return: handoff settings of form {'format', 'inputs': {input_category: file_path}, 'outputPath'}
+        """
+        handoff_directory = directory or os.path.join(self.io_session.local_temp_directory, 'handoff')
+        inputs = {name: handoff.writeFrame(data_frame, os.path.join(handoff_directory, 'input'), name, format) for name, data_frame in data_frames.items()}
+        for file_path in inputs.values():
+            self.io_session.manifest.record(file_path, 'staged')
+        output_path = os.path.join(handoff_directory, 'output')
+        os.makedirs(output_path, exist_ok=True)
+        written = {os.path.splitext(file_path)[1] for file_path in inputs.values()}
+        format = handoff.FEATHER if written == {handoff.EXTENSIONS[handoff.FEATHER]} else handoff.CSV  # As written (see handoff.writeFrame)
+        return {'format': format, 'inputs': inputs, 'outputPath': output_path}
+
+    def collectHandedOffFrames(self, handoff_settings, output_paths=None):
+        """
+        Read results handed back by the model engine, writing each to its local outputPath as csv for upload
+        :param output_paths: optional outputPaths to write to instead of io_session's (e.g., of a shard). instrumentError is written there too
+        :note: otherwise, instrumentError results are joined to self.instrument_error, which writes instrumentError.csv on completion
+        :return: dictionary of form {output_category: data_frame}
+        """
+        frames = {}
+        for name, (file_path, data_frame) in handoff.readFrames(handoff_settings['outputPath']).items():
+            self.io_session.manifest.record(file_path, 'staged')
+            frames[name] = data_frame
+            if name == 'instrumentError' and output_paths is None:
+                self.instrument_error.joinDataFrame(data_frame)
+            elif name in (output_paths or self.io_session.local_directories['outputPaths']):
+                output_path = (output_paths or self.io_session.local_directories['outputPaths'])[name]
+                os.makedirs(output_path, exist_ok=True)
+                mapping.writeCsv(data_frame, os.path.join(output_path, f'{name}.csv'), float_format=mapping.CSV_FLOAT_FORMAT)
+            else:
+                self.logger.warning(f'Handed off output {name} is not in model run parameters outputPaths. Ignoring')
+        return frames
+
     def cleanUp(self, log_file=None, keep_temp=False):
-        """Delete temp directories and upload logfile and batch id file"""
-        if not keep_temp:
+        """
+        Delete temp directories and upload logfile and batch id file
+        :note: if the run failed before FINAL_STEP and its checkpoint is persistent, temp files are kept for resuming (see run.py --resume)
+        """
+        keep_checkpoint = self.failed and self.checkpoint.resumable(FINAL_STEP)
+        if keep_checkpoint:
+            self.logger.info(f'Keeping checkpoint {self.checkpoint.directory}. Run again with --resume to skip completed work')
+        elif not keep_temp:
             self.io_session.deleteTempDirectories()
+        self.logger.info(f'Upload metrics: {self.io_session.metrics}')  # Before the log file is flushed and uploaded
+        self.logger.info(f'Transfer metrics: {self.io_session.transfers.summary()}')
         if log_file:
+            [handler.flush() for handler in logging.getLogger().handlers]  # Log records are written in the background
             self.io_session.uploadFiles({'log': log_file})
+        if not keep_checkpoint and not keep_temp:
+            self.checkpoint.clear()
+        self.checkpoint.close()
+        if self.run_id:
+            instrumenterror.removeErrorHandler(self.run_id)
+        else:
+            self.instrument_error.close()  # Removes entries spilled to disk (see spillErrors)
@@ -8,41 +8,68 @@ CAP_DIRECTORY = os.path.dirname(MODEL_DIRECTORY)
 PACKAGE_DIRECTORY = os.path.dirname(CAP_DIRECTORY)
 sys.path.extend([CAP_DIRECTORY, PACKAGE_DIRECTORY])
 from config import config
-from model import Model
 
 
-def _parseInputArguments():
-    parser = argparse.ArgumentParser(description='Run model')
+def _addRunArguments(parser):
+    """Add logging, temp file and configuration arguments (shared by run.py and batch.py)"""
     parser.add_argument('-d', '--usedefaults', help='Do not overwrite system env variables with included configuration files', action='store_false')
     parser.add_argument('-l', '--loglevel', help='Set log level for console and logfile output', choices=['NOTSET', 'DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL', 'DISABLED'])
     parser.add_argument('-k', '--keeptemp', help='Do not clear temp directories and files after model run', action='store_true')
+    parser.add_argument('-r', '--resume', help='Resume from the checkpoint of an earlier failed run, skipping completed steps, shards and uploads',
+                        action='store_true')
     cfgs = parser.add_mutually_exclusive_group()
     cfgs.add_argument('-o', '--overwrite', help='Overwrite configurations with custom configuration file', metavar=('CUSTOM_CONFIG_PATH'))
     cfgs.add_argument('-c', '--config', help='Add custom configurations without overwriting system variables', metavar=('CUSTOM_CONFIG_PATH'))
-    mode = parser.add_mutually_exclusive_group(required=True)
-    mode.add_argument('-s', '--s3', help='Run model with data hosted on S3 (default behavior)', metavar=('MODEL_PARAMS_S3_KEY'))
-    mode.add_argument('-L', '--local', help='Run model with data from local test folder', metavar=('TEST_FOLDER_PATH'))
+    return parser
+
+
+def _addCredentialArguments(parser):
+    """Add login and proxy login arguments (shared by run.py and batch.py)"""
     credentials = parser.add_mutually_exclusive_group(required=True)
     credentials.add_argument('-j', '--jwt', help='Log in using JSON web token', metavar=('JWT'))
     credentials.add_argument('-u', '--unpw', help='Log in using username and password', nargs=2, metavar=('USERNAME', 'PASSWORD'), default=[None, None])
     proxy = parser.add_mutually_exclusive_group()
     proxy.add_argument('-t', '--proxyjwt', help='Use proxy user JWT for API access', metavar=('JWT'))
     proxy.add_argument('-p', '--proxyunpw', help='Use proxy username and password for API access', nargs=2, metavar=('USERNAME', 'PASSWORD'), default=[None, None])
+    return parser
+
+
+def _parseInputArguments():
+    parser = argparse.ArgumentParser(description='Run model')
+    _addRunArguments(parser)
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('-s', '--s3', help='Run model with data hosted on S3 (default behavior)', metavar=('MODEL_PARAMS_S3_KEY'))
+    mode.add_argument('-L', '--local', help='Run model with data from local test folder', metavar=('TEST_FOLDER_PATH'))
+    _addCredentialArguments(parser)
     return parser.parse_args()
 
 
-def _runModel(args):
-    logger = logging.getLogger(__name__)
-    model_run_parameters_path = args.s3 if args.s3 else args.local
-    local_mode = bool(args.local)
+def _getCredentials(args):
+    """:return: tuple of (credentials, proxy_credentials) dictionaries"""
     credentials = {'jwt': args.jwt, 'username': args.unpw[0], 'password': args.unpw[1]}
     if not args.proxyjwt and args.proxyunpw == [None, None]:
         proxy_credentials = {}
     else:
         proxy_credentials = {'jwt': args.proxyjwt, 'username': args.proxyunpw[0], 'password': args.proxyunpw[1], 'sso_url': os.environ.get('PROXY_TOKEN_URL')}
+    return credentials, proxy_credentials
+
+
+def runModel(model_run_parameters_path, local_mode, credentials, proxy_credentials, keep_temp=False, log_file=None, session_pool=None, run_id=None,
+             temp_directory=None, resume=False):
+    """
+    Run and clean up a single model run, without exiting or shutting down logging
+    :param log_file: optional log file to upload to logPath on cleanup
+    :param run_id: optional name isolating this run's instrumentError handler from other runs in the same process
+    :param temp_directory: optional local temp directory to reuse, instead of creating one
+    :param resume: If True, resume from the checkpoint of an earlier failed run (see MOODYS_CHECKPOINT_DIRECTORY)
+    :return: exit code
+    """
+    from model import Model  # Deferred so that argument parsing (and -h) does not pay for pandas/moodyscappy imports
+    logger = logging.getLogger(__name__)
     try:
         logger.info('Running Model')
-        model = Model(credentials, proxy_credentials, model_run_parameters_path, local_mode)
+        model = Model(credentials, proxy_credentials, model_run_parameters_path, local_mode, session_pool=session_pool, run_id=run_id,
+                      temp_directory=temp_directory, resume=resume)
         model.run()
         logger.info('Model execution completed')
         exit_code = 0
@@ -51,10 +78,20 @@ def _runModel(args):
         logger.debug(e)
         exit_code = 1
     try:
-        model.cleanUp(log_file=config.LOG_FILE, keep_temp=args.keeptemp)
+        model.cleanUp(log_file=log_file, keep_temp=keep_temp)
     except UnboundLocalError:
         pass  # An authentication error will prevent instantiation of Model object, and UnboundLocalError unnecessarily clutters call stack
     logger.info(f'Exit code: {exit_code}')
+    return exit_code
+
+
+def _runModel(args):
+    model_run_parameters_path = args.s3 if args.s3 else args.local
+    local_mode = bool(args.local)
+    credentials, proxy_credentials = _getCredentials(args)
+    with config.RunLogContext() as run_log:
+        exit_code = runModel(model_run_parameters_path, local_mode, credentials, proxy_credentials, keep_temp=args.keeptemp, log_file=run_log.log_file,
+                             resume=args.resume)
     logging.shutdown()
     return exit_code
 
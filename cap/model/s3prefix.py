@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import itertools
+import logging
+
+
+MAX_DELETE_BATCH = 1000  # S3 DeleteObjects accepts at most 1000 keys per request
+DEFAULT_MAX_WORKERS = 8
+
+logger = logging.getLogger(__name__)
+
+
+def iterKeys(s3_client, bucket, prefix, page_size=MAX_DELETE_BATCH):
+    """
+    Lazily list every key under an S3 prefix, following continuation tokens
+
+    :param s3_client: boto3 S3 client (e.g., Cappy.init_s3_client())
+    :param bucket: bucket name
+    :param prefix: key prefix to list
+    :param page_size: maximum keys requested per list_objects_v2 call
+    :return: generator of keys
+    """
+    kwargs = {'Bucket': bucket, 'Prefix': prefix, 'MaxKeys': page_size}
+    while True:
+        response = s3_client.list_objects_v2(**kwargs)
+        for obj in response.get('Contents', []):
+            yield obj['Key']
+        if not response.get('IsTruncated'):
+            return
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    batch = list(itertools.islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(itertools.islice(iterator, size))
+
+
+def deleteKeys(s3_client, bucket, keys, batch_size=MAX_DELETE_BATCH):
+    """
+    Delete keys in batches using DeleteObjects
+
+    :param keys: iterable of keys (consumed lazily, e.g., output of iterKeys)
+    :param batch_size: keys per DeleteObjects request (S3 maximum is 1000)
+    :return: list of keys that were successfully deleted
+    """
+    batch_size = min(batch_size, MAX_DELETE_BATCH)
+    deleted = []
+    for batch in _batched(keys, batch_size):
+        response = s3_client.delete_objects(Bucket=bucket, Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True})
+        errors = response.get('Errors', [])
+        for error in errors:
+            logger.warning(f'Error deleting {error.get("Key")}: {error.get("Message")}')
+        failed = {error.get('Key') for error in errors}
+        deleted.extend(key for key in batch if key not in failed)
+    return deleted
+
+
+def clearPrefix(s3_client, bucket, prefix):
+    """Delete every key under an S3 prefix. :return: list of deleted keys"""
+    deleted = deleteKeys(s3_client, bucket, iterKeys(s3_client, bucket, prefix))
+    logger.debug(f'Deleted {len(deleted)} keys under {prefix}')
+    return deleted
+
+
+def _mapPrefixes(function, s3_client, bucket, prefixes, max_workers):
+    prefixes = [prefix for prefix in prefixes if prefix]
+    if not prefixes:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(prefixes))) as executor:
+        # Each prefix runs in a copy of the caller's context, so that its records reach the caller's run log (see config.RunLogContext)
+        futures = {prefix: executor.submit(contextvars.copy_context().run, function, s3_client, bucket, prefix) for prefix in prefixes}
+    return {prefix: future.result() for prefix, future in futures.items()}
+
+
+def listPrefixes(s3_client, bucket, prefixes, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    List several prefixes in parallel
+
+    :return: dictionary of form {prefix: [keys]}
+    """
+    return _mapPrefixes(lambda *args: list(iterKeys(*args)), s3_client, bucket, prefixes, max_workers)
+
+
+def clearPrefixes(s3_client, bucket, prefixes, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Clear several prefixes in parallel
+
+    :return: dictionary of form {prefix: [deleted keys]}
+    :raises: first exception raised by any prefix, after all prefixes have been attempted
+    """
+    return _mapPrefixes(clearPrefix, s3_client, bucket, prefixes, max_workers)
@@ -0,0 +1,408 @@
+import argparse
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import itertools
+import json
+import logging
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+# Adding package directory necessary for some imports to work in local mode
+MODEL_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+CAP_DIRECTORY = os.path.dirname(MODEL_DIRECTORY)
+PACKAGE_DIRECTORY = os.path.dirname(CAP_DIRECTORY)
+sys.path.extend([CAP_DIRECTORY, PACKAGE_DIRECTORY])
+from config import config
+
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8808
+DEFAULT_MAX_BATCH_ROWS = 5000
+DEFAULT_MAX_WAIT = 0.005  # Seconds a batch waits for more requests to coalesce with, once it has one
+DEFAULT_REQUEST_TIMEOUT = 60
+DEFAULT_ENGINE_TIMEOUT = 50  # Seconds the worker may take to answer a request before it is killed, less than a request waits
+DEFAULT_START_TIMEOUT = 300  # Seconds the worker may take to load model data
+STOP_TIMEOUT = 10
+OUTPUT_CATEGORIES = ['instrumentRiskMetric', 'instrumentError']
+IDENTIFIER = 'instrumentidentifier'
+DATE_FORMAT = '%Y-%m-%d'
+_STOP = object()
+
+
+class ScoringError(Exception):
+    """Raised when the model engine fails to score a batch"""
+
+
+def _readLines(stream, lines):
+    """Put lines of stream on the lines queue, then None at end of stream"""
+    try:
+        for line in stream:
+            lines.put(line)
+    except (OSError, ValueError):
+        pass  # Stream closed
+    lines.put(None)
+
+
+class RScoringEngine:
+    """
+    Model engine (bin/score_worker.R) kept running between requests, so that calibration tables, sector maps and DD data are
+    loaded once rather than on every run
+
+    :param package_directory: package directory holding bin/ and data/
+    :param log_directory: directory for the worker's debug.log (default: R temp directory)
+    :param timeout: seconds the worker may take to answer a request. A worker that does not is killed, and restarted on the next request
+    :param start_timeout: seconds the worker may take to load model data and report ready
+    :param command: command starting the worker (default: Rscript bin/score_worker.R)
+    :note: score() is serialized, as the worker handles one request at a time. The worker is restarted if it dies
+    :note: worker output that is not a response (e.g., a stray print) is logged and skipped
+    """
+
+    def __init__(self, package_directory=PACKAGE_DIRECTORY, log_directory=None, timeout=DEFAULT_ENGINE_TIMEOUT, start_timeout=DEFAULT_START_TIMEOUT,
+                 command=None):
+        self.logger = logging.getLogger(__name__)
+        self.package_directory = package_directory
+        self.log_directory = log_directory
+        self.timeout = timeout
+        self.start_timeout = start_timeout
+        self.command = command
+        self._process = None
+        self._lines = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+
+    def start(self):
+        """Start the worker, blocking until it has loaded model data"""
+        with self._lock:
+            self._start()
+
+    def _start(self):
+        script = os.path.join(self.package_directory, 'bin', 'score_worker.R')
+        command = self.command or ['Rscript', script, '-l', self.package_directory] + (['-g', self.log_directory] if self.log_directory else [])
+        self.logger.info('Starting scoring worker')
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1)
+        self._lines = queue.Queue()  # Read in a thread of its own, so that reads can time out
+        threading.Thread(target=_readLines, args=(self._process.stdout, self._lines), name='ScoringWorkerReader', daemon=True).start()
+        try:
+            self._readResponse(lambda response: response.get('ready'), self.start_timeout)
+        except ScoringError as e:
+            self._kill()
+            raise ScoringError(f'Scoring worker failed to start: {e}')
+
+    def _readResponse(self, accept, timeout):
+        """
+        :param accept: function(response) returning True for the response waited for
+        :raise ScoringError: if the worker exits, or sends no accepted response within timeout seconds
+        :return: first response (JSON object) of the worker accepted
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        while True:
+            try:
+                line = self._lines.get(timeout=max(deadline - time.monotonic(), 0) if deadline is not None else None)
+            except queue.Empty:
+                raise ScoringError(f'Scoring worker did not respond within {timeout:g} seconds')
+            if line is None:
+                raise ScoringError('Scoring worker exited unexpectedly')
+            try:
+                response = json.loads(line)
+            except ValueError:
+                response = None
+            if isinstance(response, dict) and accept(response):
+                return response
+            self.logger.warning(f'Ignoring scoring worker output: {line.rstrip()}')
+
+    def score(self, instruments, reporting_date, run_date):
+        """
+        :param instruments: list of instrumentReference rows (dictionaries with lowercase attribute names)
+        :param reporting_date: reporting date (YYYY-MM-DD)
+        :param run_date: run date (YYYY-MM-DD)
+        :return: dictionary of form {output_category: list of rows}, rows identified by instrumentidentifier
+        """
+        request = {'id': next(self._ids), 'reportingDate': reporting_date, 'runDate': run_date, 'instruments': instruments}
+        with self._lock:
+            if self._closed:
+                raise ScoringError('Scoring engine is closed')
+            if self._process is None or self._process.poll() is not None:
+                self._start()
+            try:
+                self._process.stdin.write(json.dumps(request) + '\n')
+                self._process.stdin.flush()
+                response = self._readResponse(lambda response: response.get('id') == request['id'], self.timeout)
+            except OSError as e:
+                self.logger.error(f'Unable to reach scoring worker: {e}')
+                self._kill()  # Restarted on next request
+                raise ScoringError('Scoring worker exited unexpectedly')
+            except ScoringError:
+                self._kill()  # Restarted on next request
+                raise
+        if response.get('error'):
+            raise ScoringError(response['error'])
+        return {category: response.get(category) or [] for category in OUTPUT_CATEGORIES}
+
+    def _stop(self):
+        if self._process is not None:
+            if self._process.poll() is None:
+                try:
+                    self._process.stdin.close()  # Worker exits at end of input
+                    self._process.wait(timeout=STOP_TIMEOUT)
+                except (OSError, subprocess.TimeoutExpired):
+                    pass
+            self._kill()
+
+    def _kill(self):
+        if self._process is not None:
+            if self._process.poll() is None:
+                self._process.kill()
+            self._process.wait()
+            for stream in (self._process.stdin, self._process.stdout):
+                try:
+                    stream.close()
+                except OSError:
+                    pass
+            self._process = None
+
+    def close(self, timeout=STOP_TIMEOUT):
+        """
+        Stop the worker. Later requests fail
+        :param timeout: seconds to wait for a request in progress, after which the worker is killed and the request fails
+        """
+        self._closed = True
+        if not self._lock.acquire(timeout=timeout):
+            process = self._process
+            if process is not None:
+                process.kill()  # Ends the request in progress, which then releases the lock
+            self._lock.acquire()
+        try:
+            self._stop()
+        finally:
+            self._lock.release()
+
+
+class _Request:
+
+    def __init__(self, instruments, reporting_date, run_date):
+        self.instruments = instruments
+        self.dates = (reporting_date, run_date)
+        self.future = Future()
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent scoring requests into one engine call, so that the engine's per-call overhead is paid once per batch
+
+    :param engine: object with score(instruments, reporting_date, run_date) (e.g., RScoringEngine)
+    :param max_batch_rows: number of rows at which a batch is scored without waiting for more requests
+    :param max_wait: seconds a batch waits for more requests once it has one
+    :note: instrumentidentifiers are replaced by row keys for the engine call, so that requests may reuse identifiers
+    """
+
+    def __init__(self, engine, max_batch_rows=DEFAULT_MAX_BATCH_ROWS, max_wait=DEFAULT_MAX_WAIT):
+        self.logger = logging.getLogger(__name__)
+        self.engine = engine
+        self.max_batch_rows = max_batch_rows
+        self.max_wait = max_wait
+        self.metrics = {'requests': 0, 'batches': 0, 'rows': 0}
+        self._metrics_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='MicroBatcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, instruments, reporting_date, run_date):
+        """:return: concurrent.futures.Future of dictionary of form {output_category: list of rows}"""
+        request = _Request(instruments, reporting_date, run_date)
+        self._queue.put(request)
+        return request.future
+
+    def score(self, instruments, reporting_date, run_date, timeout=None):
+        return self.submit(instruments, reporting_date, run_date).result(timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            request = self._queue.get()
+            if request is _STOP:
+                break
+            batch, rows = [request], len(request.instruments)
+            deadline = time.monotonic() + self.max_wait
+            while rows < self.max_batch_rows:
+                try:
+                    request = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if request is _STOP:
+                    stopping = True
+                    break
+                batch.append(request)
+                rows += len(request.instruments)
+            for dates in dict.fromkeys(request.dates for request in batch):  # One engine call per date pair, in arrival order
+                self._scoreBatch([request for request in batch if request.dates == dates])
+
+    def _scoreBatch(self, requests):
+        rows, owners = [], []
+        for index, request in enumerate(requests):
+            for instrument in request.instruments:
+                owners.append((index, instrument.get(IDENTIFIER)))
+                rows.append({**instrument, IDENTIFIER: str(len(rows))})
+        try:
+            response = self.engine.score(rows, *requests[0].dates)
+            results = [{category: [] for category in OUTPUT_CATEGORIES} for _ in requests]
+            for category, records in response.items():
+                for record in records:
+                    index, identifier = owners[int(record[IDENTIFIER])]
+                    results[index].setdefault(category, []).append({**record, IDENTIFIER: identifier})
+        except Exception as e:  # Failed requests get the exception, and the batcher carries on
+            self.logger.error(f'Scoring batch of {len(requests)} requests ({len(rows)} rows) failed: {e}')
+            for request in requests:
+                request.future.set_exception(e)
+            return
+        for request, result in zip(requests, results):
+            request.future.set_result(result)
+        with self._metrics_lock:
+            self.metrics['requests'] += len(requests)
+            self.metrics['batches'] += 1
+            self.metrics['rows'] += len(rows)
+
+    def close(self, timeout=None):
+        """
+        Score requests already submitted, then stop
+        :param timeout: seconds to wait for submitted requests to be scored (default: no limit)
+        :return: True if stopped, False if requests were still being scored after timeout
+        """
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+
+def parseScoringRequest(body):
+    """
+    Validate a scoring request of form {'instruments': [instrumentReference rows], 'reportingDate': 'YYYY-MM-DD', 'runDate': 'YYYY-MM-DD'}
+    :note: attribute names are matched case-insensitively. runDate defaults to today
+    :raise ValueError: if the request is malformed
+    :return: tuple of (instruments with lowercase attribute names, reporting_date, run_date)
+    """
+    if not isinstance(body, dict) or not isinstance(body.get('instruments'), list):
+        raise ValueError('Request must be a JSON object with an instruments list')
+    instruments = []
+    for row, instrument in enumerate(body['instruments']):
+        if not isinstance(instrument, dict):
+            raise ValueError(f'Instrument {row} is not a JSON object')
+        instrument = {str(attribute).lower().replace(' ', ''): value for attribute, value in instrument.items()}
+        if instrument.get(IDENTIFIER) in (None, ''):
+            raise ValueError(f'Instrument {row} has no {IDENTIFIER}')
+        instruments.append(instrument)
+    dates = []
+    for name, default in [('reportingDate', None), ('runDate', datetime.date.today().strftime(DATE_FORMAT))]:
+        value = body.get(name) or default
+        try:
+            dates.append(datetime.datetime.strptime(value, DATE_FORMAT).strftime(DATE_FORMAT))
+        except (TypeError, ValueError):
+            raise ValueError(f'{name} must be a date of form YYYY-MM-DD')
+    return instruments, dates[0], dates[1]
+
+
+class ScoringRequestHandler(BaseHTTPRequestHandler):
+    """POST /score scores a batch of instruments (see parseScoringRequest). GET /health reports batching metrics"""
+
+    server_version = 'CapScoring/1.0'
+
+    def _reply(self, status, body):
+        payload = json.dumps(body, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path != '/health':
+            return self._reply(404, {'error': f'Unknown path {self.path}'})
+        self._reply(200, {'status': 'ok', **self.server.batcher.metrics})
+
+    def do_POST(self):
+        if self.path != '/score':
+            return self._reply(404, {'error': f'Unknown path {self.path}'})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or 'null')
+            instruments, reporting_date, run_date = parseScoringRequest(body)
+        except ValueError as e:  # Includes json.JSONDecodeError
+            return self._reply(400, {'error': str(e)})
+        try:
+            result = self.server.batcher.score(instruments, reporting_date, run_date, timeout=self.server.request_timeout)
+        except FutureTimeoutError:
+            return self._reply(504, {'error': f'Scoring did not complete within {self.server.request_timeout} seconds'})
+        except Exception as e:
+            return self._reply(500, {'error': str(e)})
+        self._reply(200, result)
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(f'{self.address_string()} {format % args}')
+
+
+class ScoringService(ThreadingHTTPServer):
+    """
+    Long-running local HTTP service scoring instruments with a warm model engine, coalescing concurrent requests (see MicroBatcher)
+
+    :param engine: object with score(instruments, reporting_date, run_date) (e.g., RScoringEngine)
+    :param address: (host, port) to listen on. Port 0 picks a free port (see server_address)
+    :param request_timeout: seconds a request waits for its batch to be scored
+    """
+
+    daemon_threads = True
+
+    def __init__(self, engine, address=(DEFAULT_HOST, DEFAULT_PORT), max_batch_rows=DEFAULT_MAX_BATCH_ROWS, max_wait=DEFAULT_MAX_WAIT,
+                 request_timeout=DEFAULT_REQUEST_TIMEOUT):
+        super().__init__(address, ScoringRequestHandler)
+        self.engine = engine
+        self.request_timeout = request_timeout
+        self.batcher = MicroBatcher(engine, max_batch_rows=max_batch_rows, max_wait=max_wait)
+
+    def server_close(self):
+        """Stop accepting requests, and wait at most request_timeout for submitted requests to be scored"""
+        super().server_close()
+        if not self.batcher.close(timeout=self.request_timeout):
+            logging.getLogger(__name__).warning(f'Scoring requests still in progress after {self.request_timeout} seconds. Stopping anyway')
+
+
+def _parseInputArguments():
+    parser = argparse.ArgumentParser(description='Serve online scoring requests over HTTP')
+    parser.add_argument('-d', '--usedefaults', help='Do not overwrite system env variables with included configuration files', action='store_false')
+    parser.add_argument('-l', '--loglevel', help='Set log level for console and logfile output', choices=['NOTSET', 'DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL', 'DISABLED'])
+    parser.add_argument('-H', '--host', help='Address to listen on', default=DEFAULT_HOST)
+    parser.add_argument('-P', '--port', help='Port to listen on', type=int, default=DEFAULT_PORT)
+    parser.add_argument('-b', '--maxbatchrows', help='Number of rows at which a batch is scored without waiting for more requests', type=int,
+                        default=DEFAULT_MAX_BATCH_ROWS)
+    parser.add_argument('-w', '--maxwaitms', help='Milliseconds a batch waits for more requests to coalesce with', type=float,
+                        default=DEFAULT_MAX_WAIT * 1000)
+    parser.add_argument('-T', '--enginetimeout', help='Seconds the model engine may take to score a batch before it is restarted', type=float,
+                        default=DEFAULT_ENGINE_TIMEOUT)
+    cfgs = parser.add_mutually_exclusive_group()
+    cfgs.add_argument('-o', '--overwrite', help='Overwrite configurations with custom configuration file', metavar=('CUSTOM_CONFIG_PATH'))
+    cfgs.add_argument('-c', '--config', help='Add custom configurations without overwriting system variables', metavar=('CUSTOM_CONFIG_PATH'))
+    return parser.parse_args()
+
+
+def main():
+    args = _parseInputArguments()
+    config.configureLogger(args.loglevel)
+    config.processConfigurations(args.overwrite, args.config, args.usedefaults)
+    logger = logging.getLogger(__name__)
+    engine = RScoringEngine(timeout=args.enginetimeout)
+    engine.start()  # Load model data before accepting requests
+    service = ScoringService(engine, (args.host, args.port), max_batch_rows=args.maxbatchrows, max_wait=args.maxwaitms / 1000)
+    logger.info(f'Serving scoring requests on http://{args.host}:{service.server_address[1]}/score')
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.server_close()
+        engine.close()
+        logging.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+import base64
+import hashlib
+import json
+import logging
+import threading
+import time
+
+
+DEFAULT_MAX_AGE = 3600  # Seconds to keep a session whose token expiry cannot be determined
+DEFAULT_REFRESH_MARGIN = 300  # Seconds before token expiry at which a session is considered stale
+DEFAULT_MIN_REFRESH_INTERVAL = 60  # Seconds between re-authentications of a session whose token cannot be refreshed (e.g., a JWT near expiry)
+TOKEN_ATTRIBUTES = ['jwt', 'token', 'access_token', '_token']  # Places a Cappy session may hold its JWT
+
+
+def _defaultSessionFactory(**kwargs):
+    from moodyscappy import Cappy  # Deferred so that importing this module stays cheap
+    return Cappy(**kwargs)
+
+
+def _credentialsKey(credentials, errors):
+    """Hash of credentials, so that plain text passwords are not used as dictionary keys"""
+    items = sorted((k, v) for k, v in credentials.items() if v is not None)
+    return hashlib.sha256(json.dumps([items, errors]).encode('utf-8')).hexdigest()
+
+
+def getTokenExpiry(token):
+    """
+    Read the exp claim of a JSON web token (signature is not verified)
+    :return: expiry as seconds since epoch, or None if token is not a readable JWT
+    """
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))['exp'])
+    except Exception:
+        return None
+
+
+class _PooledSession:
+    def __init__(self, session, refresh_at):
+        self.session = session
+        self.refresh_at = refresh_at
+        self.s3_client = None
+
+
+class SessionPool:
+    """
+    Cache of authenticated Cappy sessions and their S3 clients, keyed by credentials
+
+    :param session_factory: callable accepting Cappy keyword arguments (default: moodyscappy.Cappy)
+    :param max_age: seconds to keep sessions whose token expiry is unknown
+    :param refresh_margin: seconds before token expiry at which a session is re-authenticated
+    :param min_refresh_interval: minimum seconds between re-authentications, for tokens that are already within refresh_margin of
+                                 expiry when authenticated (e.g., a JWT passed in that cannot be refreshed)
+    :param clock: callable returning current time in seconds since epoch
+    :note: sessions that failed to authenticate with errors other than 'raise' (i.e., that hold no token) are not cached
+    """
+
+    def __init__(self, session_factory=None, max_age=DEFAULT_MAX_AGE, refresh_margin=DEFAULT_REFRESH_MARGIN,
+                 min_refresh_interval=DEFAULT_MIN_REFRESH_INTERVAL, clock=time.time):
+        self.logger = logging.getLogger(__name__)
+        self._session_factory = session_factory or _defaultSessionFactory
+        self._max_age = max_age
+        self._refresh_margin = refresh_margin
+        self._min_refresh_interval = min_refresh_interval
+        self._clock = clock
+        self._entries = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    def _keyLock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _authenticated(self, session):
+        """:return: whether a session holds a token (Cappy logs, rather than raises, failed authentications unless errors='raise')"""
+        return any(getattr(session, attribute, None) for attribute in TOKEN_ATTRIBUTES)
+
+    def _refreshAt(self, session, credentials):
+        """:return: time at which to re-authenticate a new session, at least min_refresh_interval from now"""
+        now = self._clock()
+        refresh_at = self._expiry(session, credentials) - self._refresh_margin
+        if refresh_at < now + self._min_refresh_interval:
+            self.logger.warning(f'Session token expires within {self._refresh_margin} seconds and cannot be refreshed. '
+                                f'Re-authenticating in {self._min_refresh_interval} seconds')
+            return now + self._min_refresh_interval
+        return refresh_at
+
+    def _expiry(self, session, credentials):
+        tokens = [credentials.get('jwt'), *[getattr(session, attribute, None) for attribute in TOKEN_ATTRIBUTES]]
+        expiries = [getTokenExpiry(token) for token in tokens if isinstance(token, str)]
+        expiries = [expiry for expiry in expiries if expiry is not None]
+        return min(expiries) if expiries else self._clock() + self._max_age
+
+    def getSession(self, credentials, errors='raise'):
+        """
+        Get a cached session for the given credentials, authenticating if none exists or its token is about to expire
+        :param credentials: dictionary of Cappy keyword arguments (e.g., jwt or username and password, optional sso_url)
+        :param errors: Cappy error handling mode
+        :return: Cappy session
+        """
+        key = _credentialsKey(credentials, errors)
+        with self._keyLock(key):
+            entry = self._entries.get(key)
+            if entry is not None and entry.refresh_at > self._clock():
+                return entry.session
+            if entry is not None:
+                self.logger.info('Cached session token is about to expire. Re-authenticating')
+            session = self._session_factory(**credentials, errors=errors)
+            if errors != 'raise' and not self._authenticated(session):
+                self._entries.pop(key, None)  # Failed (and logged), so authenticate again on next use
+                return session
+            self._entries[key] = _PooledSession(session, self._refreshAt(session, credentials))
+            return session
+
+    def getS3Client(self, session):
+        """
+        Get the cached S3 client of a pooled session, creating it on first use
+        :note: sessions not created by this pool get a new, uncached client
+        """
+        with self._lock:
+            entry = next((entry for entry in self._entries.values() if entry.session is session), None)
+        if entry is None:
+            return session.init_s3_client()
+        if entry.s3_client is None:
+            entry.s3_client = session.init_s3_client()
+        return entry.s3_client
+
+    def invalidate(self, credentials, errors='raise'):
+        """Drop the cached session for the given credentials, forcing re-authentication on next use"""
+        with self._lock:
+            self._entries.pop(_credentialsKey(credentials, errors), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_session_pool = None
+_session_pool_lock = threading.Lock()
+
+
+def getSessionPool():
+    """:return: process-wide default SessionPool"""
+    global _session_pool
+    with _session_pool_lock:
+        if _session_pool is None:
+            _session_pool = SessionPool()
+        return _session_pool
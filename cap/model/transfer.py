@@ -0,0 +1,165 @@
+from concurrent.futures import Future, FIRST_COMPLETED, wait
+import contextvars
+import logging
+import os
+import random
+import statistics
+import threading
+import time
+
+
+TIMEOUT_VARIABLE = 'MOODYS_TRANSFER_TIMEOUT'
+RETRIES_VARIABLE = 'MOODYS_TRANSFER_RETRIES'
+HEDGE_FACTOR_VARIABLE = 'MOODYS_TRANSFER_HEDGE_FACTOR'
+DEFAULT_TIMEOUT = 900  # Seconds per attempt. Generous: large inputs are transferred in one call
+DEFAULT_RETRIES = 2
+DEFAULT_HEDGE_FACTOR = 4  # Hedge transfers taking 4 times longer than the median
+BACKOFF = 1  # Seconds before the first retry, doubled for every further retry
+MAX_BACKOFF = 30
+MIN_SAMPLES = 3  # Completed transfers needed before the median is trusted for hedging
+MIN_HEDGE_DELAY = 1  # Seconds. Small objects are dominated by request latency, which a hedge does not improve
+PERMANENT_ERROR_CODES = {'403', '404', 'AccessDenied', 'NoSuchBucket', 'NoSuchKey'}  # S3 (botocore ClientError) codes not worth retrying
+
+
+class TransferTimeout(TimeoutError):
+    pass
+
+
+def isRetryable(error):
+    """:return: False for errors a retry cannot fix (e.g., a missing object), else True"""
+    if isinstance(error, (FileNotFoundError, PermissionError, KeyError)):
+        return False
+    response = getattr(error, 'response', None)
+    code = response.get('Error', {}).get('Code') if isinstance(response, dict) else None
+    return code not in PERMANENT_ERROR_CODES
+
+
+class TransferScheduler:
+    """
+    Run transfers (Cappy downloads and uploads) with a deadline per attempt, retries with exponential backoff, and a hedged
+    duplicate attempt for transfers that fall far behind the median throughput of completed ones, so that one slow or stuck
+    connection does not stall a model run
+
+    :param timeout: seconds an attempt may take before it is abandoned and retried, 0 for none
+                    (default: MOODYS_TRANSFER_TIMEOUT environment variable, else DEFAULT_TIMEOUT)
+    :param retries: attempts after the first (default: MOODYS_TRANSFER_RETRIES environment variable, else DEFAULT_RETRIES)
+    :param hedge_factor: an attempt running hedge_factor times longer than expected from the median throughput (or median duration,
+                         if its size is unknown) gets a duplicate attempt, the first to succeed is used. 0 to never hedge
+                         (default: MOODYS_TRANSFER_HEDGE_FACTOR environment variable, else DEFAULT_HEDGE_FACTOR)
+    :note: a stuck call cannot be interrupted, so abandoned attempts run on in daemon threads. Their results are handed to the
+           discard function given to run
+    :note: per-object latency and throughput are recorded in self.records, see summary
+    """
+
+    def __init__(self, timeout=None, retries=None, hedge_factor=None, backoff=BACKOFF, min_samples=MIN_SAMPLES, min_hedge_delay=MIN_HEDGE_DELAY):
+        self.logger = logging.getLogger(__name__)
+        self.timeout = float(_setting(timeout, TIMEOUT_VARIABLE, DEFAULT_TIMEOUT)) or None
+        self.retries = int(_setting(retries, RETRIES_VARIABLE, DEFAULT_RETRIES))
+        self.hedge_factor = float(_setting(hedge_factor, HEDGE_FACTOR_VARIABLE, DEFAULT_HEDGE_FACTOR))
+        self.backoff = backoff
+        self.min_samples = min_samples
+        self.min_hedge_delay = min_hedge_delay
+        self.records = []
+        self._lock = threading.Lock()
+
+    def _expectedDuration(self, size):
+        """:return: seconds a transfer of size bytes is expected to take from completed transfers, or None if too few completed"""
+        with self._lock:
+            records = [record for record in self.records if record['succeeded']]
+        if len(records) < self.min_samples:
+            return None
+        throughputs = [record['throughput'] for record in records if record['throughput']]
+        if size and len(throughputs) >= self.min_samples:
+            return size / statistics.median(throughputs)
+        return statistics.median(record['seconds'] for record in records)
+
+    def _start(self, function, attempt):
+        """Run function(attempt) in a daemon thread, in the caller's context (e.g., its run log). :return: Future of its result"""
+        future = Future()
+
+        def target():
+            try:
+                future.set_result(function(attempt))
+            except BaseException as e:
+                future.set_exception(e)
+        threading.Thread(target=contextvars.copy_context().run, args=(target,), name=f'transfer-{attempt}', daemon=True).start()
+        return future
+
+    def _abandon(self, futures, discard):
+        for future in futures:
+            if discard is not None:
+                future.add_done_callback(lambda f: discard(f.result()) if f.exception() is None else None)
+
+    def run(self, key, function, size=None, direction='transfer', discard=None):
+        """
+        :param key: object key, for logging and records
+        :param function: function(attempt) doing one attempt of the transfer (attempts may overlap, so downloads should write to
+                         a path of their own per attempt). Its result is returned from the first attempt to succeed
+        :param size: bytes to transfer if known (uploads), else the result of size(result) is recorded if size is callable
+        :param direction: 'download' or 'upload', recorded
+        :param discard: function(result) called with results of attempts that succeed after another attempt was used
+        :raise: the error of the last attempt (TransferTimeout if it was abandoned) if all attempts failed, or the first error that
+                is not retryable (see isRetryable)
+        """
+        started = time.monotonic()
+        attempt = 0
+        hedged = False
+        error = None
+        for retry in range(self.retries + 1):
+            if error is not None and not isRetryable(error):
+                break
+            if retry:
+                delay = min(self.backoff * 2 ** (retry - 1), MAX_BACKOFF) * random.uniform(0.5, 1)  # Jittered, so that retries spread out
+                self.logger.info(f'Retrying {direction} of {key} in {delay:.1f}s ({retry}/{self.retries}): {error!r}')
+                time.sleep(delay)
+            attempt_started = time.monotonic()
+            deadline = attempt_started + self.timeout if self.timeout else None
+            expected = self._expectedDuration(size if not callable(size) else None)
+            hedge_at = attempt_started + max(expected * self.hedge_factor, self.min_hedge_delay) if expected is not None and self.hedge_factor else None
+            pending = {self._start(function, attempt)}
+            attempt += 1
+            while pending:
+                wake_up = [time_ for time_ in (deadline, hedge_at) if time_ is not None]
+                done, pending = wait(pending, timeout=max(min(wake_up) - time.monotonic(), 0) if wake_up else None, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        self._abandon(pending, discard)
+                        result = future.result()
+                        self._record(key, direction, size(result) if callable(size) else size, time.monotonic() - started, attempt, hedged, True)
+                        return result
+                    error = future.exception()
+                now = time.monotonic()
+                if pending and hedge_at is not None and now >= hedge_at:
+                    self.logger.info(f'Hedging {direction} of {key}: running {now - attempt_started:.1f}s, expected {expected:.1f}s')
+                    pending.add(self._start(function, attempt))
+                    attempt += 1
+                    hedged = True
+                    hedge_at = None
+                if pending and deadline is not None and now >= deadline:
+                    error = TransferTimeout(f'{direction.capitalize()} of {key} took longer than {self.timeout:g}s')
+                    self._abandon(pending, discard)
+                    pending = set()
+        self._record(key, direction, None if callable(size) else size, time.monotonic() - started, attempt, hedged, False)
+        raise error
+
+    def _record(self, key, direction, size, seconds, attempts, hedged, succeeded):
+        record = {'key': key, 'direction': direction, 'bytes': size, 'seconds': seconds, 'throughput': size / seconds if size and seconds else None,
+                  'attempts': attempts, 'hedged': hedged, 'succeeded': succeeded}
+        with self._lock:
+            self.records.append(record)
+        self.logger.debug(f'Transfer record: {record}')
+
+    def summary(self):
+        """:return: dictionary of transfer counts, bytes and median throughput (bytes per second) of completed transfers"""
+        with self._lock:
+            records = self.records[:]
+        throughputs = [record['throughput'] for record in records if record['succeeded'] and record['throughput']]
+        return {'transfers': len(records), 'failed_transfers': sum(not record['succeeded'] for record in records),
+                'retried_transfers': sum(record['attempts'] > 1 + record['hedged'] for record in records),
+                'hedged_transfers': sum(record['hedged'] for record in records),
+                'transferred_bytes': sum(record['bytes'] or 0 for record in records if record['succeeded']),
+                'median_throughput': statistics.median(throughputs) if throughputs else None}
+
+
+def _setting(value, variable, default):
+    return value if value is not None else os.environ.get(variable) or default
@@ -0,0 +1,105 @@
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import uuid
+
+
+CLEANUP_MODE_VARIABLE = 'MOODYS_TEMP_CLEANUP'
+CLEANUP_MODES = ['process', 'thread', 'sync']
+DEFAULT_CLEANUP_MODE = 'process'
+TRASH_DIRECTORY = os.path.join(tempfile.gettempdir(), 'cap-trash')
+_DELETE_SCRIPT = 'import shutil, sys\nfor path in sys.argv[1:]:\n    shutil.rmtree(path, ignore_errors=True)'
+
+_threads = []
+_threads_lock = threading.Lock()
+
+
+def moveToTrash(path, trash_directory=TRASH_DIRECTORY):
+    """
+    Move a file or directory out of the way with a single rename, so that it can be deleted off the critical path
+    :note: falls back to a hidden sibling if the trash directory is on another file system
+    :return: path of trashed file or directory, or None if path does not exist
+    """
+    if not os.path.lexists(path):
+        return None
+    name = f'{os.path.basename(os.path.normpath(path))}.{uuid.uuid4().hex}'
+    try:
+        os.makedirs(trash_directory, exist_ok=True)
+        trash_path = os.path.join(trash_directory, name)
+        os.rename(path, trash_path)
+    except OSError:
+        trash_path = os.path.join(os.path.dirname(os.path.normpath(path)), f'.{name}.trash')
+        os.rename(path, trash_path)
+    return trash_path
+
+
+def _delete(paths):
+    for path in paths:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def deletePaths(paths, mode=None):
+    """
+    Delete files and directories (e.g., returned by moveToTrash)
+    :param mode: 'process' (detached helper process that outlives this one), 'thread' (daemon thread) or 'sync'
+                 (default: MOODYS_TEMP_CLEANUP environment variable, else 'process')
+    """
+    logger = logging.getLogger(__name__)
+    paths = [path for path in paths if path]
+    mode = mode or os.environ.get(CLEANUP_MODE_VARIABLE) or DEFAULT_CLEANUP_MODE
+    if not paths:
+        return
+    if mode == 'process':
+        try:
+            subprocess.Popen([sys.executable, '-c', _DELETE_SCRIPT, *paths], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.DEVNULL, start_new_session=True, close_fds=True)
+            return
+        except OSError as e:
+            logger.debug(f'Unable to start cleanup process ({e}). Deleting in a thread')
+            mode = 'thread'
+    if mode == 'thread':
+        thread = threading.Thread(target=_delete, args=(paths,), name='TrashCleanup', daemon=True)
+        with _threads_lock:
+            _threads[:] = [t for t in _threads if t.is_alive()] + [thread]
+        thread.start()
+        return
+    _delete(paths)
+
+
+def trash(paths, mode=None, trash_directory=TRASH_DIRECTORY):
+    """
+    Move files and directories to trash and delete them in the background (see deletePaths for modes)
+    :return: list of trashed paths
+    """
+    trashed = [moveToTrash(path, trash_directory) for path in paths]
+    trashed = [path for path in trashed if path]
+    deletePaths(trashed, mode)
+    return trashed
+
+
+def emptyTrash(mode=None, trash_directory=TRASH_DIRECTORY):
+    """Delete everything left in the trash directory (e.g., by processes that exited before their cleanup finished)"""
+    try:
+        with os.scandir(trash_directory) as entries:
+            paths = [entry.path for entry in entries]
+    except FileNotFoundError:
+        return
+    deletePaths(paths, mode)
+
+
+def waitForBackgroundDeletes(timeout=None):
+    """Wait for deletes running in threads of this process to finish"""
+    with _threads_lock:
+        threads = list(_threads)
+    for thread in threads:
+        thread.join(timeout)
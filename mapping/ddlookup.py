@@ -0,0 +1,133 @@
+import json
+import numpy as np
+import os
+import pandas as pd
+
+
+INDEX_FILE = 'index.json'
+VALUE_COLUMNS = ['dma36mdd1']
+FORMAT_VERSION = 1
+VALUE_DTYPE = '<f8'  # Little-endian float64, as written by R's writeBin(size=8, endian='little')
+
+
+def _toNumeric(values):
+    """:return: numeric array of values, NaN where not numeric (strings are parsed once per distinct value)"""
+    values = np.asarray(values).ravel()
+    if values.dtype.kind in 'iuf':
+        return values
+    codes, uniques = pd.factorize(values)
+    return np.append(pd.to_numeric(pd.Series(uniques, dtype=object), errors='coerce').to_numpy(dtype='float64'), np.nan)[codes]
+
+
+def monthIndex(yearmonths):
+    """:return: months since year 0 (float array, NaN where yearmonth is missing or not of form YYYYMM)"""
+    years, months = np.divmod(_toNumeric(yearmonths), 100)
+    index = (years * 12 + months - 1).astype('float64')
+    index[(months < 1) | (months > 12)] = np.nan
+    return index
+
+
+def _compileTable(dd_data, name, value_columns):
+    """:return: ({file_name: sector x month matrix}, index entry) for one DD table"""
+    months = monthIndex(dd_data['yearmonth'])
+    sectors = dd_data['sector'].astype(str).to_numpy()
+    first = int(np.nanmin(months))
+    n_months = int(np.nanmax(months)) - first + 1
+    sector_codes = sorted(set(sectors))
+    columns = pd.Index(sector_codes).get_indexer(sectors)
+    rows = months.astype('int64') - first
+    matrices = {}
+    for value_column in value_columns:
+        matrix = np.full((len(sector_codes), n_months), np.nan, dtype=VALUE_DTYPE)
+        matrix[columns, rows] = dd_data[value_column].to_numpy(dtype='float64')
+        matrices[f'{name}.{value_column}.f64'] = matrix
+    yearmonths = pd.to_numeric(dd_data['yearmonth'])
+    return matrices, {'firstMonth': first, 'months': n_months, 'sectors': sector_codes, 'files': dict(zip(value_columns, matrices)),
+                      'minYearmonth': int(yearmonths.min()), 'maxYearmonth': int(yearmonths.max())}
+
+
+def compileDDLookup(dd_tables, model_dd_files, directory, value_columns=VALUE_COLUMNS):
+    """
+    Compile DD tables into dense (sector x month) matrices, the format written by bin/compile_dd_lookup.R
+
+    :param dd_tables: dictionary {dd_file: data frame with yearmonth, sector and value columns} (e.g., objects in DDdata.RData)
+    :param model_dd_files: dictionary {model_code: dd_file} (DDFile column of data/ModelToSheet.csv)
+    :param directory: directory to write index.json and one .f64 file per table and value column to
+    :return: path to index file
+    """
+    os.makedirs(directory, exist_ok=True)
+    tables = {}
+    for name, dd_data in dd_tables.items():
+        matrices, tables[name] = _compileTable(dd_data, name, value_columns)
+        for file_name, matrix in matrices.items():
+            matrix.tofile(os.path.join(directory, file_name))
+    models = {model: {'ddFile': name, 'minYearmonth': tables[name]['minYearmonth'], 'maxYearmonth': tables[name]['maxYearmonth']}
+              for model, name in model_dd_files.items() if name in tables}
+    index_path = os.path.join(directory, INDEX_FILE)
+    temp_path = f'{index_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump({'version': FORMAT_VERSION, 'tables': tables, 'models': models}, f, indent=2)
+    os.replace(temp_path, index_path)  # Written last, so readers never see an index without its matrices
+    return index_path
+
+
+class DDLookup:
+    """
+    DD values compiled from DDdata.RData, looked up by array indexing rather than merging on (yearmonth, sector)
+
+    :param directory: directory holding index.json written by bin/compile_dd_lookup.R or compileDDLookup
+    :note: matrices are memory-mapped, so only the pages touched by lookups are read
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_FILE)) as f:
+            index = json.load(f)
+        self.tables = index['tables'] or {}  # jsonlite writes empty named lists as []
+        self.models = index['models'] or {}
+        self._sectors = {name: pd.Index(table['sectors']) for name, table in self.tables.items()}
+        self._matrices = {}
+
+    def _matrix(self, dd_file, value_column):
+        key = (dd_file, value_column)
+        if key not in self._matrices:
+            table = self.tables[dd_file]
+            self._matrices[key] = np.memmap(os.path.join(self.directory, table['files'][value_column]), dtype=VALUE_DTYPE,
+                                            mode='r', shape=(len(table['sectors']), table['months']))
+        return self._matrices[key]
+
+    def lookup(self, dd_file, yearmonths, sectors, value_column=VALUE_COLUMNS[0]):
+        """
+        :param dd_file: name of DD table (DDFile of the model)
+        :param yearmonths: array-like of yearmonths (YYYYMM, numeric or string)
+        :param sectors: array-like of sector (or state) codes, same length as yearmonths
+        :return: float64 array of values, NaN where the table has no value (as left by a left merge)
+        """
+        table = self.tables[dd_file]
+        rows = monthIndex(yearmonths) - table['firstMonth']
+        codes, uniques = pd.factorize(pd.Series(np.asarray(sectors, dtype=object).ravel()))  # Match each distinct sector once
+        columns = np.append(self._sectors[dd_file].get_indexer(pd.Index(uniques).astype(str)), -1)[codes]  # Code -1 (missing) -> -1
+        found = (rows >= 0) & (rows < table['months']) & (columns >= 0)
+        values = np.full(len(rows), np.nan)
+        values[found] = self._matrix(dd_file, value_column)[columns[found], rows[found].astype('int64')]
+        return values
+
+    def dateRange(self, model):
+        """:return: (min_yearmonth, max_yearmonth) of the model's DD table, or None if the model has no DD table"""
+        model = self.models.get(model)
+        return (model['minYearmonth'], model['maxYearmonth']) if model else None
+
+    def inDateRange(self, model, yearmonths):
+        """:return: boolean array, True where yearmonth lies within the model's DD date range"""
+        date_range = self.dateRange(model)
+        yearmonths = _toNumeric(yearmonths)
+        if date_range is None:
+            return np.zeros(len(yearmonths), dtype=bool)
+        return (yearmonths >= date_range[0]) & (yearmonths <= date_range[1])
+
+
+def loadDDLookup(directory):
+    """:return: DDLookup for directory, or None if no compiled lookup exists there"""
+    if not os.path.isfile(os.path.join(directory, INDEX_FILE)):
+        return None
+    return DDLookup(directory)
@@ -0,0 +1,222 @@
+import hashlib
+import json
+import logging
+import numpy as np
+import os
+import pandas as pd
+import re
+import tempfile
+from mapping import mapping
+
+
+DTYPE_PLAN_DIRECTORY_VARIABLE = 'MOODYS_DTYPE_PLAN_DIRECTORY'
+DEFAULT_DTYPE_PLAN_DIRECTORY = os.path.join(tempfile.gettempdir(), 'cap-dtype-plans')
+DATE_FORMAT = '%Y-%m-%d'
+SAMPLE_ROWS = 10000
+CATEGORY_MAX_UNIQUE = 1000  # Columns with more distinct values than this (in the sample) stay object
+INTEGER_PATTERN = re.compile(r'^[+-]?\d+$')
+LEADING_ZERO_PATTERN = re.compile(r'^[+-]?0\d')  # Codes with leading zeros (e.g., zip codes) must stay strings
+BOOLEAN_STRINGS = {'true', 'false'}
+PLAN_VERSION = 2  # Persisted plans of another version are planned again (version 1 planned booleans as object-valued 'bool')
+INTEGER_DTYPES = ['Int8', 'Int16', 'Int32', 'Int64']  # Nullable integers, read natively by pandas (not via mapping.toInteger)
+
+
+def _headerSignature(columns, attributes=None):
+    """Key of a plan: the file's header and the (case-insensitive) attributes it was planned for"""
+    attributes = sorted({attribute.lower() for attribute in attributes}) if attributes is not None else None
+    return hashlib.sha256(json.dumps([[*columns], attributes]).encode('utf-8')).hexdigest()
+
+
+def _integerDtype(values, headroom):
+    """Smallest nullable integer dtype holding the sampled values, scaled by headroom for rows outside the sample"""
+    numbers = values.astype('int64')
+    low, high = int(numbers.min()) * headroom, int(numbers.max()) * headroom
+    for dtype in INTEGER_DTYPES:
+        info = np.iinfo(dtype.lower())
+        if info.min <= low and high <= info.max:
+            return dtype
+    return 'Int64'
+
+
+def _planColumn(series, date_format, category_max_ratio, downcast_floats, integer_headroom):
+    """:return: dtype for a sampled column of strings, or None to leave it to pandas (object)"""
+    values = series.dropna()
+    values = values[values.str.strip() != '']
+    if values.empty:
+        return None
+    numeric = values.map(LEADING_ZERO_PATTERN.match).isna().all()
+    if numeric and values.map(INTEGER_PATTERN.match).notna().all():
+        return _integerDtype(values, integer_headroom)
+    if numeric and pd.to_numeric(values, errors='coerce').notna().all():
+        return 'float32' if downcast_floats else 'float64'
+    if values.str.lower().isin(BOOLEAN_STRINGS).all():
+        return 'boolean'  # Nullable, so that missing values stay missing
+    if pd.to_datetime(values, format=date_format, errors='coerce').notna().all():
+        return 'datetime64[ns]'
+    unique = values.nunique()
+    if unique <= CATEGORY_MAX_UNIQUE and unique <= category_max_ratio * len(values):
+        return 'category'
+    return None
+
+
+def planDtypes(csv_path, attributes=None, sample_rows=SAMPLE_ROWS, date_format=DATE_FORMAT,
+               category_max_ratio=mapping.CATEGORY_MAX_RATIO, downcast_floats=False, integer_headroom=4, **kwargs):
+    """
+    Choose memory-efficient dtypes from a sample of rows at the start of a .csv file
+
+    :param csv_path: File path to file to plan
+    :param attributes: optional list of columns to plan (e.g., the model run parameters inputData attributes), case-insensitive
+    :param sample_rows: number of rows to sample
+    :param date_format: explicit format columns must match to be planned as datetime64
+    :param category_max_ratio: maximum ratio of distinct values to non-null sampled values for category dtype
+    :param downcast_floats: use float32 rather than float64 (loses precision beyond ~7 significant digits). Off by default, so that
+                            floats read as they would without a plan
+    :param integer_headroom: factor applied to the sampled integer range before choosing the smallest integer dtype
+    :param kwargs: Additional kwargs to pass to pandas.read_csv()
+    :return: Dict {column_name: dtype}, for use with mapping.readCsvWithCorrectDtypes
+    """
+    sample = pd.read_csv(csv_path, nrows=sample_rows, dtype=str, **kwargs)
+    if attributes is not None:
+        wanted = {attribute.lower() for attribute in attributes}
+        sample = sample[[column for column in sample.columns if column.lower() in wanted]]
+    plan = {column: _planColumn(sample[column], date_format, category_max_ratio, downcast_floats, integer_headroom) for column in sample.columns}
+    return {column: dtype for column, dtype in plan.items() if dtype is not None}
+
+
+class DtypePlanStore:
+    """
+    Plans persisted as one JSON file per input category, keyed by header signature, so later runs skip sampling
+
+    :param directory: directory to persist plans in (default: MOODYS_DTYPE_PLAN_DIRECTORY environment variable)
+    """
+
+    def __init__(self, directory=None):
+        self.logger = logging.getLogger(__name__)
+        self.directory = directory or os.environ.get(DTYPE_PLAN_DIRECTORY_VARIABLE) or DEFAULT_DTYPE_PLAN_DIRECTORY
+
+    def _path(self, category):
+        return os.path.join(self.directory, f'{category}.json')
+
+    def _load(self, category):
+        try:
+            with open(self._path(category)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, category, plans):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            temp_path = f'{self._path(category)}.{os.getpid()}.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump(plans, f, indent=2)
+            os.replace(temp_path, self._path(category))  # Atomic, so concurrent runs never read a partial plan
+        except OSError as e:
+            self.logger.warning(f'Unable to persist dtype plan for {category}: {e}')
+
+    def get(self, category, columns, attributes=None, date_format=DATE_FORMAT):
+        """:return: persisted dtypes for the given header, attributes and date format, or None"""
+        plan = self._load(category).get(_headerSignature(columns, attributes))
+        if plan is None or plan.get('dateFormat') != date_format or plan.get('version', 1) != PLAN_VERSION:
+            return None
+        return plan['dtypes']
+
+    def put(self, category, columns, dtypes, attributes=None, date_format=DATE_FORMAT):
+        plans = self._load(category)
+        plans[_headerSignature(columns, attributes)] = {'columns': [*columns], 'dateFormat': date_format, 'dtypes': dtypes, 'version': PLAN_VERSION}
+        self._save(category, plans)
+
+    def remove(self, category, columns, attributes=None):
+        plans = self._load(category)
+        if plans.pop(_headerSignature(columns, attributes), None) is not None:
+            self._save(category, plans)
+
+
+def getDtypePlan(csv_path, category, attributes=None, store=None, date_format=DATE_FORMAT, **kwargs):
+    """
+    Get the persisted dtype plan for a .csv file's header, planning and persisting one if none exists
+
+    :param csv_path: File path to file to plan
+    :param category: input category the plan is stored under (e.g., instrumentReference)
+    :param attributes: optional list of columns to plan (e.g., the model run parameters inputData attributes)
+    :param store: DtypePlanStore (default: store in MOODYS_DTYPE_PLAN_DIRECTORY)
+    :param kwargs: Additional kwargs to pass to planDtypes()
+    :return: Dict {column_name: dtype}
+    """
+    store = store or DtypePlanStore()
+    columns = pd.read_csv(csv_path, nrows=0).columns
+    dtypes = store.get(category, columns, attributes, date_format)
+    if dtypes is None:
+        dtypes = planDtypes(csv_path, attributes, date_format=date_format, **kwargs)
+        store.put(category, columns, dtypes, attributes, date_format)
+    return dtypes
+
+
+def _plannedRead(csv_path, category, attributes, dtypes, store, date_format):
+    """
+    :return: tuple of (dtypes: plan overridden by dtypes, date formats: {column: date_format} of columns the plan typed as datetime,
+             function(column) removing the plan if dates of a column do not match date_format)
+    """
+    logger = logging.getLogger(__name__)
+    overrides = {column.lower() for column in dtypes}
+    plan = {column: dtype for column, dtype in getDtypePlan(csv_path, category, attributes, store=store, date_format=date_format).items()
+            if column.lower() not in overrides}
+    date_formats = {column: date_format for column, dtype in plan.items() if 'datetime64' in dtype}  # Overrides are parsed by inference
+    misfits = set()
+
+    def onDateMisfit(column):
+        if not misfits:
+            logger.warning(f'Dates in {column} of {os.path.basename(csv_path)} do not match {date_format}. Parsing by inference, re-planning on next run')
+            store.remove(category, pd.read_csv(csv_path, nrows=0).columns, attributes)
+        misfits.add(column)
+    return {**plan, **dtypes}, date_formats, onDateMisfit
+
+
+def readCsvWithPlannedDtypes(csv_path, category, attributes=None, dtypes={}, store=None, date_format=DATE_FORMAT, **kwargs):
+    """
+    Read .csv file with a persisted dtype plan, falling back to an unplanned read if the plan does not fit the file
+
+    :param csv_path: File path to file to read
+    :param category: input category the plan is stored under (e.g., instrumentReference)
+    :param attributes: optional list of columns to plan (e.g., the model run parameters inputData attributes)
+    :param dtypes: Dict {column_name: pandas.dtype} overriding planned dtypes. Dates of overrides are parsed by format inference
+    :param store: DtypePlanStore (default: store in MOODYS_DTYPE_PLAN_DIRECTORY)
+    :param date_format: format of columns the plan typed as datetime. Columns with dates in another format are parsed by inference
+    :param kwargs: Additional kwargs to pass to mapping.readCsvWithCorrectDtypes()
+    :return: Data frame
+    """
+    logger = logging.getLogger(__name__)
+    store = store or DtypePlanStore()
+    try:
+        plan, date_formats, on_date_misfit = _plannedRead(csv_path, category, attributes, dtypes, store, date_format)
+        return mapping.readCsvWithCorrectDtypes(csv_path, plan, date_format=date_formats, on_date_misfit=on_date_misfit, **kwargs)
+    except (TypeError, ValueError, OverflowError) as e:
+        logger.warning(f'Dtype plan for {category} does not fit {os.path.basename(csv_path)} ({e}). Reading without plan')
+        store.remove(category, pd.read_csv(csv_path, nrows=0).columns, attributes)  # Re-plan on next run
+        return mapping.readCsvWithCorrectDtypes(csv_path, dtypes, date_format={}, **kwargs)
+
+
+def readCsvChunksWithPlannedDtypes(csv_path, category, chunksize, attributes=None, dtypes={}, store=None, date_format=DATE_FORMAT, **kwargs):
+    """
+    Read .csv file with a persisted dtype plan, chunksize rows at a time (see readCsvWithPlannedDtypes)
+
+    :param chunksize: number of rows per chunk (e.g., as fits a memory budget)
+    :note: if the plan does not fit a chunk, that chunk and the rest of the file are read without plan, with the same kwargs
+    :return: generator of data frames
+    """
+    logger = logging.getLogger(__name__)
+    store = store or DtypePlanStore()
+    plan, date_formats, on_date_misfit = _plannedRead(csv_path, category, attributes, dtypes, store, date_format)
+    rows = 0
+    try:
+        for chunk in mapping.readCsvChunksWithCorrectDtypes(csv_path, chunksize, plan, date_format=date_formats, on_date_misfit=on_date_misfit,
+                                                            **kwargs):
+            rows += len(chunk.index)
+            yield chunk
+        return
+    except (TypeError, ValueError, OverflowError) as e:
+        logger.warning(f'Dtype plan for {category} does not fit {os.path.basename(csv_path)} ({e}). Reading rest of file without plan')
+        store.remove(category, pd.read_csv(csv_path, nrows=0).columns, attributes)  # Re-plan on next run
+    for chunk in mapping.readCsvChunksWithCorrectDtypes(csv_path, chunksize, dtypes, date_format={}, skiprows=range(1, rows + 1), **kwargs):
+        chunk.index += rows
+        yield chunk
@@ -0,0 +1,90 @@
+import functools
+import logging
+import os
+import subprocess
+from mapping import mapping
+
+
+FEATHER = 'feather'
+CSV = 'csv'
+EXTENSIONS = {FEATHER: '.feather', CSV: '.csv'}
+R_ARROW_CHECK = ['Rscript', '-e', 'quit(status = if (requireNamespace("arrow", quietly = TRUE)) 0 else 1)']
+
+
+def arrowAvailable():
+    """:return: True if pyarrow can be imported (optional dependency, needed for feather handoff)"""
+    try:
+        import pyarrow.feather  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+@functools.lru_cache(maxsize=None)
+def rArrowAvailable():
+    """:return: True if the model engine's R installation has the arrow package (needed to read a feather handoff), checked once per process"""
+    try:
+        return subprocess.run(R_ARROW_CHECK, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=60).returncode == 0
+    except (OSError, subprocess.SubprocessError):
+        return False
+
+
+def handoffFormat(requested=None):
+    """:return: requested format, or feather if both pyarrow and the arrow package in R are available and csv if not"""
+    if requested == FEATHER and not arrowAvailable():
+        logging.getLogger(__name__).warning('pyarrow is not installed. Falling back to csv handoff')
+        return CSV
+    return requested or (FEATHER if arrowAvailable() and rArrowAvailable() else CSV)
+
+
+def writeFrame(data_frame, directory, name, format=None):
+    """
+    Write a typed data frame for the model engine to read, as uncompressed feather (memory-mappable) or csv
+    :param directory: handoff directory
+    :param name: file name without extension (e.g., instrumentReference)
+    :param format: 'feather' or 'csv' (default: feather if pyarrow and the arrow package in R are available, see handoffFormat)
+    :note: falls back to csv if the frame cannot be represented in Arrow (e.g., mixed-type object columns)
+    :return: path to written file
+    """
+    logger = logging.getLogger(__name__)
+    os.makedirs(directory, exist_ok=True)
+    format = handoffFormat(format)
+    if format == FEATHER:
+        file_path = os.path.join(directory, name + EXTENSIONS[FEATHER])
+        try:
+            data_frame.reset_index(drop=True).to_feather(file_path, compression='uncompressed')
+            return file_path
+        except Exception as e:  # pyarrow.ArrowInvalid, ArrowTypeError, ...
+            logger.warning(f'Unable to write {name} as feather ({e}). Falling back to csv handoff')
+            if os.path.exists(file_path):
+                os.remove(file_path)
+    return mapping.writeCsv(data_frame, os.path.join(directory, name + EXTENSIONS[CSV]))
+
+
+def readFrame(file_path, columns=None, **kwargs):
+    """
+    Read a handoff file written by writeFrame or by the model engine
+    :param columns: optional list of columns to read
+    :param kwargs: Additional kwargs to pass to mapping.readCsvWithCorrectDtypes() for csv files
+    :return: Data frame
+    """
+    if os.path.splitext(file_path)[1] == EXTENSIONS[FEATHER]:
+        from pyarrow import feather  # Deferred, as pyarrow is optional
+        return feather.read_table(file_path, columns=columns, memory_map=True).to_pandas()
+    return mapping.readCsvWithCorrectDtypes(file_path, usecols=columns, **kwargs)
+
+
+def readFrames(directory):
+    """
+    Read all handoff files in a directory (e.g., results written back by the model engine)
+    :return: dictionary of form {file_name_wo_ext: (file_path, data_frame)}
+    """
+    frames = {}
+    try:
+        with os.scandir(directory) as entries:
+            file_paths = sorted(entry.path for entry in entries if entry.is_file() and os.path.splitext(entry.name)[1] in EXTENSIONS.values())
+    except FileNotFoundError:
+        return frames
+    for file_path in file_paths:
+        frames[os.path.splitext(os.path.basename(file_path))[0]] = (file_path, readFrame(file_path))
+    return frames
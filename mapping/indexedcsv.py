@@ -0,0 +1,144 @@
+import bisect
+import csv
+import heapq
+import io
+import json
+import os
+import pandas as pd
+
+
+INDEX_EXTENSION = '.idx'  # Uploaded next to the csv as data.idx (see IOSession.uploadDestination)
+FORMAT_VERSION = 1
+KEY = 'instrumentidentifier'
+ROW_GROUP_ROWS = 1000
+
+
+def indexPath(csv_path):
+    """:return: path of the sidecar index of a .csv file (e.g., instrumentRiskMetric.idx for instrumentRiskMetric.csv)"""
+    return os.path.splitext(csv_path)[0] + INDEX_EXTENSION
+
+
+def _sortedRun(csv_path, columns, key, run_path):
+    """Sort one .csv file (e.g., a shard's output) by key, stably and without parsing values, aligned to columns"""
+    frame = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+    frame = frame.rename(columns={column: column.lower() for column in frame.columns}).reindex(columns=[column.lower() for column in columns])
+    frame.fillna('').sort_values(key.lower(), kind='mergesort').to_csv(run_path, index=False, header=False)
+    return run_path
+
+
+def _readRun(run_path):
+    with open(run_path, 'r', newline='', encoding='utf-8') as f:
+        yield from csv.reader(f)
+
+
+def writeIndexedCsv(csv_paths, out_path, key=KEY, row_group_rows=ROW_GROUP_ROWS):
+    """
+    Write .csv files (e.g., outputs of shards) as one .csv file sorted by key, in row groups of row_group_rows rows, with a sidecar
+    index of each row group's key range and byte range (see IndexedCsv)
+
+    :param csv_paths: list of .csv files. Each is sorted in memory, then all are merged, so memory use is bounded by the largest file
+    :param key: column to sort by (case-insensitive), compared as strings
+    :note: columns are those of the first file (case-insensitive). The order of rows with equal keys is kept
+    :return: out_path
+    """
+    with open(csv_paths[0], 'r', newline='', encoding='utf-8') as f:
+        columns = next(csv.reader(f), [])
+    key_columns = [column for column in columns if column.lower() == key.lower()]
+    if not key_columns:
+        raise ValueError(f'{os.path.basename(csv_paths[0])} has no {key} column')
+    key_position = columns.index(key_columns[0])
+    temp_path = f'{out_path}.{os.getpid()}.tmp'
+    run_paths = [f'{out_path}.{os.getpid()}.{index}.run' for index in range(len(csv_paths))]
+    row_groups = []
+    try:
+        for csv_path, run_path in zip(csv_paths, run_paths):
+            _sortedRun(csv_path, columns, key, run_path)
+        rows = heapq.merge(*[_readRun(run_path) for run_path in run_paths], key=lambda row: row[key_position])  # Stable across runs
+        with open(temp_path, 'wb') as out_file:
+            out_file.write(_csvBytes([columns]))
+            group = []
+            for row in rows:
+                group.append(row)
+                if len(group) == row_group_rows:
+                    row_groups.append(_writeRowGroup(out_file, group, key_position))
+                    group = []
+            if group:
+                row_groups.append(_writeRowGroup(out_file, group, key_position))
+        os.replace(temp_path, out_path)
+    finally:
+        for path in [temp_path, *run_paths]:
+            if os.path.exists(path):
+                os.remove(path)
+    index = {'version': FORMAT_VERSION, 'key': key_columns[0], 'columns': columns, 'size': os.path.getsize(out_path), 'rowGroups': row_groups}
+    temp_index_path = f'{indexPath(out_path)}.{os.getpid()}.tmp'
+    with open(temp_index_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(temp_index_path, indexPath(out_path))
+    return out_path
+
+
+def _csvBytes(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows(rows)
+    return buffer.getvalue().encode('utf-8')
+
+
+def _writeRowGroup(out_file, group, key_position):
+    """Write a row group. :return: index entry [first_key, last_key, byte_offset, byte_length, rows]"""
+    offset = out_file.tell()
+    data = _csvBytes(group)
+    out_file.write(data)
+    return [group[0][key_position], group[-1][key_position], offset, len(data), len(group)]
+
+
+class IndexedCsv:
+    """
+    Random access by key to a .csv file written by writeIndexedCsv, reading only the row groups that may hold the keys
+
+    :param csv_path: path to sorted .csv file (e.g., instrumentRiskMetric.csv, or data.csv as uploaded)
+    :param index_path: path to its index (default: indexPath(csv_path))
+    :raise ValueError: if the index does not belong to the file (e.g., the file was rewritten since)
+    """
+
+    def __init__(self, csv_path, index_path=None):
+        self.csv_path = csv_path
+        with open(index_path or indexPath(csv_path)) as f:
+            index = json.load(f)
+        if index.get('version') != FORMAT_VERSION or index['size'] != os.path.getsize(csv_path):
+            raise ValueError(f'Index of {csv_path} is out of date')
+        self.key = index['key']
+        self.columns = index['columns']
+        self.row_groups = index['rowGroups']
+        self._first_keys = [row_group[0] for row_group in self.row_groups]
+
+    def _groups(self, key):
+        """:return: positions of row groups whose key range holds key"""
+        end = bisect.bisect_right(self._first_keys, key)
+        start = end
+        while start > 0 and self.row_groups[start - 1][1] >= key:  # Rows of one key may span several row groups
+            start -= 1
+        return range(start, end)
+
+    def lookup(self, keys):
+        """
+        :param keys: key or list of keys (e.g., instrumentidentifiers)
+        :return: data frame (of strings) of all rows with the given keys, in key order
+        """
+        keys = sorted({str(key) for key in ([keys] if isinstance(keys, str) else keys)})
+        groups = sorted({group for key in keys for group in self._groups(key)})
+        reads = []
+        for group in groups:  # Adjacent row groups are read in one go
+            offset, length = self.row_groups[group][2:4]
+            if reads and reads[-1][0] + reads[-1][1] == offset:
+                reads[-1][1] += length
+            else:
+                reads.append([offset, length])
+        chunks = []
+        with open(self.csv_path, 'rb') as f:
+            for offset, length in reads:
+                f.seek(offset)
+                chunks.append(f.read(length))
+        if not chunks:
+            return pd.DataFrame(columns=self.columns, dtype=str)
+        frame = pd.read_csv(io.BytesIO(b''.join(chunks)), names=self.columns, header=None, dtype=str, keep_default_na=False)
+        return frame[frame[self.key].isin(keys)].reset_index(drop=True)
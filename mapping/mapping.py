@@ -1,3 +1,8 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+import io
+import multiprocessing
+import numpy as np
 import os
 import pandas as pd
 import shutil
@@ -5,58 +10,141 @@ import shutil
 
 TRUTHY = {True, 'true', '1', '1.0', 1, 1.0}
 FALSEY = {False, 'false', '0', '0.0', 0, 0.0}
-NULLNA = {None, '', pd.np.NaN, pd.NaT}
+NULLNA = {None, '', np.NaN, pd.NaT}
+HEADER_REPLACEMENTS = {'–': '-'}  # pandas chokes on en-dashes (4 byte utf8 char)
+HEADER_ENCODING = 'cp1252'
+CATEGORY_MAX_RATIO = 0.5  # Suggested maximum ratio of distinct values to rows for category dtype (see mapEnums, dtypeplan)
+CSV_DATE_FORMAT = '%Y-%m-%d'
+CSV_FLOAT_FORMAT = '%.6f'  # Matches rounding to 6 digits on the R side
+CSV_CHUNK_ROWS = 100000  # Frames with more rows are serialized in row-block chunks on a process pool
 
 
-def readCsvWithCorrectDtypes(csv_path, dtypes={}, **kwargs):
-    """
-    Read .csv files with provided datatypes, case-insensitively
+@lru_cache(maxsize=256)
+def _columnResolver(columns):
+    """Case-insensitive column lookup {lowercase_column: column}, cached per header signature (tuple of columns)"""
+    return {column.lower(): column for column in columns}
 
-    :param csv_path: File path to file to read
-    :param dtypes: Dict {column_name: pandas.dtype}
-    :param kwargs: Additional kwargs to pass to pandas.read_csv()
-    :note: usecol kwarg given additional support for case-insensitivity
-    :not supported: .csv files containing duplicate columns (case-insensitive)
-    :return: Data frame
+
+@lru_cache(maxsize=256)
+def _cachedLowercaseEnums(enum_items):
+    return {key.lower(): value for key, value in enum_items}
+
+
+def _lowercaseEnums(enums):
+    try:
+        return _cachedLowercaseEnums(tuple(enums.items()))
+    except TypeError:  # Unhashable enum values cannot be cached
+        return {key.lower(): value for key, value in enums.items()}
+
+
+def _prepareCsvRead(csv_path, dtypes, kwargs):
+    """
+    Resolve dtypes and usecols against the file's header, case-insensitively
+    :return: tuple of (csv_path, pandas.read_csv kwargs, (date_columns, bool_columns, int_columns)) for _correctDtypes
     """
 
     # Get columns from csv and create lowercase mapping for use later
-    csv_columns = {column.lower(): column for column in pd.read_csv(csv_path, nrows=0).columns}
+    if hasattr(csv_path, 'read'):
+        header = csv_path.readline()
+        csv_path = _PrefixedTextStream(header, csv_path)  # Put the consumed header back in front of the stream
+        header_columns = pd.read_csv(io.StringIO(header), nrows=0).columns
+        kwargs['memory_map'] = False
+    else:
+        header_columns = pd.read_csv(csv_path, nrows=0, encoding=kwargs.get('encoding')).columns
+    csv_columns = _columnResolver(tuple(header_columns))
 
-    # Create separate mapping data structures for problematic dtypes
+    # Create separate mapping data structures for problematic dtypes (nullable 'Int64' etc. are left to pandas)
     int_columns = {column for column, dtype in dtypes.items() if 'int' in dtype}
-    bool_columns = {column for column, dtype in dtypes.items() if 'bool' in dtype}
+    bool_columns = {column: dtype for column, dtype in dtypes.items() if 'bool' in dtype}
     date_columns = {column for column, dtype in dtypes.items() if 'datetime64' in dtype}
 
     # Filter problematic types out of dtypes and set case properly
-    dtypes = {column: dtypes[column] for column in ({*dtypes} - int_columns - bool_columns - date_columns)}
+    dtypes = {column: dtypes[column] for column in ({*dtypes} - int_columns - {*bool_columns} - date_columns)}
     dtypes = {column.lower(): dtype for column, dtype in dtypes.items()}
     dtypes = {csv_columns.get(column): dtype for column, dtype in dtypes.items() if csv_columns.get(column)}
 
     # If usecols kwarg supplied, set column casing correctly
-    usecols = {csv_columns.get(column.lower()) for column in kwargs.get('usecols', [])}
+    usecols = {csv_columns.get(column.lower()) for column in kwargs.get('usecols') or []}
     kwargs['usecols'] = (usecols - {None}) or None
 
-    # Process kwargs and read csv
+    # Process kwargs
     kwargs = {'low_memory': False, 'memory_map': True, 'dtype': dtypes, **kwargs}
-    df = pd.read_csv(csv_path, **kwargs)
+    return csv_path, kwargs, (date_columns, bool_columns, int_columns)
+
+
+def _parseDates(series, date_format, on_date_misfit=None):
+    """
+    Parse a column of dates, with an explicit format if given (much faster than inferring formats)
+    :note: if the format leaves dates unparsed that were in the source, the column is parsed again with format inference, and
+           on_date_misfit(column) is called
+    """
+    dates = pd.to_datetime(series, format=date_format, errors='coerce')
+    if date_format is not None and (dates.isna() & series.notna() & series.astype(str).str.strip().ne('')).any():
+        if on_date_misfit is not None:
+            on_date_misfit(series.name)
+        dates = pd.to_datetime(series, errors='coerce')
+    return dates
+
+
+def _correctDtypes(df, columns, date_format=None, on_date_misfit=None):
+    """
+    Convert the date, bool and int columns returned by _prepareCsvRead, which pandas.read_csv() does not handle well
+    :param date_format: explicit format of all date columns, or dict {column: format} of some (others are inferred)
+    """
+    date_columns, bool_columns, int_columns = columns
+
+    # Columns given in dtypes but absent from the file (or not in usecols) are skipped
+    df_columns = _columnResolver(tuple(df.columns))
+    present = lambda columns: [df_columns[column.lower()] for column in columns if column.lower() in df_columns]
 
     # Process datetime columns separately, as pd.to_datetime() handles errors better than pd.read_csv()
-    for date_column in date_columns:
-        df[date_column] = pd.to_datetime(df[date_column], errors='coerce')
+    date_formats = {column.lower(): column_format for column, column_format in date_format.items()} if isinstance(date_format, dict) else None
+    for date_column in present(date_columns):
+        column_format = date_formats.get(date_column.lower()) if date_formats is not None else date_format
+        df[date_column] = _parseDates(df[date_column], column_format, on_date_misfit)
 
-    # Process boolean columns separately, as pandas will break if a bool column has NaNs
-    for bool_column in bool_columns:
-        df[bool_column] = toBoolean(df[bool_column])
+    # Process boolean columns separately, as pandas will break if a bool column has NaNs. Nullable 'boolean' columns keep their dtype
+    bool_dtypes = {column.lower(): dtype for column, dtype in bool_columns.items()}
+    for bool_column in present(bool_columns):
+        values = toBoolean(df[bool_column])
+        df[bool_column] = pd.array(values, dtype='boolean') if bool_dtypes[bool_column.lower()] == 'boolean' else values
 
     # Process integer columns separately, as pandas will break if an int column has NaNs
-    for int_column in int_columns:
+    for int_column in present(int_columns):
         df[int_column] = toInteger(df[int_column])
-
-    # Return data frame, optionally lowercasing columns
     return df
 
 
+def readCsvWithCorrectDtypes(csv_path, dtypes={}, date_format=None, on_date_misfit=None, **kwargs):
+    """
+    Read .csv files with provided datatypes, case-insensitively
+
+    :param csv_path: File path to file to read, or a readable text stream (e.g., from cleanOutputHeaders)
+    :param dtypes: Dict {column_name: pandas.dtype}
+    :param date_format: optional explicit format of datetime64 columns (much faster than inferring formats), or dict {column: format}
+                        of some of them (others are inferred). Columns with dates not matching their format are parsed by inference
+    :param on_date_misfit: optional function(column) called for columns with dates not matching their format
+    :param kwargs: Additional kwargs to pass to pandas.read_csv()
+    :note: usecol kwarg given additional support for case-insensitivity
+    :not supported: .csv files containing duplicate columns (case-insensitive)
+    :return: Data frame
+    """
+    csv_path, kwargs, columns = _prepareCsvRead(csv_path, dtypes, kwargs)
+    return _correctDtypes(pd.read_csv(csv_path, **kwargs), columns, date_format, on_date_misfit)
+
+
+def readCsvChunksWithCorrectDtypes(csv_path, chunksize, dtypes={}, date_format=None, on_date_misfit=None, **kwargs):
+    """
+    Read .csv files with provided datatypes, case-insensitively, chunksize rows at a time (see readCsvWithCorrectDtypes)
+    :param chunksize: number of rows per chunk (e.g., as fits a memory budget)
+    :return: generator of data frames, with a RangeIndex continuing across chunks
+    """
+    csv_path, kwargs, columns = _prepareCsvRead(csv_path, dtypes, kwargs)
+    with pd.read_csv(csv_path, chunksize=max(int(chunksize), 1), **kwargs) as reader:
+        for chunk in reader:
+            yield _correctDtypes(chunk, columns, date_format, on_date_misfit)
+
+
 def toBoolean(series):
     series = series.map(str).map(str.lower)
     return [True if val in TRUTHY else False if val in FALSEY else None for val in series]
@@ -68,63 +156,268 @@ def toInteger(series):
         try:
             x = int(val)
         except ValueError:
-            x = pd.np.NaN
+            x = np.NaN
         new_series.append(x)
-    return pd.Series(new_series, dtype='object')
+    return pd.Series(new_series, index=series.index, dtype='object')
+
 
+def _formatDates(data_frame, date_format):
+    """Replace datetime columns with their string representation, so that chunks do not format dates separately"""
+    date_columns = [column for column, dtype in data_frame.dtypes.items() if pd.api.types.is_datetime64_any_dtype(dtype)]
+    if not date_columns:
+        return data_frame
+    data_frame = data_frame.copy(deep=False)
+    for column in date_columns:
+        data_frame[column] = data_frame[column].dt.strftime(date_format)
+    return data_frame
 
-def createCsvFilesFromDataFrames(data_frame_dict, directory, scenario_name=None, **to_csv_kwargs):
+
+def _processPool(max_workers=None):
+    """
+    Process pool whose workers are not forked from this process. The caller usually has threads running (batch runs, the log writer,
+    transfers), and a forked child inherits their locks (e.g., the logging lock) in whatever state they were in, which can deadlock it
     """
-    Create temp files from data frames
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(method))
+
+
+def _serializeCsvChunk(data_frame, header, to_csv_kwargs):
+    return data_frame.to_csv(None, header=header, **to_csv_kwargs)
+
+
+def writeCsv(data_frame, file_path, chunk_rows=CSV_CHUNK_ROWS, max_workers=None, executor=None,
+             date_format=CSV_DATE_FORMAT, float_format=None, **to_csv_kwargs):
+    """
+    Write data frame to csv, serializing row-block chunks on a process pool and concatenating them in order
+    :param data_frame: data frame to write
+    :param file_path: path of csv file
+    :param chunk_rows: number of rows per chunk. Frames with at most this many rows are written directly
+    :param max_workers: number of worker processes (default: number of CPUs). 1 disables chunking
+    :param executor: optional concurrent.futures executor to serialize chunks on (e.g., shared between files)
+    :param date_format: format of datetime columns, applied once to the whole frame
+    :param float_format: optional fixed float format (e.g., CSV_FLOAT_FORMAT)
+    :param to_csv_kwargs: Keyword arguments to pass to pandas.DataFrame.to_csv()
+    :return: file_path
+    """
+    to_csv_kwargs = {'index': False, **to_csv_kwargs, 'float_format': float_format}
+    encoding = to_csv_kwargs.pop('encoding', None) or 'utf-8'
+    data_frame = _formatDates(data_frame, date_format)
+    chunk_rows = max(int(chunk_rows), 1)
+    chunks = [data_frame.iloc[start:start + chunk_rows] for start in range(0, len(data_frame.index), chunk_rows)] or [data_frame]
+    if executor is None and (len(chunks) == 1 or max_workers == 1):
+        data_frame.to_csv(file_path, encoding=encoding, **to_csv_kwargs)
+        return file_path
+    header = to_csv_kwargs.pop('header', True)
+    owned_executor = None
+    if executor is None:
+        executor = owned_executor = _processPool(max_workers=min(max_workers or os.cpu_count() or 1, len(chunks)))
+    try:
+        window = 2 * (getattr(executor, '_max_workers', None) or 1)  # Bound number of serialized chunks held in memory
+        with open(file_path, 'w', encoding=encoding, newline='') as f:
+            pending = []
+            for index, chunk in enumerate(chunks):
+                pending.append(executor.submit(_serializeCsvChunk, chunk, header if index == 0 else False, to_csv_kwargs))
+                if len(pending) >= window:
+                    f.write(pending.pop(0).result())
+            for future in pending:
+                f.write(future.result())
+    finally:
+        if owned_executor is not None:
+            owned_executor.shutdown()
+    return file_path
+
+
+def createCsvFilesFromDataFrames(data_frame_dict, directory, scenario_name=None, max_workers=None, float_format=None, **to_csv_kwargs):
+    """
+    Create temp files from data frames, writing several frames concurrently
     :param data_frame_dict: dict of data frames {name: data_frame}
     :param scenario_name: If given scenario name will be appended to the file name
-    :param read_csv_kwargs: Keyword arguments to pass to pandas.DataFrame.to_csv()
+    :param max_workers: number of worker processes to serialize csv chunks on (default: number of CPUs). 1 writes serially
+    :param float_format: optional fixed float format (e.g., CSV_FLOAT_FORMAT for parity with rounding on the R side)
+    :param to_csv_kwargs: Keyword arguments to pass to writeCsv() and pandas.DataFrame.to_csv()
     :return: dict of file paths to temp files {name: file_path}
     """
-    return_files = {}
-    to_csv_kwargs = {'date_format': '%Y-%m-%d', 'index': False, **to_csv_kwargs}
-    for name, data_frame in data_frame_dict.items():
-        file_name = name + (f'_{scenario_name}' if scenario_name else '') + '.csv'
-        file_path = os.path.join(directory, file_name)
-        data_frame.to_csv(file_path, **to_csv_kwargs)
-        return_files[name] = file_path
-    return return_files
+    file_paths = {name: os.path.join(directory, name + (f'_{scenario_name}' if scenario_name else '') + '.csv') for name in data_frame_dict}
+    total_rows = sum(len(data_frame.index) for data_frame in data_frame_dict.values())
+    chunk_rows = to_csv_kwargs.get('chunk_rows', CSV_CHUNK_ROWS)
+    if max_workers == 1 or total_rows <= chunk_rows:
+        for name, data_frame in data_frame_dict.items():
+            writeCsv(data_frame, file_paths[name], max_workers=1, float_format=float_format, **to_csv_kwargs)
+        return file_paths
+    with _processPool(max_workers=max_workers) as executor, ThreadPoolExecutor(max_workers=len(data_frame_dict)) as writers:
+        futures = [writers.submit(writeCsv, data_frame, file_paths[name], executor=executor, float_format=float_format, **to_csv_kwargs)
+                   for name, data_frame in data_frame_dict.items()]
+        for future in futures:
+            future.result()
+    return file_paths
+
+
+def projectCsv(csv_path, columns, out_path=None, chunksize=CSV_CHUNK_ROWS, **kwargs):
+    """
+    Copy only the given columns of a .csv file, case-insensitively and without parsing values
+    :param csv_path: File path to file to project
+    :param columns: columns to keep. Columns not in the file are ignored
+    :param out_path: File path to write projected file to (default: replace csv_path)
+    :param chunksize: number of rows to hold in memory at a time
+    :param kwargs: Additional kwargs to pass to pandas.read_csv()
+    :return: out_path (or csv_path)
+    """
+    wanted = {column.lower() for column in columns}
+    temp_path = f'{out_path or csv_path}.{os.getpid()}.tmp'
+    kwargs = {'dtype': str, 'keep_default_na': False, **kwargs, 'usecols': lambda column: column.lower() in wanted, 'chunksize': chunksize}
+    with open(temp_path, 'w', newline='') as f:
+        header = True
+        for chunk in pd.read_csv(csv_path, **kwargs):
+            chunk.to_csv(f, index=False, header=header)
+            header = False
+        if header:  # File has no rows
+            pd.read_csv(csv_path, nrows=0, usecols=kwargs['usecols']).to_csv(f, index=False)
+    os.replace(temp_path, out_path or csv_path)
+    return out_path or csv_path
+
+
+def concatenateCsv(csv_paths, out_path):
+    """
+    Concatenate .csv files (e.g., outputs of shards) into one, keeping the header of the first file, without parsing values
+    :note: files whose headers differ are aligned by column name (columns missing from a file are left empty)
+    :return: out_path
+    """
+    headers = []
+    for csv_path in csv_paths:
+        with open(csv_path, 'r', newline='') as f:
+            headers.append(f.readline().rstrip('\r\n'))
+    temp_path = f'{out_path}.{os.getpid()}.tmp'
+    if len(set(headers)) > 1:
+        frames = [pd.read_csv(csv_path, dtype=str, keep_default_na=False) for csv_path in csv_paths]
+        pd.concat(frames, ignore_index=True, sort=False).to_csv(temp_path, index=False)
+    else:
+        with open(temp_path, 'wb') as out_file:
+            for index, csv_path in enumerate(csv_paths):
+                with open(csv_path, 'rb') as f:
+                    if index > 0:
+                        f.readline()  # Header
+                    shutil.copyfileobj(f, out_file)
+    os.replace(temp_path, out_path)
+    return out_path
 
 
 def reindexCaseInsensitively(data_frame, reindex_columns):
-    to_columns = {column.lower(): column for column in reindex_columns}
-    data_frame = data_frame.rename(columns=str.lower).rename(columns=to_columns)
-    return data_frame.reindex(columns=reindex_columns, fill_value='')
+    """Reindex columns case-insensitively, renaming matches to the casing of reindex_columns and filling missing columns with ''"""
+    resolver = _columnResolver(tuple(data_frame.columns))
+    to_columns = {resolver[column.lower()]: column for column in reindex_columns if column.lower() in resolver}
+    return data_frame.rename(columns=to_columns, copy=False).reindex(columns=reindex_columns, fill_value='', copy=False)
+
+
+def _mapSeriesEnums(series, enums, category_max_ratio=None):
+    """Map a series through lowercase enums, lowercasing and looking up each distinct value once"""
+    codes, uniques = pd.factorize(series)
+    mapped = np.array([enums.get(str.lower(value), np.NaN) for value in uniques], dtype=object)
+    if category_max_ratio is not None and len(uniques) <= category_max_ratio * len(series):
+        mapped_codes, categories = pd.factorize(mapped)
+        codes = np.append(mapped_codes, -1)[codes]  # Missing values (code -1) stay missing
+        return pd.Series(pd.Categorical.from_codes(codes, categories), index=series.index, name=series.name)
+    return pd.Series(np.append(mapped, np.NaN)[codes], index=series.index, name=series.name).infer_objects()
 
 
-def mapEnums(df, enum_mapping):
-    """ Map the enums of columns in a data frame case-insensitively """
-    map_to_original_columns = {column.lower(): column for column in df}
-    df = df.rename(columns=str.lower)
+def mapEnums(df, enum_mapping, inplace=False, category_max_ratio=None):
+    """
+    Map the enums of columns in a data frame case-insensitively
+
+    :param df: data frame
+    :param enum_mapping: dict {column_name: {enum: mapped_value}}
+    :param inplace: modify df instead of returning a shallow copy
+    :param category_max_ratio: optional maximum ratio of distinct values to rows for returning a mapped column as category dtype
+                               (e.g., CATEGORY_MAX_RATIO). By default, mapped columns are not categorical
+    :note: unmatched values are mapped to NaN
+    :return: data frame with mapped columns
+    """
+    df = df if inplace else df.copy(deep=False)
+    resolver = _columnResolver(tuple(df.columns))
     for column, enums in enum_mapping.items():
-        enums = {k.lower(): v for k, v in enums.items()}
-        df[column.lower()] = df[column.lower()].map(str.lower, na_action='ignore').map(enums, na_action='ignore')
-    return df.rename(columns=map_to_original_columns)
+        df_column = resolver[column.lower()]
+        df[df_column] = _mapSeriesEnums(df[df_column], _lowercaseEnums(enums), category_max_ratio)
+    return df
+
+
+class _PrefixedTextStream(io.TextIOBase):
+    """Read-only text stream returning a replacement first line, followed by the rest of an underlying text stream"""
+
+    def __init__(self, first_line, stream):
+        self._prefix = first_line
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data, self._prefix = self._prefix + self._stream.read(), ''
+            return data
+        data, self._prefix = self._prefix[:size], self._prefix[size:]
+        return data + self._stream.read(size - len(data)) if len(data) < size else data
+
+    def readline(self, size=-1):
+        if self._prefix:
+            data, self._prefix = self._prefix, ''
+            return data
+        return self._stream.readline(size)
 
+    def close(self):
+        self._stream.close()
+        super().close()
 
-def cleanOutputHeaders(files):
+
+def _cleanHeaderLine(line):
+    for bad, good in HEADER_REPLACEMENTS.items():
+        line = line.replace(bad, good)
+    return line
+
+
+def _cleanHeaderCopy(in_file_path):
+    file, ext = os.path.splitext(in_file_path)
+    out_file_path = f'{file}_cleaned{ext}'
+    with open(in_file_path, 'r', encoding=HEADER_ENCODING) as in_file:
+        line = _cleanHeaderLine(in_file.readline())
+        with open(out_file_path, 'w') as out_file:
+            out_file.write(line)
+            shutil.copyfileobj(in_file, out_file)
+    return out_file_path
+
+
+def _cleanHeaderStream(in_file_path):
+    in_file = open(in_file_path, 'r', encoding=HEADER_ENCODING)
+    return _PrefixedTextStream(_cleanHeaderLine(in_file.readline()), in_file)
+
+
+def _cleanHeaderInPlace(in_file_path):
+    with open(in_file_path, 'r+b') as f:
+        raw_line = f.readline()
+        line = raw_line.decode(HEADER_ENCODING)
+        cleaned = _cleanHeaderLine(line).encode(HEADER_ENCODING)
+        if len(cleaned) != len(raw_line):
+            return _cleanHeaderStream(in_file_path)
+        if cleaned != raw_line:
+            f.seek(0)
+            f.write(cleaned)
+    return in_file_path
+
+
+def cleanOutputHeaders(files, mode='copy', max_workers=None):
     """
     Replace non-standard characters in CSV file columns so pandas can do its thing.
 
     :param files: dict of {name: path to possibly unreadable (by pandas) file}
-    :return: path to cleaned file
-    """
-    return_files = {}
-    map_bad_chars_to_good = {'–': '-'}  # pandas chokes on en-dashes (4 byte utf8 char)
-    for name, in_file_path in files.items():
-        file, ext = os.path.splitext(in_file_path)
-        out_file_path = f'{file}_cleaned{ext}'
-        return_files[name] = out_file_path
-        with open(in_file_path, 'r', encoding='cp1252') as in_file:
-            line = in_file.readline()
-            for bad, good in map_bad_chars_to_good.items():
-                line = line.replace(bad, good)
-            with open(out_file_path, 'w') as out_file:
-                out_file.write(line)
-                shutil.copyfileobj(in_file, out_file)
-    return return_files
+    :param mode: 'copy' to write a re-encoded {file}_cleaned copy,
+                 'inplace' to patch the header bytes in the original file (stays cp1252 encoded, read it with encoding='cp1252'),
+                 'stream' to return a text stream that rewrites only the header line while it is read
+    :param max_workers: number of files processed concurrently
+    :note: 'inplace' falls back to 'stream' when the cleaned header has a different byte length
+    :note: streams can be passed to readCsvWithCorrectDtypes, and must be closed by the caller
+    :return: dict of {name: path to cleaned file, or text stream}
+    """
+    clean = {'copy': _cleanHeaderCopy, 'inplace': _cleanHeaderInPlace, 'stream': _cleanHeaderStream}[mode]
+    if len(files) <= 1 or mode == 'stream':
+        return {name: clean(in_file_path) for name, in_file_path in files.items()}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {name: executor.submit(clean, in_file_path) for name, in_file_path in files.items()}
+    return {name: future.result() for name, future in futures.items()}
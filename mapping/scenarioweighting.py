@@ -0,0 +1,82 @@
+import csv
+import itertools
+import numpy as np
+import os
+import pandas as pd
+
+
+PARTITION_FILE_NAME = 'data.csv'  # As uploaded under scenarioPartition=... (see IOSession.uploadDestination)
+KEY_COLUMNS = ['instrumentidentifier', 'term']
+VALUE_COLUMNS = ['annualizedcumulativepd', 'maturityriskpd']
+SCENARIO_COLUMNS = ['scenarioidentifier', 'inputscenarioidentifier']  # Dropped from the weighted output
+CHUNK_ROWS = 100000
+
+
+def partitionPath(category_directory, scenario_name, file_name=PARTITION_FILE_NAME):
+    """:return: path of a scenario's output in an output category directory (e.g., instrumentRiskMetric/scenarioPartition=BASE/data.csv)"""
+    return os.path.join(category_directory, f'scenarioPartition={scenario_name}', file_name)
+
+
+def normalizedWeights(weights):
+    """
+    :param weights: list of scenario weights (e.g., iosession.Scenario.weight of each scenario)
+    :return: numpy array of the weights scaled to sum to 1
+    :raise ValueError: if a weight is missing or negative, or all are 0
+    """
+    try:
+        weights = np.array([float(weight) for weight in weights])
+    except (TypeError, ValueError):
+        raise ValueError(f'Scenario weights must be numbers: {weights}')
+    if (weights < 0).any() or weights.sum() <= 0:
+        raise ValueError(f'Scenario weights must not be negative and must not all be 0: {weights.tolist()}')
+    return weights / weights.sum()
+
+
+def writeWeightedTermStructure(csv_paths, weights, out_path, key_columns=KEY_COLUMNS, value_columns=VALUE_COLUMNS, chunksize=CHUNK_ROWS):
+    """
+    Write the probability-weighted average of scenario outputs (e.g., instrumentRiskMetric of each scenarioPartition), reading all
+    scenarios in aligned chunks, so that memory use is bounded by chunksize rows per scenario rather than by the size of the outputs
+
+    :param csv_paths: list of .csv files, one per scenario, with the same rows (key_columns) in the same order
+    :param weights: list of scenario weights, in the order of csv_paths (scaled to sum to 1, see normalizedWeights)
+    :param key_columns: columns identifying a row (case-insensitive), which must be equal across scenarios
+    :param value_columns: columns to weight (case-insensitive), parsed as floats. A value missing in any scenario is missing in the output.
+                          Value columns missing from the first file are ignored
+    :note: other columns are taken from the first file, except scenario identifiers (SCENARIO_COLUMNS), which are dropped
+    :raise ValueError: if the files are not aligned (different rows, row order or row count)
+    :return: out_path
+    """
+    weights = normalizedWeights(weights)
+    if len(weights) != len(csv_paths):
+        raise ValueError(f'Got {len(weights)} weights for {len(csv_paths)} scenario outputs')
+    with open(csv_paths[0], 'r', newline='') as f:
+        columns = [column for column in next(csv.reader(f), []) if column.lower() not in SCENARIO_COLUMNS]
+    readers = [pd.read_csv(csv_path, dtype=str, keep_default_na=False, chunksize=chunksize) for csv_path in csv_paths]
+    temp_path = f'{out_path}.{os.getpid()}.tmp'
+    try:
+        with open(temp_path, 'w', newline='') as out_file:
+            csv.writer(out_file, lineterminator='\n').writerow(columns)
+            for index, chunks in enumerate(itertools.zip_longest(*readers)):
+                if any(chunk is None for chunk in chunks):
+                    raise ValueError(f'Scenario outputs have different numbers of rows: {csv_paths}')
+                chunks = [chunk.rename(columns=str.lower) for chunk in chunks]
+                first = chunks[0]
+                keys = [column.lower() for column in key_columns if column.lower() in first.columns]
+                values = [column.lower() for column in value_columns if column.lower() in first.columns]
+                for csv_path, chunk in zip(csv_paths[1:], chunks[1:]):
+                    if not all(column in chunk.columns and np.array_equal(chunk[column].to_numpy(), first[column].to_numpy()) for column in keys):
+                        raise ValueError(f'Rows of {csv_path} are not aligned with {csv_paths[0]} at chunk {index}')
+                weighted = np.zeros((len(first.index), len(values)))
+                for weight, chunk in zip(weights, chunks):
+                    weighted += weight * chunk.reindex(columns=values).apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+                out = first.reindex(columns=[column.lower() for column in columns])
+                out[values] = weighted
+                out.to_csv(out_file, index=False, header=False, lineterminator='\n')
+        os.replace(temp_path, out_path)
+    finally:
+        for reader in readers:
+            reader.close()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return out_path
+
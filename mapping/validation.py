@@ -0,0 +1,104 @@
+import numpy as np
+import os
+import pandas as pd
+from mapping import ddlookup
+
+
+MODEL_TO_SHEET_FILE = 'ModelToSheet.csv'
+DD_LOOKUP_DIRECTORY = 'ddlookup'
+IDENTIFIER = 'instrumentidentifier'
+PORTFOLIO = 'portfolioidentifier'
+TTC_PD = 'ttcannualizedpdoneyear'
+MODEL_CODE = 'privatefirmmodelname'
+ERROR_ATTRIBUTES = [IDENTIFIER, PORTFOLIO]  # Identify invalid instruments in instrumentError rows, so they must be read with the attributes checked
+REQUIRED_ATTRIBUTES = {TTC_PD: 'TTC PD', MODEL_CODE: 'Model Code'}  # Labels as in getCCAEDF error messages
+DD_LAG_MONTHS = 2  # DD data is used as of 2 months before the analysis date (see getCCAEDF)
+ERROR_CODE = '100'
+MODULE_CODE = 'PIT Coverter'  # As written by run_model.R
+
+
+def ddYearmonth(analysis_date):
+    """:return: yearmonth (YYYYMM) of the DD data used for an analysis date"""
+    month = analysis_date.year * 12 + analysis_date.month - 1 - DD_LAG_MONTHS
+    return (month // 12) * 100 + month % 12 + 1
+
+
+def _blank(series):
+    """:return: boolean array, True where series is missing or an empty string"""
+    blank = series.isna().to_numpy()
+    if series.dtype == object or isinstance(series.dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(series.dtype):
+        blank |= series.astype(str).str.strip().eq('').to_numpy()
+    return blank
+
+
+class InstrumentValidator:
+    """
+    Check instruments before scoring, with one columnar mask per check rather than a pass per instrument, so that invalid
+    instruments are reported without being handed to the model engine
+
+    :param model_codes: model codes the engine supports (Model column of data/ModelToSheet.csv)
+    :param dd_lookup: optional ddlookup.DDLookup. If given with analysis_date, instruments whose model has no DD data for the
+                      analysis date are invalid
+    :param analysis_date: date instruments are scored as of (earlier of reporting date and run date)
+    """
+
+    def __init__(self, model_codes, dd_lookup=None, analysis_date=None):
+        self.model_codes = pd.Index(sorted({*model_codes}))
+        self.dd_lookup = dd_lookup
+        self.analysis_date = analysis_date
+
+    def _column(self, data_frame, columns, attribute):
+        column = columns.get(attribute)
+        return data_frame[column] if column is not None else pd.Series(None, index=data_frame.index, dtype=object)
+
+    def _outOfDateRange(self, models, known):
+        """:return: boolean array, True where a known model has a DD table that does not cover the analysis date"""
+        if self.dd_lookup is None or self.analysis_date is None:
+            return np.zeros(len(models), dtype=bool)
+        yearmonth = ddYearmonth(self.analysis_date)
+        codes, uniques = pd.factorize(models)
+        out_of_range = np.array([self.dd_lookup.dateRange(model) is not None and not self.dd_lookup.inDateRange(model, [yearmonth])[0]
+                                 for model in uniques] + [False])
+        return out_of_range[codes] & known
+
+    def validate(self, data_frame):
+        """
+        :param data_frame: instrumentReference data frame (attribute names matched case-insensitively)
+        :return: tuple of (data frame of valid instruments, data frame of instrumentError rows for invalid instruments)
+        """
+        columns = {column.lower(): column for column in data_frame.columns}
+        n_rows = len(data_frame.index)
+        messages = np.full(n_rows, '', dtype=object)
+        missing = {}
+        for attribute, label in REQUIRED_ATTRIBUTES.items():
+            missing[attribute] = _blank(self._column(data_frame, columns, attribute))
+            messages[missing[attribute]] += f'{label} is required; '
+
+        not_numeric = pd.to_numeric(self._column(data_frame, columns, TTC_PD), errors='coerce').isna().to_numpy() & ~missing[TTC_PD]
+        messages[not_numeric] += 'TTC PD is not a number; '
+
+        models = self._column(data_frame, columns, MODEL_CODE).astype(object).to_numpy()
+        known = self.model_codes.get_indexer(models) >= 0
+        unknown = ~known & ~missing[MODEL_CODE]
+        messages[unknown] += 'Model Code ' + pd.Series(models[unknown], dtype=object).astype(str).to_numpy() + ' is not supported; '
+        messages[self._outOfDateRange(models, known)] += "'Current Date': Current Date Range is invalid;"
+
+        invalid = messages != ''
+        errors = pd.DataFrame({
+            'errorMessage': messages[invalid],
+            'errorCode': ERROR_CODE,
+            'moduleCode': MODULE_CODE,
+            'portfolioIdentifier': self._column(data_frame, columns, PORTFOLIO).to_numpy()[invalid],
+            'instrumentIdentifier': self._column(data_frame, columns, IDENTIFIER).to_numpy()[invalid]
+        })
+        return data_frame[~invalid], errors
+
+
+def loadInstrumentValidator(data_directory, analysis_date=None):
+    """
+    :param data_directory: directory holding ModelToSheet.csv and, if compiled, the DD lookup (see bin/compile_dd_lookup.R)
+    :param analysis_date: date instruments are scored as of. The DD date range is checked only if given and the DD lookup is compiled
+    :return: InstrumentValidator
+    """
+    model_codes = pd.read_csv(os.path.join(data_directory, MODEL_TO_SHEET_FILE), usecols=['Model'], dtype=str)['Model'].dropna()
+    return InstrumentValidator(model_codes, ddlookup.loadDDLookup(os.path.join(data_directory, DD_LOOKUP_DIRECTORY)), analysis_date)
@@ -0,0 +1,97 @@
+"""
+DD lookup benchmark (not collected by pytest)
+
+Times looking up DD values for synthetic instruments by merging on (yearmonth, sector), as getCCAEDF does without a
+compiled lookup, against array indexing into the dense matrix compiled by mapping.ddlookup, and compares them against
+the baseline recorded in baseline.ini.
+
+usage: python tests/benchmarks/bench_ddlookup.py [-i INSTRUMENTS] [-n REPEATS] [--record]
+"""
+import argparse
+import configparser
+import numpy as np
+import os
+import pandas as pd
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+TEST_DIRECTORY = os.path.dirname(BENCHMARK_DIRECTORY)
+PACKAGE_DIRECTORY = os.path.dirname(TEST_DIRECTORY)
+sys.path.extend([TEST_DIRECTORY, PACKAGE_DIRECTORY])
+from mapping import ddlookup
+
+BASELINE_FILE = os.path.join(BENCHMARK_DIRECTORY, 'baseline.ini')
+SECTION = 'ddlookup'
+SECTORS = [f'Sector{i:02d}' for i in range(40)] + ['NATION'] + [f'STATE{i:02d}' for i in range(50)]
+YEARMONTHS = [year * 100 + month for year in range(1990, 2021) for month in range(1, 13)]
+
+
+def syntheticData(instruments, seed=0):
+    """:return: (DD table of every yearmonth and sector, instruments with yearmonth.dd and sector)"""
+    random = np.random.default_rng(seed)
+    grid = pd.MultiIndex.from_product([YEARMONTHS, SECTORS], names=['yearmonth', 'sector']).to_frame(index=False)
+    dd_data = grid.assign(dma36mdd1=random.normal(size=len(grid.index)))
+    data = pd.DataFrame({'yearmonth.dd': random.choice(YEARMONTHS + [202112], instruments),  # Some outside the table
+                         'sector': random.choice(SECTORS + ['Unassigned'], instruments)})
+    return dd_data, data
+
+
+def timeCall(function, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), result
+
+
+def measure(instruments, repeats):
+    dd_data, data = syntheticData(instruments)
+    directory = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        ddlookup.compileDDLookup({'DDusa': dd_data}, {'USA 4.0': 'DDusa'}, directory)
+        compile_ms = (time.perf_counter() - start) * 1000
+        lookup = ddlookup.DDLookup(directory)
+
+        def merge():
+            merged = data.merge(dd_data, how='left', left_on=['yearmonth.dd', 'sector'], right_on=['yearmonth', 'sector'])
+            return merged['dma36mdd1'].to_numpy(), (merged['yearmonth.dd'] < dd_data['yearmonth'].min()) | (merged['yearmonth.dd'] > dd_data['yearmonth'].max())
+
+        def index():
+            return lookup.lookup('DDusa', data['yearmonth.dd'], data['sector']), ~lookup.inDateRange('USA 4.0', data['yearmonth.dd'])
+
+        merge_ms, (merged, merge_invalid) = timeCall(merge, repeats)
+        lookup_ms, (looked_up, lookup_invalid) = timeCall(index, repeats)
+        assert np.array_equal(merged, looked_up, equal_nan=True) and np.array_equal(merge_invalid, lookup_invalid)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return {name: round(value, 1) for name, value in
+            {'compile_ms': compile_ms, 'merge_ms': merge_ms, 'lookup_ms': lookup_ms, 'speedup': merge_ms / lookup_ms}.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark DD lookup against merging')
+    parser.add_argument('-i', '--instruments', type=int, default=1000000, help='Number of synthetic instruments')
+    parser.add_argument('-n', '--repeats', type=int, default=5, help='Number of timed lookups')
+    parser.add_argument('--record', action='store_true', help='Record results as the new baseline')
+    args = parser.parse_args()
+
+    results = measure(args.instruments, args.repeats)
+    baseline = configparser.ConfigParser()
+    baseline.read(BASELINE_FILE)
+    recorded = baseline[SECTION] if baseline.has_section(SECTION) else {}
+    for name, value in results.items():
+        previous = recorded.get(name)
+        print(f'{name:<28} {value:>10.1f}' + (f'   (baseline {float(previous):.1f})' if previous else ''))
+    if args.record:
+        baseline[SECTION] = {name: str(value) for name, value in results.items()}
+        with open(BASELINE_FILE, 'w') as f:
+            baseline.write(f)
+
+
+if __name__ == '__main__':
+    main()
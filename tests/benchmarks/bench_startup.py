@@ -0,0 +1,73 @@
+"""
+Startup benchmark for the CLI entry point (not collected by pytest)
+
+Measures wall-clock time of `run.py -h` and the -X importtime cost of the modules the model run path imports,
+and compares them against the baseline recorded in baseline.ini.
+
+usage: python tests/benchmarks/bench_startup.py [-n REPEATS] [--record]
+"""
+import argparse
+import configparser
+import os
+import statistics
+import subprocess
+import sys
+import time
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+TEST_DIRECTORY = os.path.dirname(BENCHMARK_DIRECTORY)
+PACKAGE_DIRECTORY = os.path.dirname(TEST_DIRECTORY)
+sys.path.extend([TEST_DIRECTORY, PACKAGE_DIRECTORY])
+from test_startup import RUN_SCRIPT, getImportTimes
+
+BASELINE_FILE = os.path.join(BENCHMARK_DIRECTORY, 'baseline.ini')
+SECTION = 'startup'
+# Modules imported at load time of the model run path before imports were deferred
+MODEL_PATH_MODULES = ['pandas', 'moodyscappy', 'boto3']
+
+
+def timeHelp(repeats):
+    """:return: median wall-clock milliseconds of `python run.py -h`"""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, RUN_SCRIPT, '-h'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def importCost(module):
+    """:return: cumulative -X importtime milliseconds of a module, or None if it is not installed"""
+    if subprocess.run([sys.executable, '-c', f'import {module}'], stderr=subprocess.DEVNULL).returncode != 0:
+        return None
+    return getImportTimes(['-c', f'import {module}'])[module][0] / 1000
+
+
+def measure(repeats):
+    results = {'run_help_wall_ms': timeHelp(repeats)}
+    results['run_help_import_ms'] = sum(cumulative for cumulative, top in getImportTimes([RUN_SCRIPT, '-h']).values() if top) / 1000
+    for module in MODEL_PATH_MODULES:
+        results[f'{module}_import_ms'] = importCost(module)
+    return {name: round(value, 1) for name, value in results.items() if value is not None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CLI startup')
+    parser.add_argument('-n', '--repeats', type=int, default=10, help='Number of timed runs of run.py -h')
+    parser.add_argument('--record', action='store_true', help='Record results as the new baseline')
+    args = parser.parse_args()
+
+    results = measure(args.repeats)
+    baseline = configparser.ConfigParser()
+    baseline.read(BASELINE_FILE)
+    recorded = baseline[SECTION] if baseline.has_section(SECTION) else {}
+    for name, value in results.items():
+        previous = recorded.get(name)
+        print(f'{name:<28} {value:>10.1f}' + (f'   (baseline {float(previous):.1f})' if previous else ''))
+    if args.record:
+        baseline[SECTION] = {name: str(value) for name, value in results.items()}
+        with open(BASELINE_FILE, 'w') as f:
+            baseline.write(f)
+
+
+if __name__ == '__main__':
+    main()
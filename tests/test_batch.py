@@ -0,0 +1,60 @@
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+TEST_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIRECTORY = os.path.dirname(TEST_DIRECTORY)
+MODEL_DIRECTORY = os.path.join(PACKAGE_DIRECTORY, 'cap', 'model')
+SAMPLE_TEST_DIRECTORY = os.path.join(TEST_DIRECTORY, 'sample-test')
+sys.path.extend([TEST_DIRECTORY, PACKAGE_DIRECTORY, MODEL_DIRECTORY])
+import batch
+import sessionpool
+from test_sessionpool import FakeCappy
+
+
+class TestBatch(unittest.TestCase):
+
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.mrp_paths = []
+        for name in ['portfolio-a', 'portfolio-b']:
+            test_folder = os.path.join(self.directory, name)
+            shutil.copytree(SAMPLE_TEST_DIRECTORY, test_folder, ignore=shutil.ignore_patterns('benchmark', 'output'))
+            self.mrp_paths.append(os.path.join(test_folder, 'modelRunParameter.json'))
+        self.session_pool = sessionpool.SessionPool(session_factory=FakeCappy)
+        logging.getLogger().setLevel(logging.INFO)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+    def test_expand_local_glob(self):
+        paths = batch.expandLocalPaths([os.path.join(self.directory, '*', '*.json'), self.mrp_paths[0]])
+        assert paths == self.mrp_paths
+
+
+    def test_batch_runs_share_sessions_and_isolate_logs(self):
+        FakeCappy.instances = []
+        credentials = {'username': 'user', 'password': 'pw'}
+        results = batch.runBatch(self.mrp_paths, True, credentials, {}, workers=2, session_pool=self.session_pool)
+        assert [exit_code for _, _, exit_code in results] == [0, 0]
+        assert len(FakeCappy.instances) == 1
+        for (run_id, mrp_path, _), (other_run_id, _, _) in zip(results, reversed(results)):
+            with open(os.path.join(os.path.dirname(mrp_path), 'output', 'log', 'log.log')) as f:
+                log = f.read()
+            assert f'Starting run {run_id}' in log
+            assert f'Starting run {other_run_id}' not in log
+
+
+    def test_summary_exit_code(self):
+        assert batch.printSummary([('run0000', 'a.json', 0), ('run0001', 'b.json', 0)]) == 0
+        assert batch.printSummary([('run0000', 'a.json', 0), ('run0001', 'b.json', 1)]) == 1
+        assert batch.printSummary([]) == 1
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+TEST_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIRECTORY = os.path.dirname(TEST_DIRECTORY)
+MODEL_DIRECTORY = os.path.join(PACKAGE_DIRECTORY, 'cap', 'model')
+SAMPLE_TEST_DIRECTORY = os.path.join(TEST_DIRECTORY, 'sample-test')
+sys.path.extend([TEST_DIRECTORY, PACKAGE_DIRECTORY, MODEL_DIRECTORY])
+import checkpoint
+import iosession
+
+
+class TestRunCheckpoint(unittest.TestCase):
+
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cleanup_mode = mock.patch.dict(os.environ, {'MOODYS_TEMP_CLEANUP': 'sync'})
+        self.cleanup_mode.start()
+
+
+    def tearDown(self):
+        self.cleanup_mode.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+    def test_progress_survives_to_resumed_run(self):
+        run = checkpoint.RunCheckpoint('run', directory=self.directory)
+        run.verify('mrp-md5')
+        run.complete('inputs', files={'instrumentReference': '/tmp/instrumentReference.csv'})
+        run.completeShard('scoring', 0)
+        run.close()
+        resumed = checkpoint.RunCheckpoint('run', directory=self.directory, resume=True)
+        assert resumed.verify('mrp-md5')
+        assert resumed.details('inputs') == {'files': {'instrumentReference': '/tmp/instrumentReference.csv'}}
+        assert resumed.isShardComplete('scoring', 0) and not resumed.isShardComplete('scoring', 1)
+
+
+    def test_run_without_resume_starts_over(self):
+        run = checkpoint.RunCheckpoint('run', directory=self.directory)
+        run.verify('mrp-md5')
+        run.complete('inputs')
+        os.makedirs(run.work_directory)
+        run.close()
+        fresh = checkpoint.RunCheckpoint('run', directory=self.directory)
+        assert not fresh.resumed and not fresh.isComplete('inputs')
+        assert not os.path.exists(run.work_directory)
+
+
+    def test_changed_model_run_parameters_start_over(self):
+        run = checkpoint.RunCheckpoint('run', directory=self.directory)
+        run.verify('mrp-md5')
+        run.complete('inputs')
+        run.close()
+        resumed = checkpoint.RunCheckpoint('run', directory=self.directory, resume=True)
+        assert not resumed.verify('other-md5')
+        assert not resumed.isComplete('inputs')
+
+
+    def test_in_memory_without_directory(self):
+        with mock.patch.dict(os.environ, {checkpoint.CHECKPOINT_DIRECTORY_VARIABLE: ''}):
+            run = checkpoint.RunCheckpoint('run', resume=True)
+        assert not run.persistent and not run.resumed and run.work_directory is None
+        run.complete('inputs')
+        assert run.isComplete('inputs')
+
+
+    def test_checkpoint_id_is_stable(self):
+        mrp_path = os.path.join(SAMPLE_TEST_DIRECTORY, 'modelRunParameter.json')
+        assert checkpoint.checkpointId(mrp_path) == checkpoint.checkpointId(os.path.relpath(mrp_path))
+        assert checkpoint.checkpointId('mrp/a.json') != checkpoint.checkpointId('mrp/b.json')
+
+
+    def test_resumed_session_keeps_files_and_skips_uploads(self):
+        test_folder = os.path.join(self.directory, 'sample-test')
+        shutil.copytree(SAMPLE_TEST_DIRECTORY, test_folder, ignore=shutil.ignore_patterns('benchmark', 'output'))
+        mrp_path = os.path.join(test_folder, 'modelRunParameter.json')
+        checkpoints = os.path.join(self.directory, 'checkpoints')
+
+        run = checkpoint.RunCheckpoint(checkpoint.checkpointId(mrp_path), directory=checkpoints)
+        io_session = iosession.IOSession(None, mrp_path, True, checkpoint=run)
+        assert io_session.local_temp_directory == run.work_directory
+        output_path = os.path.join(io_session.local_directories['outputPaths']['instrumentRiskMetric'], 'instrumentRiskMetric.csv')
+        with open(output_path, 'w') as f:
+            f.write('instrumentidentifier,term\nLoan001,1\n')
+        io_session.uploadFiles({'instrumentRiskMetric': output_path})
+        assert io_session.metrics['uploaded_files'] == 1
+        run.close()
+
+        resumed = checkpoint.RunCheckpoint(checkpoint.checkpointId(mrp_path), directory=checkpoints, resume=True)
+        io_session = iosession.IOSession(None, mrp_path, True, checkpoint=resumed)
+        assert io_session.resumed and os.path.isfile(output_path)
+        io_session.uploadFiles({'instrumentRiskMetric': output_path})
+        assert io_session.metrics['skipped_files'] == 1 and io_session.metrics['uploaded_files'] == 0
+        with open(output_path, 'a') as f:
+            f.write('Loan001,2\n')
+        io_session.uploadFiles({'instrumentRiskMetric': output_path})
+        assert io_session.metrics['uploaded_files'] == 1
+
+
+
+    def test_checkpoint_in_use_is_left_alone(self):
+        run = checkpoint.RunCheckpoint('run', directory=self.directory)
+        run.verify('mrp-md5')
+        run.complete('inputs')
+        os.makedirs(run.work_directory)
+        concurrent = checkpoint.RunCheckpoint('run', directory=self.directory)
+        assert not concurrent.persistent and concurrent.work_directory is None
+        assert run.isComplete('inputs') and os.path.isdir(run.work_directory)
+        run.close()
+        resumed = checkpoint.RunCheckpoint('run', directory=self.directory, resume=True)
+        assert resumed.persistent and resumed.verify('mrp-md5')
+
+
+    def test_resumable(self):
+        run = checkpoint.RunCheckpoint('run', directory=self.directory)
+        run.verify('mrp-md5')
+        assert not run.resumable('uploads')  # Nothing done yet
+        run.complete('inputs')
+        assert run.resumable('uploads')
+        run.complete('uploads')
+        assert not run.resumable('uploads')  # Nothing left to do
+        with mock.patch.dict(os.environ, {checkpoint.CHECKPOINT_DIRECTORY_VARIABLE: ''}):
+            in_memory = checkpoint.RunCheckpoint('other')
+        in_memory.complete('inputs')
+        assert not in_memory.resumable('uploads')
+
+
+    def test_old_checkpoints_are_pruned(self):
+        in_progress = checkpoint.RunCheckpoint('in-progress', directory=self.directory)
+        in_progress.verify('mrp-md5')
+        for index in range(4):
+            run = checkpoint.RunCheckpoint(f'run{index}', directory=self.directory)
+            run.verify('mrp-md5')
+            os.utime(run.directory, (index, index))  # Oldest first
+            run.close()
+        os.utime(in_progress.directory, (0, 0))
+        latest = checkpoint.RunCheckpoint('latest', directory=self.directory)
+        latest.verify('mrp-md5')
+        remaining = sorted(name for name in os.listdir(self.directory) if not name.endswith(checkpoint.LOCK_SUFFIX))
+        assert remaining == ['in-progress', 'latest', 'run1', 'run2', 'run3']  # 3 most recent kept besides the current run, runs in progress are never removed
+        latest.close()
+        in_progress.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
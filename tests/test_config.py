@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+TEST_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIRECTORY = os.path.dirname(TEST_DIRECTORY)
+MODEL_DIRECTORY = os.path.join(PACKAGE_DIRECTORY, 'cap', 'model')
+sys.path.extend([TEST_DIRECTORY, PACKAGE_DIRECTORY, MODEL_DIRECTORY])
+from cap.config import config
+import transfer
+
+
+class TestRunLogContext(unittest.TestCase):
+
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.root_handlers = logging.getLogger().handlers[:]
+        self.disabled = {name: logger.disabled for name, logger in logging.Logger.manager.loggerDict.items() if isinstance(logger, logging.Logger)}
+        self.global_log_file = os.path.join(self.directory, 'global.log')
+        config.configureLogger('DEBUG', log_file=self.global_log_file)
+        self.logger = logging.getLogger(self.id())  # Created after configureLogger, which disables existing loggers
+
+
+    def tearDown(self):
+        config.stopLogger()
+        logging.getLogger().handlers = self.root_handlers
+        for name, logger in logging.Logger.manager.loggerDict.items():
+            if isinstance(logger, logging.Logger):
+                logger.disabled = self.disabled.get(name, False)  # fileConfig disables loggers that existed before it was called
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+
+    def test_concurrent_runs_write_separate_logs(self):
+        def logRun(run_id):
+            with config.RunLogContext(run_id, directory=os.path.join(self.directory, run_id)) as run_log:
+                for i in range(50):
+                    self.logger.info(f'{run_id} message {i}')
+                run_log.flush()
+                return self.read(run_log.log_file)
+
+        run_ids = [f'run{i}' for i in range(4)]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            logs = dict(zip(run_ids, executor.map(logRun, run_ids)))
+        for run_id, log in logs.items():
+            assert log.count(f'{run_id} message') == 50
+            assert not [other for other in run_ids if other != run_id and other + ' message' in log]
+        for handler in logging.getLogger().handlers:
+            handler.flush()
+        assert self.read(self.global_log_file).count(' message ') == 200
+
+
+    def test_owned_directory_removed_on_exit(self):
+        with config.RunLogContext('owned') as run_log:
+            self.logger.info('hello')
+            assert os.path.isfile(run_log.log_file)
+        assert not os.path.exists(run_log.directory)
+
+
+    def test_transfer_threads_log_to_run(self):
+        with config.RunLogContext('transfers', directory=self.directory) as run_log:
+            transfer.TransferScheduler(timeout=5, retries=0).run('key', lambda attempt: self.logger.info(f'attempt {attempt} in thread'))
+            run_log.flush()
+            assert 'attempt 0 in thread' in self.read(run_log.log_file)
+        config.stopLogger()
+        logging.getLogger().handlers[0].flush()  # No-op once the log writer is stopped
+
+
+    def test_do_not_log_modules_are_filtered(self):
+        with config.RunLogContext('filtered', directory=self.directory) as run_log:
+            logging.getLogger(config.DO_NOT_LOG_MODULES[0]).warning('noisy')
+            self.logger.warning('useful')
+            run_log.flush()
+            log = self.read(run_log.log_file)
+        assert 'useful' in log
+        assert 'noisy' not in log
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import numpy as np
+import os
+import pandas as pd
+import shutil
+import sys
+import tempfile
+import unittest
+TEST_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIRECTORY = os.path.dirname(TEST_DIRECTORY)
+sys.path.extend([TEST_DIRECTORY, PACKAGE_DIRECTORY])
+from mapping import ddlookup
+
+
+class TestDDLookup(unittest.TestCase):
+
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.dd_data = pd.DataFrame({
+            'yearmonth': [201811, 201812, 201901, 201901, 201903],  # No data for 201902
+            'sector': ['Agriculture', 'Agriculture', 'Agriculture', 'NATION', 'NATION'],
+            'dma36mdd1': [0.1, 0.2, 0.3, 1.3, 1.5]
+        })
+        ddlookup.compileDDLookup({'DDusa': self.dd_data}, {'USA 4.0': 'DDusa'}, self.directory)
+        self.lookup = ddlookup.DDLookup(self.directory)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+    def test_lookup_matches_merge(self):
+        instruments = pd.DataFrame({
+            'yearmonth': ['201901', '201812', '201902', '201901', '202001', '201811', None],
+            'sector': ['Agriculture', 'Agriculture', 'NATION', 'Unassigned', 'NATION', 'NATION', 'NATION']
+        })
+        merged = instruments.assign(yearmonth=pd.to_numeric(instruments['yearmonth'])).merge(self.dd_data, how='left', on=['yearmonth', 'sector'])
+        values = self.lookup.lookup('DDusa', instruments['yearmonth'], instruments['sector'])
+        np.testing.assert_array_equal(values, merged['dma36mdd1'].to_numpy())
+
+
+    def test_missing_sector_is_nan(self):
+        values = self.lookup.lookup('DDusa', [201901, 201901], [None, np.nan])
+        assert np.isnan(values).all()
+
+
+    def test_date_range_per_model(self):
+        assert self.lookup.dateRange('USA 4.0') == (201811, 201903)
+        assert self.lookup.dateRange('AUT 3.1') is None
+        assert [*self.lookup.inDateRange('USA 4.0', ['201810', '201811', 201903, '201904', ''])] == [False, True, True, False, False]
+
+
+    def test_load_without_compiled_lookup(self):
+        assert ddlookup.loadDDLookup(os.path.join(self.directory, 'missing')) is None
+        assert isinstance(ddlookup.loadDDLookup(self.directory), ddlookup.DDLookup)
+
+
+if __name__ == '__main__':
+    unittest.main()
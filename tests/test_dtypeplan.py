@@ -0,0 +1,116 @@
+import os
+import pandas as pd
+import shutil
+import sys
+import tempfile
+import unittest
+TEST_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIRECTORY = os.path.dirname(TEST_DIRECTORY)
+sys.path.extend([TEST_DIRECTORY, PACKAGE_DIRECTORY])
+from mapping import dtypeplan
+
+
+class TestDtypePlan(unittest.TestCase):
+
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = dtypeplan.DtypePlanStore(os.path.join(self.directory, 'plans'))
+        self.csv_path = os.path.join(self.directory, 'instrumentReference.csv')
+        pd.DataFrame({
+            'InstrumentIdentifier': [f'Loan{i:03}' for i in range(40)],
+            'interestRateType': ['Fixed', 'Variable'] * 20,
+            'lienPosition': ['1', '2', None, '1'] * 10,
+            'collateralZipCode': ['02134', '10001'] * 20,
+            'fixedRate': [0.05 + i / 1000 for i in range(40)],
+            'reportingDate': ['2018-03-31'] * 39 + [None],
+            'foreclosed': ['False', 'TRUE', None, 'true'] * 10,
+            'notAnAttribute': [1] * 40
+        }).to_csv(self.csv_path, index=False)
+        self.attributes = ['instrumentidentifier', 'interestratetype', 'lienposition', 'collateralzipcode', 'fixedrate', 'reportingdate', 'foreclosed']
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+    def test_plan(self):
+        plan = dtypeplan.planDtypes(self.csv_path, self.attributes)
+        assert plan == {
+            'interestRateType': 'category',
+            'lienPosition': 'Int8',
+            'collateralZipCode': 'category',
+            'fixedRate': 'float64',
+            'reportingDate': 'datetime64[ns]',
+            'foreclosed': 'boolean'
+        }
+
+
+    def test_planned_read_is_persisted_and_smaller(self):
+        df = dtypeplan.readCsvWithPlannedDtypes(self.csv_path, 'instrumentReference', self.attributes, store=self.store)
+        assert str(df['lienPosition'].dtype) == 'Int8'
+        assert str(df['interestRateType'].dtype) == 'category'
+        assert [*df['collateralZipCode'].unique()] == ['02134', '10001']
+        assert str(df['foreclosed'].dtype) == 'boolean'
+        assert df['foreclosed'].tolist()[:4] == [False, True, pd.NA, True]
+        assert df['reportingDate'].isna().sum() == 1
+        assert df.memory_usage(deep=True).sum() < pd.read_csv(self.csv_path).memory_usage(deep=True).sum()
+        columns = df.columns
+        assert self.store.get('instrumentReference', columns, self.attributes) is not None
+        assert self.store.get('instrumentReference', columns, self.attributes[:2]) is None
+
+
+    def test_plan_of_older_version_is_replanned(self):
+        columns = pd.read_csv(self.csv_path, nrows=0).columns
+        self.store.put('instrumentReference', columns, {'foreclosed': 'bool'}, self.attributes)
+        plans = self.store._load('instrumentReference')
+        [plan.pop('version') for plan in plans.values()]
+        self.store._save('instrumentReference', plans)
+        assert self.store.get('instrumentReference', columns, self.attributes) is None
+        df = dtypeplan.readCsvWithPlannedDtypes(self.csv_path, 'instrumentReference', self.attributes, store=self.store)
+        assert str(df['foreclosed'].dtype) == 'boolean'
+
+
+    def test_plan_that_does_not_fit_falls_back(self):
+        columns = pd.read_csv(self.csv_path, nrows=0).columns
+        self.store.put('instrumentReference', columns, {'fixedRate': 'Int8'}, self.attributes)
+        df = dtypeplan.readCsvWithPlannedDtypes(self.csv_path, 'instrumentReference', self.attributes, dtypes={'reportingdate': 'datetime64[ns]'}, store=self.store)
+        assert df['fixedRate'].dtype == 'float64'
+        assert str(df['reportingDate'].dtype) == 'datetime64[ns]'
+        assert self.store.get('instrumentReference', columns, self.attributes) is None
+
+
+    def test_chunks_fall_back_where_plan_does_not_fit(self):
+        columns = pd.read_csv(self.csv_path, nrows=0).columns
+        df = pd.read_csv(self.csv_path, dtype=str)
+        df.loc[30, 'lienPosition'] = '1000'  # Outside the sampled range of the Int8 plan
+        df.to_csv(self.csv_path, index=False)
+        self.store.put('instrumentReference', columns, {'lienPosition': 'Int8'}, self.attributes)
+        chunks = [*dtypeplan.readCsvChunksWithPlannedDtypes(self.csv_path, 'instrumentReference', 25, self.attributes, store=self.store,
+                                                            dtypes={'reportingdate': 'datetime64[ns]'}, usecols=['lienposition', 'reportingdate'])]
+        assert [len(chunk.index) for chunk in chunks] == [25, 15]
+        assert [[*chunk.columns] for chunk in chunks] == [['lienPosition', 'reportingDate']] * 2  # Same read settings after falling back
+        assert [str(chunk['reportingDate'].dtype) for chunk in chunks] == ['datetime64[ns]'] * 2
+        assert str(chunks[0]['lienPosition'].dtype) == 'Int8'
+        assert [*chunks[1].index] == [*range(25, 40)] and chunks[1].loc[30, 'lienPosition'] == 1000
+        assert self.store.get('instrumentReference', columns, self.attributes) is None
+
+
+
+    def test_dates_in_other_formats(self):
+        df = pd.read_csv(self.csv_path, dtype=str)
+        df['asOfDate'] = '03/31/2018'
+        df.loc[35, 'reportingDate'] = '04/30/2018'  # Outside the sample the plan is made from
+        df.to_csv(self.csv_path, index=False)
+        columns = [*df.columns]
+        self.store.put('instrumentReference', columns, dtypeplan.planDtypes(self.csv_path, self.attributes, sample_rows=30), self.attributes)
+        with self.assertLogs('mapping.dtypeplan', 'WARNING'):
+            df = dtypeplan.readCsvWithPlannedDtypes(self.csv_path, 'instrumentReference', self.attributes, dtypes={'asofdate': 'datetime64[ns]'},
+                                                    store=self.store)
+        assert (df['asOfDate'] == pd.Timestamp('2018-03-31')).all()  # Dates of overrides are inferred
+        assert df.loc[35, 'reportingDate'] == pd.Timestamp('2018-04-30') and df['reportingDate'].isna().sum() == 1
+        assert self.store.get('instrumentReference', columns, self.attributes) is None  # Re-planned on next run
+
+
+if __name__ == '__main__':
+    unittest.main()
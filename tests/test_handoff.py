@@ -0,0 +1,130 @@
+import json
+import os
+import pandas as pd
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+TEST_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIRECTORY = os.path.dirname(TEST_DIRECTORY)
+MODEL_DIRECTORY = os.path.join(PACKAGE_DIRECTORY, 'cap', 'model')
+SAMPLE_TEST_DIRECTORY = os.path.join(TEST_DIRECTORY, 'sample-test')
+sys.path.extend([TEST_DIRECTORY, PACKAGE_DIRECTORY, MODEL_DIRECTORY])
+from mapping import handoff
+import model
+import sessionpool
+from test_sessionpool import FakeCappy
+
+
+class TestHandoff(unittest.TestCase):
+
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.df = pd.DataFrame({
+            'instrumentidentifier': ['Loan001', 'Loan002', 'Loan003'],
+            'ttcannualizedpdoneyear': [0.01, None, 0.03],
+            'reportingdate': pd.to_datetime(['2018-03-31', '2018-03-31', None]),
+            'privatefirmmodelname': pd.Categorical(['USA 4.0', 'USA 4.0', 'UDS 4.0'])
+        }, index=[10, 11, 12])
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+    def test_csv_round_trip(self):
+        file_path = handoff.writeFrame(self.df, self.directory, 'instrumentReference', format=handoff.CSV)
+        assert file_path == os.path.join(self.directory, 'instrumentReference.csv')
+        df = handoff.readFrame(file_path, columns=['instrumentidentifier', 'ttcannualizedpdoneyear'])
+        assert [*df.columns] == ['instrumentidentifier', 'ttcannualizedpdoneyear']
+        assert df['ttcannualizedpdoneyear'].isna().sum() == 1
+
+
+    def test_format_falls_back_without_pyarrow(self):
+        expected = handoff.FEATHER if handoff.arrowAvailable() else handoff.CSV
+        assert handoff.handoffFormat(handoff.FEATHER) == expected
+        assert handoff.handoffFormat(handoff.CSV) == handoff.CSV
+        with mock.patch.object(handoff, 'arrowAvailable', return_value=False):
+            assert handoff.handoffFormat() == handoff.CSV
+
+
+    def test_format_falls_back_without_arrow_in_r(self):
+        with mock.patch.object(handoff, 'arrowAvailable', return_value=True), mock.patch.object(handoff, 'rArrowAvailable', return_value=False):
+            assert handoff.handoffFormat() == handoff.CSV
+            file_path = handoff.writeFrame(self.df, self.directory, 'instrumentReference')
+        assert file_path.endswith('.csv')
+        with mock.patch.object(handoff, 'arrowAvailable', return_value=True), mock.patch.object(handoff, 'rArrowAvailable', return_value=True):
+            assert handoff.handoffFormat() == handoff.FEATHER
+
+
+    def test_r_arrow_check(self):
+        handoff.rArrowAvailable.cache_clear()
+        try:
+            with mock.patch('subprocess.run', side_effect=FileNotFoundError('Rscript')):
+                assert not handoff.rArrowAvailable()  # No R
+            handoff.rArrowAvailable.cache_clear()
+            with mock.patch('subprocess.run', return_value=subprocess.CompletedProcess([], 1)) as check:
+                assert not handoff.rArrowAvailable() and not handoff.rArrowAvailable()
+            assert check.call_count == 1  # Checked once per process
+        finally:
+            handoff.rArrowAvailable.cache_clear()
+
+
+    @unittest.skipUnless(handoff.arrowAvailable(), 'pyarrow is not installed')
+    def test_feather_round_trip_keeps_dtypes(self):
+        file_path = handoff.writeFrame(self.df, self.directory, 'instrumentReference', format=handoff.FEATHER)
+        assert file_path.endswith('.feather')
+        df = handoff.readFrame(file_path)
+        pd.testing.assert_frame_equal(df, self.df.reset_index(drop=True))
+
+
+    def test_read_frames(self):
+        handoff.writeFrame(self.df, self.directory, 'instrumentRiskMetric')
+        handoff.writeFrame(self.df.iloc[:1], self.directory, 'instrumentError', format=handoff.CSV)
+        with open(os.path.join(self.directory, 'notes.txt'), 'w') as f:
+            f.write('ignored')
+        frames = handoff.readFrames(self.directory)
+        assert sorted(frames) == ['instrumentError', 'instrumentRiskMetric']
+        assert len(frames['instrumentRiskMetric'][1]) == 3
+        assert handoff.readFrames(os.path.join(self.directory, 'missing')) == {}
+
+
+class TestShardHandoff(unittest.TestCase):
+
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        test_folder = os.path.join(self.directory, 'sample-test')
+        shutil.copytree(SAMPLE_TEST_DIRECTORY, test_folder, ignore=shutil.ignore_patterns('benchmark', 'output'))
+        self.environment = mock.patch.dict(os.environ, {'MOODYS_TEMP_CLEANUP': 'sync', 'MOODYS_CHECKPOINT_DIRECTORY': ''})
+        self.environment.start()
+        self.model = model.Model({'jwt': 'token'}, {}, os.path.join(test_folder, 'modelRunParameter.json'), True,
+                                 session_pool=sessionpool.SessionPool(session_factory=FakeCappy), run_id='handoff')
+
+
+    def tearDown(self):
+        self.model.cleanUp()
+        self.environment.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+    def test_shard_settings_keep_staged_input_path(self):
+        instruments = pd.DataFrame({'instrumentidentifier': ['Loan001'], 'ttcannualizedpdoneyear': [0.01], 'privatefirmmodelname': ['USA 4.0']})
+        self.model.validator.validate = lambda data_frame: (data_frame, pd.DataFrame())
+        with mock.patch.object(handoff, 'arrowAvailable', return_value=True), mock.patch.object(handoff, 'rArrowAvailable', return_value=False), \
+                mock.patch('subprocess.run', return_value=subprocess.CompletedProcess([], 0)) as engine:
+            self.model.scoreShard(0, instruments)
+        mrp_path = engine.call_args[0][0][engine.call_args[0][0].index('-p') + 1]
+        with open(mrp_path) as f:
+            settings = json.load(f)['settings']
+        assert settings['inputPath'] == self.model.io_session.local_directories['inputPath']
+        assert os.path.isfile(settings['handoff']['inputs']['instrumentReference'])
+        assert settings['handoff']['format'] == handoff.CSV and settings['handoff']['inputs']['instrumentReference'].endswith('.csv')  # R has no arrow
+        assert settings['outputPaths']['instrumentRiskMetric'].startswith(self.model.shardDirectory(0))
+
+
+if __name__ == '__main__':
+    unittest.main()
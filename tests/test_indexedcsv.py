@@ -0,0 +1,81 @@
+import json
+import os
+import pandas as pd
+import shutil
+import sys
+import tempfile
+import unittest
+TEST_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIRECTORY = os.path.dirname(TEST_DIRECTORY)
+sys.path.extend([TEST_DIRECTORY, PACKAGE_DIRECTORY])
+from mapping import indexedcsv
+
+
+class TestIndexedCsv(unittest.TestCase):
+
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.shard_paths = []
+        for shard, instruments in enumerate([[7, 2, 9, 4], [5, 1, 8], [6, 3, 0]]):
+            path = os.path.join(self.directory, f'shard{shard}.csv')
+            pd.DataFrame({
+                'annualizedcumulativepd': [f'{instrument / 100 + term / 1000:.6f}' for instrument in instruments for term in range(1, 11)],
+                'instrumentidentifier': [f'Loan{instrument:03}' for instrument in instruments for _ in range(10)],
+                'term': [str(term) for _ in instruments for term in range(1, 11)]
+            }).to_csv(path, index=False)
+            self.shard_paths.append(path)
+        self.csv_path = os.path.join(self.directory, 'instrumentRiskMetric.csv')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+    def test_sorted_in_row_groups(self):
+        indexedcsv.writeIndexedCsv(self.shard_paths, self.csv_path, row_group_rows=15)
+        df = pd.read_csv(self.csv_path, dtype=str)
+        expected = pd.concat([pd.read_csv(path, dtype=str) for path in self.shard_paths]).sort_values('instrumentidentifier', kind='mergesort')
+        pd.testing.assert_frame_equal(df, expected.reset_index(drop=True))
+        with open(indexedcsv.indexPath(self.csv_path)) as f:
+            index = json.load(f)
+        assert [row_group[4] for row_group in index['rowGroups']] == [15] * 6 + [10]
+        assert index['rowGroups'][0][:2] == ['Loan000', 'Loan001'] and os.path.basename(indexedcsv.indexPath(self.csv_path)) == 'instrumentRiskMetric.idx'
+        temp_files = [name for name in os.listdir(self.directory) if name.endswith(('.run', '.tmp'))]
+        assert not temp_files
+
+
+    def test_lookup(self):
+        indexedcsv.writeIndexedCsv(self.shard_paths, self.csv_path, row_group_rows=15)
+        reader = indexedcsv.IndexedCsv(self.csv_path)
+        one = reader.lookup('Loan004')
+        assert [*one['term']] == [str(term) for term in range(1, 11)] and (one['instrumentidentifier'] == 'Loan004').all()
+        assert one['annualizedcumulativepd'][0] == '0.041000'
+        many = reader.lookup(['Loan009', 'Loan000', 'Loan042'])
+        assert [*many['instrumentidentifier'].unique()] == ['Loan000', 'Loan009'] and len(many.index) == 20
+        assert reader.lookup([]).empty and reader.lookup('Loan042').empty
+
+
+    def test_lookup_reads_only_matching_row_groups(self):
+        indexedcsv.writeIndexedCsv(self.shard_paths, self.csv_path, row_group_rows=10)
+        reader = indexedcsv.IndexedCsv(self.csv_path)
+        assert [*reader._groups('Loan003')] == [3]
+        assert [*reader._groups('Loan0035')] == []
+
+
+    def test_uploaded_names_and_stale_index(self):
+        # Uploads keep the file stem of the csv and its index apart from the extension (data.csv and data.idx)
+        partition = os.path.join(self.directory, 'instrumentRiskMetric', 'scenarioPartition=Baseline')
+        os.makedirs(partition)
+        indexedcsv.writeIndexedCsv(self.shard_paths, self.csv_path)
+        shutil.copyfile(self.csv_path, os.path.join(partition, 'data.csv'))
+        shutil.copyfile(indexedcsv.indexPath(self.csv_path), os.path.join(partition, 'data.idx'))
+        assert len(indexedcsv.IndexedCsv(os.path.join(partition, 'data.csv')).lookup('Loan007').index) == 10
+        with open(self.csv_path, 'a') as f:
+            f.write('0.1,Loan999,1\n')
+        with self.assertRaises(ValueError):
+            indexedcsv.IndexedCsv(self.csv_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,9 @@
+import multiprocessing
 import os
 import pandas as pd
 import sys
+import tempfile
+import threading
 import unittest
 TEST_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
 PACKAGE_DIRECTORY = os.path.dirname(TEST_DIRECTORY)
@@ -118,5 +121,105 @@ class TestJoinDataFrame(unittest.TestCase):
         assert_frame_equal(new_handler._df, instrument_error._df)
 
 
+def _spillFromWorker(name, instrument_ids):
+    instrument_error = instrumenterror.getErrorHandler(name)
+    for instrument_id in instrument_ids:
+        instrument_error.entry(err_msg=f'worker error {instrument_id}', instrument_id=instrument_id)
+
+
+def _spillShardFromWorker(name, shard, instrument_ids):
+    instrument_error = instrumenterror.getErrorHandler(name)
+    for row, instrument_id in enumerate(instrument_ids):
+        instrument_error.entry(err_msg=f'worker error {instrument_id}', instrument_id=instrument_id, order=(shard, row))
+
+
+class TestSpill(unittest.TestCase):
+
+
+    def tearDown(self):
+        instrumenterror.removeErrorHandler(self.id())
+
+
+    def test_entries_before_spill_come_first(self):
+        instrument_error = instrumenterror.getErrorHandler(self.id())
+        instrument_error.entry(err_msg='before spill', instrument_id='a')
+        instrument_error.enableSpill()
+        instrument_error.entry(err_msg='spilled 1', instrument_id='b')
+        instrument_error.entry(err_msg='spilled 2', instrument_id='c')
+        assert [*instrument_error.collect()['instrumentIdentifier']] == ['a', 'b', 'c']
+        assert len(instrument_error._df.index) == 1
+
+
+    def test_threads_do_not_lose_entries(self):
+        instrument_error = instrumenterror.getErrorHandler(self.id())
+        instrument_error.enableSpill()
+        threads = [threading.Thread(target=_spillFromWorker, args=(self.id(), range(i * 100, (i + 1) * 100))) for i in range(4)]
+        [thread.start() for thread in threads]
+        [thread.join() for thread in threads]
+        instrument_ids = [int(instrument_id) for instrument_id in instrument_error.collect()['instrumentIdentifier']]
+        assert sorted(instrument_ids) == [*range(400)]
+        for i in range(4):  # Each thread's entries in the order they were made
+            assert [instrument_id for instrument_id in instrument_ids if instrument_id // 100 == i] == [*range(i * 100, (i + 1) * 100)]
+
+
+    @unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(), 'requires fork')
+    def test_forked_workers_merged_in_order_made(self):
+        instrument_error = instrumenterror.getErrorHandler(self.id())
+        instrument_error.entry(err_msg='parent error', instrument_id='parent')
+        spill_directory = instrument_error.enableSpill()
+        context = multiprocessing.get_context('fork')
+        for i in range(3):  # Shards of instruments, one worker after another
+            worker = context.Process(target=_spillFromWorker, args=(self.id(), range(i * 10, (i + 1) * 10)))
+            worker.start()
+            worker.join()
+        assert len(os.listdir(spill_directory)) == 3
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = instrument_error.createInstrumentErrorFile(directory)['instrumentError']
+            df = pd.read_csv(file_path, dtype=str)
+        assert [*df['instrumentIdentifier']] == ['parent'] + [str(i) for i in range(30)]
+        assert df['errorCode'].eq(str(DEFAULT_ERROR_CODE)).all()
+
+
+    @unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(), 'requires fork')
+    def test_forked_workers_merged_in_instrument_order(self):
+        instrument_error = instrumenterror.getErrorHandler(self.id())
+        instrument_error.enableSpill()
+        instrument_error.entry(err_msg='e', instrument_id='no position')
+        context = multiprocessing.get_context('fork')
+        for shard in [1, 0]:  # Later shard writes first
+            worker = context.Process(target=_spillShardFromWorker, args=(self.id(), shard, range(shard * 10, (shard + 1) * 10)))
+            worker.start()
+            worker.join()
+        instrument_ids = [*instrument_error.collect()['instrumentIdentifier']]
+        assert instrument_ids == [str(i) for i in range(20)] + ['no position']
+
+
+    def test_joined_rows_sorted_by_position(self):
+        instrument_error = instrumenterror.getErrorHandler(self.id())
+        instrument_error.enableSpill()
+        instrument_error.joinDataFrame(pd.DataFrame({'instrumentIdentifier': ['c', 'd'], 'errorMessage': 'e', 'shard': 1}), order=['shard'])
+        instrument_error.joinDataFrame(pd.DataFrame({'instrumentIdentifier': ['a', 'b'], 'errorMessage': 'e', 'shard': 0}), order=['shard'])
+        collected = instrument_error.collect()
+        assert [*collected['instrumentIdentifier']] == ['a', 'b', 'c', 'd']
+        assert 'shard' not in collected.columns
+
+
+    def test_joined_and_single_entries_share_one_order(self):
+        instrument_error = instrumenterror.getErrorHandler(self.id())
+        instrument_error.enableSpill()
+        instrument_error.entry(err_msg='e', instrument_id='w')
+        instrument_error.joinDataFrame(pd.DataFrame({'InstrumentIdentifier': ['y', 'x'], 'errorMessage': ['e', 'e']}))
+        instrument_error.entry(err_msg='e', instrument_id='z')
+        assert [*instrument_error.collect()['instrumentIdentifier']] == ['w', 'y', 'x', 'z']
+
+
+    def test_remove_handler_deletes_owned_spill_directory(self):
+        instrument_error = instrumenterror.getErrorHandler(self.id())
+        spill_directory = instrument_error.enableSpill()
+        instrument_error.entry(err_msg='e', instrument_id='a')
+        instrumenterror.removeErrorHandler(self.id())
+        assert not os.path.exists(spill_directory)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,295 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import pandas as pd
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+TEST_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIRECTORY = os.path.dirname(TEST_DIRECTORY)
+MODEL_DIRECTORY = os.path.join(PACKAGE_DIRECTORY, 'cap', 'model')
+SAMPLE_TEST_DIRECTORY = os.path.join(TEST_DIRECTORY, 'sample-test')
+sys.path.extend([TEST_DIRECTORY, PACKAGE_DIRECTORY, MODEL_DIRECTORY])
+import asynciosession
+import iosession
+from mapping import mapping
+import model
+import sessionpool
+from test_s3prefix import FakeS3Client
+from test_sessionpool import FakeCappy
+
+
+class FakeObjectStore:
+    """Stand-in for a Cappy session and its S3 client, holding objects in memory"""
+
+    def __init__(self, objects=None):
+        self.objects = dict(objects or {})
+        self.context = {'s3_bucket': 'bucket'}
+        self.logger = logging.getLogger('FakeObjectStore')
+        self.uploads = []
+        self.head_calls = 0
+
+    def s3_download_file(self, key, local_file_path):
+        if key not in self.objects:
+            raise FileNotFoundError(key)
+        with open(local_file_path, 'wb') as f:
+            f.write(self.objects[key])
+
+    def s3_upload_file(self, local_file_path, key):
+        with open(local_file_path, 'rb') as f:
+            self.objects[key] = f.read()
+        self.uploads.append(key)
+
+    def init_s3_client(self):
+        return self
+
+    def head_object(self, Bucket, Key):
+        self.head_calls += 1
+        if Key not in self.objects:
+            raise KeyError(Key)
+        return {'ETag': f'"{hashlib.md5(self.objects[Key]).hexdigest()}"', 'ContentLength': len(self.objects[Key])}
+
+
+def createFakeRemoteTestCase(test_folder, store):
+    """Put sample test case inputs and model run parameters into a fake object store. :return: model run parameters key"""
+    with open(os.path.join(test_folder, 'modelRunParameter.json')) as f:
+        mrp = json.load(f)
+    for file_name in os.listdir(os.path.join(test_folder, 'input_csv')):
+        with open(os.path.join(test_folder, 'input_csv', file_name), 'rb') as f:
+            store.objects[f'{mrp["settings"]["inputPath"]}/{file_name}'] = f.read()
+    store.objects['mrp/modelRunParameter.json'] = json.dumps(mrp).encode('utf-8')
+    return 'mrp/modelRunParameter.json'
+
+
+class TestLocalIOSession(unittest.TestCase):
+
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.test_folder = os.path.join(self.directory, 'sample-test')
+        shutil.copytree(SAMPLE_TEST_DIRECTORY, self.test_folder, ignore=shutil.ignore_patterns('benchmark', 'output'))
+        self.model_metadata_path = os.path.join(self.directory, 'model.json')
+        self.columns = ['InstrumentIdentifier', 'interestRateType', 'reportingdate']
+        with open(self.model_metadata_path, 'w') as f:
+            json.dump({'version': {'datasets': {'inputData': [{'category': 'instrumentReference', 'attributes': self.columns}]}}}, f)
+        self.io_session = iosession.IOSession(None, os.path.join(self.test_folder, 'modelRunParameter.json'), True,
+                                              model_metadata_path=self.model_metadata_path)
+
+
+    def tearDown(self):
+        self.io_session.deleteTempDirectories()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+    def test_required_columns_from_model_metadata(self):
+        assert self.io_session.required_columns == {'instrumentReference': self.columns}
+        assert iosession.readRequiredColumns(os.path.join(self.directory, 'missing.json')) == {}
+
+
+    def test_projected_inputs(self):
+        input_files = self.io_session.getSourceInputFiles(require=['instrumentReference.csv'], project=True)
+        instrument_reference = pd.read_csv(input_files['instrumentReference'], dtype=str, keep_default_na=False)
+        assert [*instrument_reference.columns] == ['reportingdate', 'instrumentidentifier', 'interestratetype']
+        original = pd.read_csv(os.path.join(self.test_folder, 'input_csv', 'instrumentReference.csv'), dtype=str, keep_default_na=False)
+        assert instrument_reference.equals(original[instrument_reference.columns])
+        assert len(pd.read_csv(input_files['propertyReference']).columns) > len(self.columns)
+
+
+    def test_usecols_read(self):
+        input_files = self.io_session.getSourceInputFiles(require=['instrumentReference.csv'])
+        columns = self.io_session.required_columns['instrumentReference']
+        df = mapping.readCsvWithCorrectDtypes(input_files['instrumentReference'], {'reportingDate': 'datetime64[ns]', 'foreclosed': 'bool'}, usecols=columns)
+        assert sorted(df.columns) == ['instrumentidentifier', 'interestratetype', 'reportingdate']
+        assert str(df['reportingdate'].dtype) == 'datetime64[ns]'
+
+
+    def test_changed_only_skips_unmodified_inputs(self):
+        input_files = self.io_session.getSourceInputFiles(require=['instrumentReference.csv'])
+        output_path = os.path.join(self.io_session.local_directories['outputPaths']['instrumentRiskMetric'], 'instrumentRiskMetric.csv')
+        with open(output_path, 'w') as f:
+            f.write('instrumentidentifier,term\nLoan001,1\n')
+        log_path = self.io_session.writeFileObjectToDisk(b'debug', 'debug.log')
+        changed = {path for file_dict in self.io_session.createFileDicts(self.io_session.local_temp_directory, changed_only=True) for path in file_dict.values()}
+        assert changed == {output_path, log_path}
+        every = {path for file_dict in self.io_session.createFileDicts(self.io_session.local_temp_directory) for path in file_dict.values()}
+        assert set(input_files.values()) < every
+        assert self.io_session.manifest.get(output_path)['size'] == os.path.getsize(output_path)
+
+        self.io_session.uploadFiles({'instrumentRiskMetric': output_path})
+        with open(input_files['propertyReference'], 'a') as f:
+            f.write('\n')
+        changed = {path for file_dict in self.io_session.createFileDicts(self.io_session.local_temp_directory, changed_only=True) for path in file_dict.values()}
+        assert changed == {log_path, input_files['propertyReference']}
+        assert os.path.isfile(os.path.join(self.test_folder, 'output', 'instrumentRiskMetric', 'data.csv'))
+
+
+class TestUploadDeduplication(unittest.TestCase):
+
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = FakeObjectStore()
+        mrp_key = createFakeRemoteTestCase(SAMPLE_TEST_DIRECTORY, self.store)
+        self.io_session = iosession.IOSession(self.store, mrp_key, False)
+        self.io_session.upload_manifest = iosession.UploadManifest(os.path.join(self.directory, 'uploads.json'))
+        self.output_path = os.path.join(self.io_session.local_directories['outputPaths']['instrumentRiskMetric'], 'instrumentRiskMetric.csv')
+        with open(self.output_path, 'w') as f:
+            f.write('instrumentidentifier,term\nLoan001,1\n')
+
+
+    def tearDown(self):
+        self.io_session.deleteTempDirectories()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+    def test_unchanged_upload_is_skipped(self):
+        files = {'instrumentRiskMetric': self.output_path}
+        self.io_session.uploadFiles(files, skip_unchanged=True)
+        self.io_session.uploadFiles(files, skip_unchanged=True)
+        size = os.path.getsize(self.output_path)
+        assert len(self.store.uploads) == 1
+        assert self.store.head_calls == 1  # Second upload is skipped from the manifest, without asking the store
+        assert self.io_session.metrics == {'uploaded_files': 1, 'uploaded_bytes': size, 'skipped_files': 1, 'skipped_bytes': size}
+
+
+    def test_remote_checksum_is_used_without_manifest(self):
+        input_files = self.io_session.getSourceInputFiles()
+        log_key = self.io_session.uploadDestination('log', input_files['instrumentReference'])
+        with open(input_files['instrumentReference'], 'rb') as f:
+            self.store.objects[log_key] = f.read()  # Uploaded by an earlier run
+        output_key = self.io_session.uploadDestination('instrumentRiskMetric', self.output_path)
+        self.store.objects[output_key] = b'stale'
+        self.io_session.uploadFiles({'log': input_files['instrumentReference'], 'instrumentRiskMetric': self.output_path}, skip_unchanged=True)
+        assert self.store.uploads == [output_key]
+        assert self.io_session.metrics['skipped_files'] == 1
+        with open(self.output_path, 'rb') as f:
+            assert self.store.objects[output_key] == f.read()
+
+
+class TestCleanUpMetrics(unittest.TestCase):
+
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        test_folder = os.path.join(self.directory, 'sample-test')
+        shutil.copytree(SAMPLE_TEST_DIRECTORY, test_folder, ignore=shutil.ignore_patterns('benchmark', 'output'))
+        self.environment = mock.patch.dict(os.environ, {'MOODYS_TEMP_CLEANUP': 'sync', 'MOODYS_CHECKPOINT_DIRECTORY': ''})
+        self.environment.start()
+        self.model = model.Model({'jwt': 'token'}, {}, os.path.join(test_folder, 'modelRunParameter.json'), True,
+                                 session_pool=sessionpool.SessionPool(session_factory=FakeCappy), run_id='metrics')
+        self.log_file = os.path.join(self.directory, 'log.log')
+        with open(self.log_file, 'w') as f:
+            f.write('')
+
+
+    def tearDown(self):
+        self.environment.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+    def test_metrics_logged_before_log_upload(self):
+        logged_before_upload = []
+        with self.assertLogs('model', 'INFO') as logs:
+            upload = lambda files, **kwargs: logged_before_upload.extend(logs.output)
+            with mock.patch.object(self.model.io_session, 'uploadFiles', side_effect=upload) as upload_files:
+                self.model.cleanUp(log_file=self.log_file)
+        upload_files.assert_called_once_with({'log': self.log_file})
+        assert any('Upload metrics' in line for line in logged_before_upload)
+        assert any('Transfer metrics' in line for line in logged_before_upload)
+
+
+class TestRemotePrefixes(unittest.TestCase):
+
+
+    def setUp(self):
+        self.store = FakeObjectStore()
+        mrp_key = createFakeRemoteTestCase(SAMPLE_TEST_DIRECTORY, self.store)
+        self.s3 = FakeS3Client([f'out/instrumentRiskMetric/scenarioPartition={i % 2}/part-{i:04}.csv' for i in range(1500)] + ['log/log.log'])
+        self.store.init_s3_client = lambda: self.s3
+        self.io_session = iosession.IOSession(self.store, mrp_key, False)
+
+
+    def tearDown(self):
+        self.io_session.deleteTempDirectories()
+
+
+    def test_list_remote_keys(self):
+        keys = self.io_session.listRemoteKeys('out/')
+        assert next(keys).endswith('scenarioPartition=0/part-0000.csv') and self.s3.list_calls == 1  # Listed lazily, a page at a time
+        assert len([*keys]) == 1499 and self.s3.list_calls == 2
+        assert [*self.io_session.listRemoteKeys('log/')] == ['log/log.log']
+
+
+    def test_clear_remote_prefixes(self):
+        deleted = self.io_session.clearRemotePrefixes(['out/instrumentRiskMetric/scenarioPartition=0', 'log'])
+        assert len(deleted['out/instrumentRiskMetric/scenarioPartition=0']) == 750 and deleted['log'] == ['log/log.log']
+        assert self.s3.keys == sorted(f'out/instrumentRiskMetric/scenarioPartition=1/part-{i:04}.csv' for i in range(1, 1500, 2))
+        self.s3.delete_objects = lambda Bucket, Delete: (_ for _ in ()).throw(ConnectionError('reset'))
+        assert self.io_session.clearRemotePrefixes(['out']) == {}
+        with self.assertRaises(ConnectionError):
+            self.io_session.clearRemotePrefixes(['out'], on_error='raise')
+
+
+class TestAsyncIOSession(unittest.TestCase):
+
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = FakeObjectStore()
+        self.mrp_key = createFakeRemoteTestCase(SAMPLE_TEST_DIRECTORY, self.store)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+    def runSession(self, local_mode, mrp_path):
+        """Stage inputs and upload a written file with both sessions. :return: (sync results, async results)"""
+        results = []
+        for session_class in [iosession.IOSession, asynciosession.AsyncIOSession]:
+            io_session = session_class(self.store, mrp_path, local_mode)
+            try:
+                if session_class is iosession.IOSession:
+                    input_files = io_session.getSourceInputFiles(require=['instrumentReference.csv'])
+                    log_path = io_session.writeFileObjectToDisk(b'trace', 'trace.log')
+                    io_session.uploadFiles({'log': log_path, 'instrumentReference': input_files['instrumentReference']}, scenario_name='base')
+                else:
+                    async def run():
+                        input_files = await io_session.getSourceInputFiles(require=['instrumentReference.csv'])
+                        log_path = await io_session.writeFileObjectToDisk(b'trace', 'trace.log')
+                        await io_session.uploadFiles({'log': log_path, 'instrumentReference': input_files['instrumentReference']}, scenario_name='base')
+                        return input_files
+                    input_files = asyncio.run(run())
+                    io_session.close()
+                relative = lambda path: os.path.relpath(path, io_session.local_temp_directory)
+                results.append(({name: relative(path) for name, path in input_files.items()}, io_session.metrics))
+            finally:
+                io_session.deleteTempDirectories()
+        return results
+
+
+    def test_s3_mode_matches_sync_session(self):
+        sync_results, async_results = self.runSession(False, self.mrp_key)
+        assert sync_results == async_results
+        assert sorted(set(self.store.uploads)) == [
+            'model-intg/cap-model-starter/sample-test/log/trace.log',
+            'model-intg/cap-model-starter/sample-test/output/instrumentReference/scenarioPartition=base/data.csv'
+        ]
+        assert len(self.store.uploads) == 4
+
+
+    def test_local_mode_matches_sync_session(self):
+        test_folder = os.path.join(self.directory, 'sample-test')
+        shutil.copytree(SAMPLE_TEST_DIRECTORY, test_folder, ignore=shutil.ignore_patterns('benchmark', 'output'))
+        sync_results, async_results = self.runSession(True, os.path.join(test_folder, 'modelRunParameter.json'))
+        assert sync_results == async_results
+        assert os.path.isfile(os.path.join(test_folder, 'output', 'instrumentReference', 'scenarioPartition=base', 'data.csv'))
+        assert os.path.isfile(os.path.join(test_folder, 'output', 'log', 'trace.log'))
+
+
+if __name__ == '__main__':
+    unittest.main()
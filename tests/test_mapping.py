@@ -1,6 +1,8 @@
 import os
 import pandas as pd
+import shutil
 import sys
+import tempfile
 import unittest
 TEST_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
 PACKAGE_DIRECTORY = os.path.dirname(TEST_DIRECTORY)
@@ -65,5 +67,163 @@ class TestReadCsvWithCorrectDtypes(unittest.TestCase):
             assert False not in [x is y for x, y in zip(test_df[column], array)]
 
 
+    def test_chunks_match_whole_read(self):
+        dtype_mapping = {'int': 'int64', 'mixed_bool': 'bool', 'date': 'datetime64[ns]', 'float': 'float64'}
+        test_df = mapping.readCsvWithCorrectDtypes(self.test_csv_path, dtypes=dtype_mapping)
+        chunks = [*mapping.readCsvChunksWithCorrectDtypes(self.test_csv_path, 4, dtypes=dtype_mapping)]
+        assert [len(chunk.index) for chunk in chunks] == [4, 4, 1]
+        pd.testing.assert_frame_equal(pd.concat(chunks), test_df)
+
+
+class TestMapEnums(unittest.TestCase):
+
+
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'InterestRateType': ['Fixed', 'FIXED', 'variable', None, 'Unknown', 'fixed'],
+            'id': range(6)
+        })
+        self.enums = {'interestratetype': {'fixed': 'FIX', 'Variable': 'VAR'}}
+        self.expected = ['FIX', 'FIX', 'VAR', None, None, 'FIX']
+
+
+    def assertMapped(self, series):
+        assert [None if pd.isna(x) else x for x in series] == self.expected
+
+
+    def test_maps_case_insensitively(self):
+        self.assertMapped(mapping.mapEnums(self.df, self.enums)['InterestRateType'])
+
+
+    def test_not_categorical_by_default(self):
+        df = pd.concat([self.df] * 10, ignore_index=True)
+        assert mapping.mapEnums(df, self.enums)['InterestRateType'].dtype == 'object'
+
+
+    def test_low_cardinality_column_is_categorical_on_request(self):
+        df = pd.concat([self.df] * 10, ignore_index=True)
+        mapped = mapping.mapEnums(df, self.enums, category_max_ratio=mapping.CATEGORY_MAX_RATIO)
+        assert mapped['InterestRateType'].dtype == 'category'
+        assert {*mapped['InterestRateType'].cat.categories} == {'FIX', 'VAR'}
+        assert mapping.mapEnums(self.df, self.enums, category_max_ratio=mapping.CATEGORY_MAX_RATIO)['InterestRateType'].dtype == 'object'
+        self.assertMapped(mapping.mapEnums(self.df, self.enums, category_max_ratio=1)['InterestRateType'])
+
+
+    def test_category_input(self):
+        df = self.df.astype({'InterestRateType': 'category'})
+        self.assertMapped(mapping.mapEnums(df, self.enums)['InterestRateType'])
+
+
+    def test_inplace(self):
+        original = self.df.copy()
+        mapping.mapEnums(self.df, self.enums)
+        assert [*self.df['InterestRateType']] == [*original['InterestRateType']]
+        returned = mapping.mapEnums(self.df, self.enums, inplace=True)
+        assert returned is self.df
+        self.assertMapped(self.df['InterestRateType'])
+
+
+class TestReindexCaseInsensitively(unittest.TestCase):
+
+
+    def test_reindex_renames_and_fills(self):
+        df = pd.DataFrame({'INSTRUMENTIDENTIFIER': ['a'], 'Term': [1], 'extra': [0]})
+        reindexed = mapping.reindexCaseInsensitively(df, ['instrumentIdentifier', 'term', 'missing'])
+        assert [*reindexed.columns] == ['instrumentIdentifier', 'term', 'missing']
+        assert reindexed.iloc[0].tolist() == ['a', 1, '']
+        assert [*df.columns] == ['INSTRUMENTIDENTIFIER', 'Term', 'extra']
+
+
+class TestWriteCsv(unittest.TestCase):
+
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.df = pd.DataFrame({
+            'id': [f'i{i}' for i in range(25)],
+            'asOfDate': pd.date_range('2020-01-31', periods=25, freq='M'),
+            'pd': [i / 7 for i in range(25)]
+        })
+        self.df.loc[3, 'asOfDate'] = pd.NaT
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+
+    def test_chunked_output_matches_to_csv(self):
+        expected = self.df.to_csv(None, index=False, date_format='%Y-%m-%d', float_format=mapping.CSV_FLOAT_FORMAT)
+        path = mapping.writeCsv(self.df, os.path.join(self.directory, 'out.csv'), chunk_rows=4, max_workers=2, float_format=mapping.CSV_FLOAT_FORMAT)
+        assert self.read(path) == expected
+
+
+    def test_create_csv_files_concurrently(self):
+        data_frames = {'first': self.df, 'second': self.df.iloc[::-1]}
+        files = mapping.createCsvFilesFromDataFrames(data_frames, self.directory, scenario_name='base', max_workers=2, chunk_rows=10)
+        assert files == {name: os.path.join(self.directory, f'{name}_base.csv') for name in data_frames}
+        for name, data_frame in data_frames.items():
+            assert self.read(files[name]) == data_frame.to_csv(None, index=False, date_format='%Y-%m-%d')  # Full precision by default
+        files = mapping.createCsvFilesFromDataFrames({'rounded': self.df}, self.directory, max_workers=1, float_format=mapping.CSV_FLOAT_FORMAT)
+        assert self.read(files['rounded']) == self.df.to_csv(None, index=False, date_format='%Y-%m-%d', float_format=mapping.CSV_FLOAT_FORMAT)
+
+
+    def test_concatenate_shard_outputs(self):
+        shards = [mapping.writeCsv(self.df.iloc[start:start + 4], os.path.join(self.directory, f'shard{start}.csv')) for start in range(0, len(self.df.index), 4)]
+        path = mapping.concatenateCsv(shards, os.path.join(self.directory, 'merged.csv'))
+        assert self.read(path) == self.df.to_csv(None, index=False, date_format='%Y-%m-%d')
+        other = mapping.writeCsv(self.df.iloc[:1, :2], os.path.join(self.directory, 'other.csv'))
+        merged = pd.read_csv(mapping.concatenateCsv([shards[0], other], path), dtype=str, keep_default_na=False)
+        assert [*merged.columns] == [*self.df.columns] and len(merged.index) == 5
+
+
+class TestCleanOutputHeaders(unittest.TestCase):
+
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.files = {}
+        for name in ['first', 'second']:
+            path = os.path.join(self.directory, f'{name}.csv')
+            with open(path, 'w', encoding='cp1252') as f:
+                f.write('id,PD 1–5Y,name\n1,0.1,café\n2,0.2,naïve\n')
+            self.files[name] = path
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+    def assertCleaned(self, df):
+        assert [*df.columns] == ['id', 'PD 1-5Y', 'name']
+        assert [*df['name']] == ['café', 'naïve']
+
+
+    def test_copy_mode(self):
+        cleaned = mapping.cleanOutputHeaders(self.files)
+        for name, path in cleaned.items():
+            assert path.endswith(f'{name}_cleaned.csv')
+            self.assertCleaned(mapping.readCsvWithCorrectDtypes(path))
+
+
+    def test_inplace_mode_patches_header_only(self):
+        size = os.path.getsize(self.files['first'])
+        cleaned = mapping.cleanOutputHeaders(self.files, mode='inplace')
+        assert cleaned == self.files
+        assert os.path.getsize(self.files['first']) == size
+        self.assertCleaned(mapping.readCsvWithCorrectDtypes(cleaned['first'], encoding='cp1252'))
+
+
+    def test_stream_mode(self):
+        cleaned = mapping.cleanOutputHeaders(self.files, mode='stream')
+        for stream in cleaned.values():
+            with stream:
+                self.assertCleaned(mapping.readCsvWithCorrectDtypes(stream, dtypes={'ID': 'float64'}, usecols=['id', 'pd 1-5y', 'NAME']))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,60 @@
+import os
+import pandas as pd
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+TEST_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIRECTORY = os.path.dirname(TEST_DIRECTORY)
+MODEL_DIRECTORY = os.path.join(PACKAGE_DIRECTORY, 'cap', 'model')
+sys.path.extend([TEST_DIRECTORY, PACKAGE_DIRECTORY, MODEL_DIRECTORY])
+import memorybudget
+
+
+class TestMemoryBudget(unittest.TestCase):
+
+
+    def test_configured_budget(self):
+        with mock.patch.dict(os.environ, {'MOODYS_MEMORY_BUDGET_MB': '512'}):
+            assert memorybudget.MemoryBudget().limit == 512 * memorybudget.MEGABYTE
+        assert memorybudget.MemoryBudget(0).limit is None
+        assert memorybudget.MemoryBudget(0).available() is None and not memorybudget.MemoryBudget(0).exceeded()
+
+
+    def test_auto_budget_is_fraction_of_system_memory(self):
+        with mock.patch.object(memorybudget, 'systemMemoryLimit', return_value=1000 * memorybudget.MEGABYTE):
+            assert memorybudget.MemoryBudget('auto').limit == 800 * memorybudget.MEGABYTE
+
+
+    def test_rows_shrink_to_fit_budget(self):
+        budget = memorybudget.MemoryBudget(1000)
+        with mock.patch.object(memorybudget, 'residentMemory', return_value=600 * memorybudget.MEGABYTE):
+            assert budget.available() == 400 * memorybudget.MEGABYTE
+            assert budget.rowsWithin(memorybudget.MEGABYTE, 100000) == 1000  # At least minimum rows
+            assert budget.rowsWithin(4096, 100000) == 25600  # A quarter of 400 MB
+            assert budget.rowsWithin(1, 100000) == 100000
+            assert not budget.exceeded() and budget.fits(400 * memorybudget.MEGABYTE) and not budget.fits(401 * memorybudget.MEGABYTE)
+        with mock.patch.object(memorybudget, 'residentMemory', return_value=1001 * memorybudget.MEGABYTE):
+            assert budget.exceeded() and budget.available() == 0
+        assert memorybudget.MemoryBudget(0).rowsWithin(memorybudget.MEGABYTE, 100000) == 100000
+
+
+    def test_resident_memory(self):
+        assert memorybudget.residentMemory() > 0
+
+
+    def test_estimate_csv_memory(self):
+        directory = tempfile.mkdtemp()
+        try:
+            csv_path = os.path.join(directory, 'instrumentReference.csv')
+            pd.DataFrame({'instrumentIdentifier': [f'Loan{i:05}' for i in range(5000)], 'fixedRate': 0.05}).to_csv(csv_path, index=False)
+            bytes_per_row, rows = memorybudget.estimateCsvMemory(csv_path, lambda nrows: pd.read_csv(csv_path, nrows=nrows))
+            assert rows == 5000
+            assert bytes_per_row == pd.read_csv(csv_path, nrows=1000).memory_usage(deep=True).sum() / 1000
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
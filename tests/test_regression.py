@@ -1,5 +1,4 @@
 from datetime import datetime
-from moodyscappy import Cappy
 import glob
 import itertools
 import json
@@ -22,6 +21,8 @@ MODEL_DIRECTORY = os.path.join(CAP_DIRECTORY, 'model')
 CONFIG_DIRECTORY = os.path.join(CAP_DIRECTORY, 'config')
 sys.path.extend([PACKAGE_DIRECTORY, TEST_DIRECTORY, MODEL_DIRECTORY, MAPPING_DIRECTORY, CONFIG_DIRECTORY, CAP_DIRECTORY])
 from cap.config import config
+from cap.model import s3prefix
+from cap.model import sessionpool
 from tests import helpers
 
 # Configuration files
@@ -86,7 +87,7 @@ class EndToEndTestCase:
         self.test_directory = test_directory
         self.user_info = user_info
         self.proxy_user_info = proxy_user_info
-        self.s3 = cap_session.init_s3_client()
+        self.s3 = sessionpool.getSessionPool().getS3Client(cap_session)
         self.bucket = cap_session.context['s3_bucket']
         self.log_file = os.path.abspath(os.path.join(test_directory, 'test.log'))
         config.configureLogger(config_file=LOGGING_CONFIG_FILE, log_file=self.log_file)
@@ -188,16 +189,12 @@ class EndToEndTestCase:
         os.makedirs(self.local_output_directory, exist_ok=True)
 
     def clearS3Directories(self):
-        def clearS3Directory(s3_directory):
-            try:
-                keys = self.listKeys(s3_directory)
-                return [self.s3.delete_object(Bucket=self.bucket, Key=key) for key in keys]
-            except Exception as e:
-                self.log.error(e)
-
         clear_s3_paths = [self.s3_input_path, self.s3_log_path, *self.s3_output_paths]
         self.log.info(f'Clearing S3 paths: {clear_s3_paths}')
-        return [clearS3Directory(path) for path in clear_s3_paths]
+        try:
+            return s3prefix.clearPrefixes(self.s3, self.bucket, clear_s3_paths)
+        except Exception as e:
+            self.log.error(e)
 
     def uploadFile(self, file, key_path):
         key = f'{key_path}/{os.path.basename(file)}'
@@ -216,7 +213,7 @@ class EndToEndTestCase:
             self.uploadFile(file, f'{self.s3_log_path}/test_results')
 
     def listKeys(self, prefix):
-        return [obj['Key'] for obj in self.s3.list_objects_v2(Bucket=self.bucket, Prefix=prefix).get('Contents', [])]
+        return list(s3prefix.iterKeys(self.s3, self.bucket, prefix))
 
     def downloadFiles(self):
         def downloadFile(key):
@@ -229,7 +226,7 @@ class EndToEndTestCase:
                 self.log.error(f'Error downloading file: {file_path}')
                 return ''
 
-        output_keys = list(itertools.chain(*[self.listKeys(path) for path in self.s3_output_paths]))
+        output_keys = list(itertools.chain(*s3prefix.listPrefixes(self.s3, self.bucket, self.s3_output_paths).values()))
         log_keys = self.listKeys(self.s3_log_path)
         self.log.info(f'Downloading files: {[*output_keys, *log_keys]}')
         return [downloadFile(key) for key in [*output_keys, *log_keys]]
@@ -246,7 +243,7 @@ def main():
     user_info = ['-u', USER_NAME, PASSWORD]
     proxy_user_info = ['-p', PROXY_USER_NAME, PROXY_PASSWORD] if PROXY_USER_NAME and PROXY_PASSWORD else []
     config._loadAll(QA_CONFIG_FILE)
-    cap_session = Cappy(username=USER_NAME, password=PASSWORD, errors='log')
+    cap_session = sessionpool.getSessionPool().getSession({'username': USER_NAME, 'password': PASSWORD}, errors='log')
     test_cases = [*config._getConfigParser(TEST_CONFIG_FILE)['CASES_LIST']]
 
     for test_case in test_cases:
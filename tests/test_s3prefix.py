@@ -0,0 +1,72 @@
+import os
+import sys
+import threading
+import unittest
+TEST_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIRECTORY = os.path.dirname(TEST_DIRECTORY)
+sys.path.extend([TEST_DIRECTORY, PACKAGE_DIRECTORY])
+from cap.model import s3prefix
+
+
+class FakeS3Client:
+    """Minimal in-memory stand-in for the boto3 list_objects_v2/delete_objects API"""
+
+    def __init__(self, keys):
+        self.keys = sorted(keys)
+        self.list_calls = 0
+        self.delete_calls = []
+        self.lock = threading.Lock()
+
+    def list_objects_v2(self, Bucket, Prefix, MaxKeys=1000, ContinuationToken=None):
+        self.list_calls += 1
+        matching = [key for key in self.keys if key.startswith(Prefix)]
+        remaining = [key for key in matching if ContinuationToken is None or key > ContinuationToken]
+        page = remaining[:MaxKeys]
+        response = {'Contents': [{'Key': key} for key in page], 'IsTruncated': len(remaining) > MaxKeys}
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1]
+        return response
+
+    def delete_objects(self, Bucket, Delete):
+        batch = [obj['Key'] for obj in Delete['Objects']]
+        with self.lock:
+            self.delete_calls.append(len(batch))
+            self.keys = [key for key in self.keys if key not in set(batch)]
+        return {}
+
+
+class TestS3Prefix(unittest.TestCase):
+
+
+    def setUp(self):
+        self.keys = [f'out/scenarioPartition={i % 3}/part-{i:05}.csv' for i in range(2500)] + ['log/log.log']
+        self.s3 = FakeS3Client(self.keys)
+
+
+    def test_iter_keys_follows_continuation_tokens(self):
+        keys = list(s3prefix.iterKeys(self.s3, 'bucket', 'out/'))
+        assert len(keys) == 2500
+        assert self.s3.list_calls == 3
+
+
+    def test_iter_keys_is_lazy(self):
+        next(s3prefix.iterKeys(self.s3, 'bucket', 'out/'))
+        assert self.s3.list_calls == 1
+
+
+    def test_delete_keys_batches_requests(self):
+        deleted = s3prefix.deleteKeys(self.s3, 'bucket', s3prefix.iterKeys(self.s3, 'bucket', 'out/'))
+        assert len(deleted) == 2500
+        assert self.s3.delete_calls == [1000, 1000, 500]
+
+
+    def test_clear_prefixes(self):
+        result = s3prefix.clearPrefixes(self.s3, 'bucket', ['out/scenarioPartition=0', 'log', None])
+        assert {*result} == {'out/scenarioPartition=0', 'log'}
+        assert len(result['log']) == 1
+        assert not [key for key in self.s3.keys if key.startswith(('out/scenarioPartition=0', 'log'))]
+        assert len(self.s3.keys) == 2500 - len(result['out/scenarioPartition=0'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import numpy as np
+import os
+import pandas as pd
+import shutil
+import sys
+import tempfile
+import unittest
+TEST_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIRECTORY = os.path.dirname(TEST_DIRECTORY)
+sys.path.extend([TEST_DIRECTORY, PACKAGE_DIRECTORY])
+from mapping import scenarioweighting
+
+
+class TestScenarioWeighting(unittest.TestCase):
+
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.scenarios = {'BASE': 2, 'UP': 1, 'DOWN': 1}
+        self.csv_paths = []
+        for shift, name in enumerate(self.scenarios):
+            path = scenarioweighting.partitionPath(os.path.join(self.directory, 'instrumentRiskMetric'), name)
+            os.makedirs(os.path.dirname(path))
+            pd.DataFrame({
+                'instrumentIdentifier': [f'Loan{instrument}' for instrument in range(7) for _ in range(1, 4)],
+                'term': [term for _ in range(7) for term in range(1, 4)],
+                'annualizedCumulativePD': [(instrument + shift) / 100 + term / 1000 for instrument in range(7) for term in range(1, 4)],
+                'scenarioIdentifier': name,
+                'asOfDate': '2018-03-31'
+            }).to_csv(path, index=False)
+            self.csv_paths.append(path)
+        self.out_path = os.path.join(self.directory, 'instrumentRiskMetricWeighted.csv')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+    def test_weighted_term_structure(self):
+        scenarioweighting.writeWeightedTermStructure(self.csv_paths, [*self.scenarios.values()], self.out_path, chunksize=4)
+        df = pd.read_csv(self.out_path)
+        assert [*df.columns] == ['instrumentIdentifier', 'term', 'annualizedCumulativePD', 'asOfDate']
+        frames = [pd.read_csv(path) for path in self.csv_paths]
+        expected = sum(frame['annualizedCumulativePD'] * weight / 4 for frame, weight in zip(frames, self.scenarios.values()))
+        np.testing.assert_allclose(df['annualizedCumulativePD'], expected)
+        pd.testing.assert_frame_equal(df[['instrumentIdentifier', 'term', 'asOfDate']], frames[0][['instrumentIdentifier', 'term', 'asOfDate']])
+
+
+    def test_missing_values(self):
+        frame = pd.read_csv(self.csv_paths[1])
+        frame.loc[4, 'annualizedCumulativePD'] = None
+        frame.to_csv(self.csv_paths[1], index=False)
+        scenarioweighting.writeWeightedTermStructure(self.csv_paths, [*self.scenarios.values()], self.out_path, chunksize=4)
+        df = pd.read_csv(self.out_path)
+        assert df['annualizedCumulativePD'].isna().tolist() == [index == 4 for index in range(21)]
+
+
+    def test_misaligned_outputs(self):
+        frame = pd.read_csv(self.csv_paths[2])
+        frame.iloc[::-1].to_csv(self.csv_paths[2], index=False)
+        with self.assertRaises(ValueError):
+            scenarioweighting.writeWeightedTermStructure(self.csv_paths, [*self.scenarios.values()], self.out_path, chunksize=4)
+        frame.iloc[:-1].to_csv(self.csv_paths[2], index=False)
+        with self.assertRaises(ValueError):
+            scenarioweighting.writeWeightedTermStructure(self.csv_paths, [*self.scenarios.values()], self.out_path, chunksize=4)
+        assert not os.path.exists(self.out_path) and not [name for name in os.listdir(self.directory) if name.endswith('.tmp')]
+
+
+    def test_weights(self):
+        np.testing.assert_allclose(scenarioweighting.normalizedWeights([2, 1, '1']), [0.5, 0.25, 0.25])
+        for weights in [[1, None], [0, 0], [1, -1]]:
+            with self.assertRaises(ValueError):
+                scenarioweighting.normalizedWeights(weights)
+
+
+if __name__ == '__main__':
+    unittest.main()
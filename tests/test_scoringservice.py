@@ -0,0 +1,238 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+TEST_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIRECTORY = os.path.dirname(TEST_DIRECTORY)
+MODEL_DIRECTORY = os.path.join(PACKAGE_DIRECTORY, 'cap', 'model')
+sys.path.extend([TEST_DIRECTORY, PACKAGE_DIRECTORY, MODEL_DIRECTORY])
+import scoringservice
+
+
+class FakeScoringEngine:
+    """Offline stand-in for RScoringEngine: a flat term structure of the TTC PD, and an error for instruments without one"""
+
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+        self.release = threading.Event()
+        self.release.set()
+
+    def score(self, instruments, reporting_date, run_date):
+        self.release.wait()
+        self.calls.append(len(instruments))
+        if self.fail:
+            raise scoringservice.ScoringError('Engine failed')
+        results = {'instrumentRiskMetric': [], 'instrumentError': []}
+        for instrument in instruments:
+            if instrument.get('ttcannualizedpdoneyear') in (None, ''):
+                results['instrumentError'].append({'instrumentidentifier': instrument['instrumentidentifier'], 'errorcode': '100',
+                                                   'errormessgae': 'TTC PD is required; '})
+                continue
+            for term in range(1, 4):
+                results['instrumentRiskMetric'].append({'instrumentidentifier': instrument['instrumentidentifier'], 'term': term,
+                                                        'annualizedcumulativepd': float(instrument['ttcannualizedpdoneyear']), 'asOfDate': run_date})
+        return results
+
+
+# Stand-in for bin/score_worker.R speaking its line protocol, with stray output around responses. Instrument 'Hang' is never answered
+FAKE_WORKER = '''
+import json
+import sys
+import time
+print('Loading model data', flush=True)
+print(json.dumps({'ready': True}), flush=True)
+for line in sys.stdin:
+    request = json.loads(line)
+    identifiers = [instrument['instrumentidentifier'] for instrument in request['instruments']]
+    if 'Hang' in identifiers:
+        time.sleep(60)
+    print('[1] "stray print"', flush=True)
+    print(json.dumps({'id': request['id'], 'instrumentRiskMetric': [{'instrumentidentifier': identifier, 'term': 1} for identifier in identifiers]}),
+          flush=True)
+'''
+
+
+def instruments(prefix, n, pd=0.01):
+    return [{'InstrumentIdentifier': f'{prefix}{i}', 'TTCAnnualizedPDOneYear': pd} for i in range(n)]
+
+
+class TestMicroBatcher(unittest.TestCase):
+
+
+    def test_concurrent_requests_are_coalesced(self):
+        engine = FakeScoringEngine()
+        engine.release.clear()  # Hold the first batch, so that the other requests queue up behind it
+        batcher = scoringservice.MicroBatcher(engine, max_wait=0.05)
+        try:
+            first = batcher.submit([{'instrumentidentifier': 'Loan0', 'ttcannualizedpdoneyear': 0.5}], '2018-03-31', '2018-04-30')
+            futures = [batcher.submit([{'instrumentidentifier': 'Loan0', 'ttcannualizedpdoneyear': i / 100}], '2018-03-31', '2018-04-30')
+                       for i in range(10)]
+            engine.release.set()
+            assert first.result(5)['instrumentRiskMetric'][0]['annualizedcumulativepd'] == 0.5
+            for i, future in enumerate(futures):
+                result = future.result(5)
+                assert [row['instrumentidentifier'] for row in result['instrumentRiskMetric']] == ['Loan0'] * 3  # Identifiers restored
+                assert result['instrumentRiskMetric'][0]['annualizedcumulativepd'] == i / 100
+            assert len(engine.calls) < 11 and sum(engine.calls) == 11
+            assert batcher.metrics['requests'] == 11 and batcher.metrics['rows'] == 11
+        finally:
+            batcher.close()
+
+
+    def test_requests_with_different_dates_are_scored_separately(self):
+        engine = FakeScoringEngine()
+        batcher = scoringservice.MicroBatcher(engine, max_wait=0.05)
+        try:
+            march = batcher.submit([{'instrumentidentifier': 'Loan0', 'ttcannualizedpdoneyear': 0.01}], '2018-03-31', '2018-03-31')
+            april = batcher.submit([{'instrumentidentifier': 'Loan0', 'ttcannualizedpdoneyear': 0.01}], '2018-04-30', '2018-04-30')
+            assert march.result(5)['instrumentRiskMetric'][0]['asOfDate'] == '2018-03-31'
+            assert april.result(5)['instrumentRiskMetric'][0]['asOfDate'] == '2018-04-30'
+        finally:
+            batcher.close()
+
+
+    def test_engine_failure_fails_batch_only(self):
+        engine = FakeScoringEngine(fail=True)
+        batcher = scoringservice.MicroBatcher(engine, max_wait=0)
+        try:
+            with self.assertRaises(scoringservice.ScoringError):
+                batcher.score([{'instrumentidentifier': 'Loan0'}], '2018-03-31', '2018-03-31', timeout=5)
+            engine.fail = False
+            assert batcher.score([{'instrumentidentifier': 'Loan0'}], '2018-03-31', '2018-03-31', timeout=5)['instrumentError']
+        finally:
+            batcher.close()
+
+
+    def test_close_waits_for_bounded_time(self):
+        engine = FakeScoringEngine()
+        engine.release.clear()  # Stuck batch
+        batcher = scoringservice.MicroBatcher(engine, max_wait=0)
+        batcher.submit([{'instrumentidentifier': 'Loan0'}], '2018-03-31', '2018-03-31')
+        time.sleep(0.05)
+        assert not batcher.close(timeout=0.05)
+        engine.release.set()
+
+
+class TestRScoringEngine(unittest.TestCase):
+
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        worker = os.path.join(self.directory, 'worker.py')
+        with open(worker, 'w') as f:
+            f.write(FAKE_WORKER)
+        self.engine = scoringservice.RScoringEngine(timeout=0.5, start_timeout=10, command=[sys.executable, worker])
+
+
+    def tearDown(self):
+        self.engine.close(timeout=0)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+    def test_stray_output_is_skipped(self):
+        self.engine.start()
+        result = self.engine.score([{'instrumentidentifier': 'Loan0'}], '2018-03-31', '2018-03-31')
+        assert result == {'instrumentRiskMetric': [{'instrumentidentifier': 'Loan0', 'term': 1}], 'instrumentError': []}
+        assert self.engine.score([{'instrumentidentifier': 'Loan1'}], '2018-03-31', '2018-03-31')['instrumentRiskMetric']
+
+
+    def test_hung_worker_is_restarted(self):
+        self.engine.start()
+        process = self.engine._process
+        started = time.monotonic()
+        with self.assertRaises(scoringservice.ScoringError):
+            self.engine.score([{'instrumentidentifier': 'Hang'}], '2018-03-31', '2018-03-31')
+        assert time.monotonic() - started < 5 and process.poll() is not None  # Killed
+        assert self.engine.score([{'instrumentidentifier': 'Loan0'}], '2018-03-31', '2018-03-31')['instrumentRiskMetric']
+        assert self.engine._process is not process
+
+
+    def test_close_ends_request_in_progress(self):
+        self.engine.timeout = None
+        self.engine.start()
+        errors = []
+
+        def score():
+            try:
+                self.engine.score([{'instrumentidentifier': 'Hang'}], '2018-03-31', '2018-03-31')
+            except scoringservice.ScoringError as e:
+                errors.append(e)
+        request = threading.Thread(target=score)
+        request.start()
+        time.sleep(0.2)
+        started = time.monotonic()
+        self.engine.close(timeout=0.1)
+        request.join(5)
+        assert time.monotonic() - started < 5 and not request.is_alive() and errors
+        with self.assertRaises(scoringservice.ScoringError):
+            self.engine.score([{'instrumentidentifier': 'Loan0'}], '2018-03-31', '2018-03-31')
+
+
+class TestScoringService(unittest.TestCase):
+
+
+    def setUp(self):
+        self.engine = FakeScoringEngine()
+        self.service = scoringservice.ScoringService(self.engine, ('127.0.0.1', 0), max_wait=0.01)
+        self.thread = threading.Thread(target=self.service.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f'http://127.0.0.1:{self.service.server_address[1]}'
+
+
+    def tearDown(self):
+        self.service.shutdown()
+        self.service.server_close()
+
+
+    def request(self, path, body=None):
+        data = body if isinstance(body, bytes) or body is None else json.dumps(body).encode('utf-8')
+        try:
+            with urllib.request.urlopen(urllib.request.Request(self.url + path, data=data), timeout=10) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+
+
+    def test_score(self):
+        body = {'instruments': instruments('Loan', 2) + [{'instrumentIdentifier': 'Loan2'}], 'reportingDate': '2018-03-31', 'runDate': '2018-04-30'}
+        status, result = self.request('/score', body)
+        assert status == 200
+        assert len(result['instrumentRiskMetric']) == 6 and result['instrumentRiskMetric'][0]['asOfDate'] == '2018-04-30'
+        assert [error['instrumentidentifier'] for error in result['instrumentError']] == ['Loan2']
+
+
+    def test_concurrent_clients(self):
+        body = lambda i: {'instruments': instruments(f'Client{i}-', 5), 'reportingDate': '2018-03-31'}
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            responses = list(executor.map(lambda i: self.request('/score', body(i)), range(16)))
+        for i, (status, result) in enumerate(responses):
+            assert status == 200
+            assert {row['instrumentidentifier'] for row in result['instrumentRiskMetric']} == {f'Client{i}-{j}' for j in range(5)}
+        status, health = self.request('/health')
+        assert status == 200 and health['requests'] == 16 and health['rows'] == 80
+
+
+    def test_bad_requests(self):
+        assert self.request('/score', b'not json')[0] == 400
+        assert self.request('/score', {'instruments': [{'ttcannualizedpdoneyear': 0.01}], 'reportingDate': '2018-03-31'})[0] == 400
+        assert self.request('/score', {'instruments': instruments('Loan', 1), 'reportingDate': '03/31/2018'})[0] == 400
+        assert self.request('/unknown')[0] == 404
+        assert not self.engine.calls
+
+
+    def test_engine_failure(self):
+        self.engine.fail = True
+        status, result = self.request('/score', {'instruments': instruments('Loan', 1), 'reportingDate': '2018-03-31'})
+        assert status == 500 and result['error'] == 'Engine failed'
+
+
+if __name__ == '__main__':
+    unittest.main()
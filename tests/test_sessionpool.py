@@ -0,0 +1,110 @@
+import base64
+import json
+import os
+import sys
+import unittest
+TEST_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIRECTORY = os.path.dirname(TEST_DIRECTORY)
+sys.path.extend([TEST_DIRECTORY, PACKAGE_DIRECTORY])
+from cap.model import sessionpool
+
+
+def makeJwt(exp):
+    encode = lambda obj: base64.urlsafe_b64encode(json.dumps(obj).encode('utf-8')).decode('utf-8').rstrip('=')
+    return f'{encode({"alg": "none"})}.{encode({"exp": exp})}.signature'
+
+
+class FakeCappy:
+    """Stand-in for moodyscappy.Cappy that counts authentications and S3 clients"""
+    instances = []
+
+    def __init__(self, jwt=None, username=None, password=None, sso_url=None, errors='raise'):
+        self.jwt = jwt or (None if password == 'wrong' else 'token')  # Failed authentications are logged with errors='log'
+        self.username = username
+        self.s3_clients = 0
+        FakeCappy.instances.append(self)
+
+    def init_s3_client(self):
+        self.s3_clients += 1
+        return object()
+
+
+class TestSessionPool(unittest.TestCase):
+
+
+    def setUp(self):
+        FakeCappy.instances = []
+        self.now = 1000.0
+        self.pool = sessionpool.SessionPool(session_factory=FakeCappy, max_age=600, refresh_margin=60, min_refresh_interval=60,
+                                             clock=lambda: self.now)
+
+
+    def test_same_credentials_reuse_session(self):
+        credentials = {'username': 'user', 'password': 'pw'}
+        first = self.pool.getSession(credentials)
+        second = self.pool.getSession(dict(credentials))
+        assert first is second
+        assert len(FakeCappy.instances) == 1
+
+
+    def test_different_credentials_or_errors_get_new_session(self):
+        self.pool.getSession({'username': 'user', 'password': 'pw'})
+        self.pool.getSession({'username': 'other', 'password': 'pw'})
+        self.pool.getSession({'username': 'user', 'password': 'pw'}, errors='log')
+        assert len(FakeCappy.instances) == 3
+
+
+    def test_s3_client_is_cached_per_session(self):
+        session = self.pool.getSession({'username': 'user', 'password': 'pw'})
+        assert self.pool.getS3Client(session) is self.pool.getS3Client(session)
+        assert session.s3_clients == 1
+
+
+    def test_refresh_before_jwt_expiry(self):
+        credentials = {'jwt': makeJwt(exp=self.now + 120)}
+        first = self.pool.getSession(credentials)
+        self.now += 30
+        assert self.pool.getSession(credentials) is first
+        self.now += 40  # Within refresh margin of expiry
+        assert self.pool.getSession(credentials) is not first
+
+
+    def test_jwt_near_expiry_is_not_refreshed_on_every_call(self):
+        credentials = {'jwt': makeJwt(exp=self.now + 30)}  # Within refresh margin already, and cannot be refreshed
+        first = self.pool.getSession(credentials)
+        assert self.pool.getSession(credentials) is first
+        self.now += 59
+        assert self.pool.getSession(credentials) is first
+        self.now += 1  # min_refresh_interval
+        assert self.pool.getSession(credentials) is not first
+        assert len(FakeCappy.instances) == 2
+
+
+    def test_failed_authentication_is_not_cached(self):
+        credentials = {'username': 'user', 'password': 'wrong'}
+        first = self.pool.getSession(credentials, errors='log')
+        assert self.pool.getSession(credentials, errors='log') is not first
+        assert len(FakeCappy.instances) == 2
+
+
+    def test_refresh_after_max_age_without_jwt(self):
+        credentials = {'username': 'user', 'password': 'pw'}
+        first = self.pool.getSession(credentials)
+        self.now += 600
+        assert self.pool.getSession(credentials) is not first
+
+
+    def test_invalidate(self):
+        credentials = {'username': 'user', 'password': 'pw'}
+        first = self.pool.getSession(credentials)
+        self.pool.invalidate(credentials)
+        assert self.pool.getSession(credentials) is not first
+
+
+    def test_unreadable_token_has_no_expiry(self):
+        assert sessionpool.getTokenExpiry('not-a-jwt') is None
+        assert sessionpool.getTokenExpiry(makeJwt(exp=42)) == 42
+
+
+if __name__ == '__main__':
+    unittest.main()
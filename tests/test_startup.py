@@ -0,0 +1,47 @@
+import os
+import subprocess
+import sys
+import unittest
+TEST_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIRECTORY = os.path.dirname(TEST_DIRECTORY)
+RUN_SCRIPT = os.path.join(PACKAGE_DIRECTORY, 'cap', 'model', 'run.py')
+
+# Cumulative import time budget for `run.py -h` (generous to absorb slow CI machines)
+IMPORT_TIME_BUDGET_MS = 300
+HEAVY_MODULES = {'pandas', 'numpy', 'moodyscappy', 'boto3', 'botocore', 'mapping', 'model'}
+
+
+def getImportTimes(args):
+    """
+    Run a python command with -X importtime
+    :return: dictionary of form {module: (cumulative_microseconds, is_top_level)}
+    """
+    process = subprocess.run([sys.executable, '-X', 'importtime', *args], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    import_times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        import_times[module.strip()] = (int(cumulative), not module.startswith('  '))  # Nested imports are indented
+    return import_times
+
+
+class TestStartup(unittest.TestCase):
+
+
+    def setUp(self):
+        self.import_times = getImportTimes([RUN_SCRIPT, '-h'])
+
+
+    def test_help_does_not_import_heavy_modules(self):
+        imported = {module.split('.')[0] for module in self.import_times}
+        assert not imported & HEAVY_MODULES, f'Heavy modules imported on CLI startup: {imported & HEAVY_MODULES}'
+
+
+    def test_help_import_time_within_budget(self):
+        total_ms = sum(cumulative for cumulative, is_top_level in self.import_times.values() if is_top_level) / 1000
+        assert total_ms < IMPORT_TIME_BUDGET_MS, f'run.py -h spent {total_ms:.1f}ms importing modules (budget {IMPORT_TIME_BUDGET_MS}ms)'
+
+
+if __name__ == '__main__':
+    unittest.main()
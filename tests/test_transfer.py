@@ -0,0 +1,134 @@
+import os
+import sys
+import threading
+import time
+import unittest
+TEST_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIRECTORY = os.path.dirname(TEST_DIRECTORY)
+MODEL_DIRECTORY = os.path.join(PACKAGE_DIRECTORY, 'cap', 'model')
+SAMPLE_TEST_DIRECTORY = os.path.join(TEST_DIRECTORY, 'sample-test')
+sys.path.extend([TEST_DIRECTORY, PACKAGE_DIRECTORY, MODEL_DIRECTORY])
+import iosession
+from test_iosession import FakeObjectStore, createFakeRemoteTestCase
+import transfer
+
+
+class UnreliableObjectStore(FakeObjectStore):
+    """
+    FakeObjectStore injecting latency and failures per key: delays are seconds per call (the last one is kept for further calls),
+    failures are errors to raise per call (None for no error)
+    """
+
+    def __init__(self, objects=None):
+        super().__init__(objects)
+        self.delays = {}
+        self.failures = {}
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def _inject(self, key):
+        with self._lock:
+            self.calls.append(key)
+            delay = self.delays.get(key, [0]).pop(0) if len(self.delays.get(key, [])) > 1 else self.delays.get(key, [0])[0]
+            failure = self.failures[key].pop(0) if self.failures.get(key) else None
+        time.sleep(delay)
+        if failure is not None:
+            raise failure
+
+    def s3_download_file(self, key, local_file_path):
+        self._inject(key)
+        super().s3_download_file(key, local_file_path)
+
+    def s3_upload_file(self, local_file_path, key):
+        self._inject(key)
+        super().s3_upload_file(local_file_path, key)
+
+
+class TestTransferScheduler(unittest.TestCase):
+
+
+    def test_retry_with_backoff(self):
+        scheduler = transfer.TransferScheduler(timeout=5, retries=2, hedge_factor=0, backoff=0.01)
+        failures = [ConnectionError('reset'), ConnectionError('reset')]
+
+        def function(attempt):
+            if failures:
+                raise failures.pop(0)
+            return attempt
+        assert scheduler.run('key', function, size=100) == 2
+        assert scheduler.records[0]['attempts'] == 3 and scheduler.records[0]['succeeded']
+        assert scheduler.summary()['retried_transfers'] == 1
+
+
+    def test_permanent_errors_are_not_retried(self):
+        scheduler = transfer.TransferScheduler(timeout=5, retries=2, hedge_factor=0, backoff=0.01)
+        with self.assertRaises(FileNotFoundError):
+            scheduler.run('missing', lambda attempt: (_ for _ in ()).throw(FileNotFoundError('missing')))
+        assert scheduler.records[0]['attempts'] == 1 and not scheduler.records[0]['succeeded']
+
+
+    def test_deadline(self):
+        scheduler = transfer.TransferScheduler(timeout=0.05, retries=1, hedge_factor=0, backoff=0.01)
+        release = threading.Event()
+        discarded = []
+        started = time.monotonic()
+        with self.assertRaises(transfer.TransferTimeout):
+            scheduler.run('stuck', lambda attempt: release.wait(5) and attempt, discard=discarded.append)
+        assert time.monotonic() - started < 1
+        release.set()
+        time.sleep(0.05)
+        assert sorted(discarded) == [0, 1]  # Abandoned attempts that finish later are discarded
+        assert scheduler.summary()['failed_transfers'] == 1
+
+
+    def test_hedge_straggler(self):
+        scheduler = transfer.TransferScheduler(timeout=5, retries=0, hedge_factor=3, min_samples=3, min_hedge_delay=0)
+        for i in range(3):
+            scheduler.run(f'fast{i}', lambda attempt: time.sleep(0.01), size=1000)
+        started = time.monotonic()
+        result = scheduler.run('slow', lambda attempt: time.sleep(2 if attempt == 0 else 0.01) or attempt, size=1000)
+        assert result == 1 and time.monotonic() - started < 1
+        record = scheduler.records[-1]
+        assert record['hedged'] and record['attempts'] == 2 and record['throughput'] > 1000
+        assert scheduler.summary()['hedged_transfers'] == 1 and scheduler.summary()['transferred_bytes'] == 4000
+
+
+class TestIOSessionTransfers(unittest.TestCase):
+
+
+    def setUp(self):
+        self.store = UnreliableObjectStore()
+        mrp_key = createFakeRemoteTestCase(SAMPLE_TEST_DIRECTORY, self.store)
+        self.io_session = iosession.IOSession(self.store, mrp_key, False)
+        self.io_session.transfers = transfer.TransferScheduler(timeout=0.5, retries=2, hedge_factor=0, backoff=0.01)
+        self.input_key = next(key for key in self.store.objects if key.endswith('instrumentReference.csv'))
+        self.local_path = os.path.join(self.io_session.local_directories['inputPath'], 'instrumentReference.csv')
+
+
+    def tearDown(self):
+        self.io_session.deleteTempDirectories()
+
+
+    def test_flaky_download(self):
+        self.store.delays[self.input_key] = [2, 0]  # First attempt is stuck past the deadline, second fails, third succeeds
+        self.store.failures[self.input_key] = [None, ConnectionError('reset')]
+        files = self.io_session._downloadObject(self.input_key, self.local_path, on_error='raise')
+        assert files == {'instrumentReference': self.local_path}
+        with open(self.local_path, 'rb') as f:
+            assert f.read() == self.store.objects[self.input_key]
+        record = self.io_session.transfers.records[-1]
+        assert record['attempts'] == 3 and record['bytes'] == os.path.getsize(self.local_path) and record['direction'] == 'download'
+        assert not [name for name in os.listdir(os.path.dirname(self.local_path)) if name.endswith('.part')]
+
+
+    def test_failed_upload(self):
+        self.store.failures['out/key'] = [ConnectionError('reset')] * 3
+        with open(self.local_path, 'w') as f:
+            f.write('instrumentidentifier\nLoan001\n')
+        assert not self.io_session._uploadFile(self.local_path, 'out/key', on_error='ignore')
+        assert self.store.calls.count('out/key') == 3 and 'out/key' not in self.store.objects
+        assert self.io_session.transfers.summary()['failed_transfers'] == 1
+
+
+if __name__ == '__main__':
+    unittest.main()
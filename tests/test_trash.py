@@ -0,0 +1,101 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+TEST_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIRECTORY = os.path.dirname(TEST_DIRECTORY)
+MODEL_DIRECTORY = os.path.join(PACKAGE_DIRECTORY, 'cap', 'model')
+SAMPLE_TEST_DIRECTORY = os.path.join(TEST_DIRECTORY, 'sample-test')
+sys.path.extend([TEST_DIRECTORY, PACKAGE_DIRECTORY, MODEL_DIRECTORY])
+import iosession
+import trash
+
+
+class TestTrash(unittest.TestCase):
+
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.trash_directory = os.path.join(self.directory, 'trash')
+        self.tree = os.path.join(self.directory, 'tree')
+        for i in range(20):
+            os.makedirs(os.path.join(self.tree, f'scenarioPartition={i}'))
+            with open(os.path.join(self.tree, f'scenarioPartition={i}', 'data.csv'), 'w') as f:
+                f.write('a,b\n1,2\n')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+    def waitUntilEmpty(self, directory, timeout=10):
+        deadline = time.time() + timeout
+        while os.listdir(directory) and time.time() < deadline:
+            time.sleep(0.05)
+        return os.listdir(directory)
+
+
+    def test_thread_mode(self):
+        trashed = trash.trash([self.tree, os.path.join(self.directory, 'missing')], mode='thread', trash_directory=self.trash_directory)
+        assert not os.path.exists(self.tree)
+        assert [os.path.dirname(path) for path in trashed] == [self.trash_directory]
+        trash.waitForBackgroundDeletes()
+        assert os.listdir(self.trash_directory) == []
+
+
+    def test_process_mode(self):
+        trash.trash([self.tree], mode='process', trash_directory=self.trash_directory)
+        assert not os.path.exists(self.tree)
+        assert self.waitUntilEmpty(self.trash_directory) == []
+
+
+    def test_empty_trash(self):
+        trash.moveToTrash(self.tree, trash_directory=self.trash_directory)
+        trash.emptyTrash(mode='sync', trash_directory=self.trash_directory)
+        assert os.listdir(self.trash_directory) == []
+
+
+class TestIOSessionTempDirectories(unittest.TestCase):
+
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.test_folder = os.path.join(self.directory, 'sample-test')
+        shutil.copytree(SAMPLE_TEST_DIRECTORY, self.test_folder, ignore=shutil.ignore_patterns('benchmark', 'output'))
+        self.mrp_path = os.path.join(self.test_folder, 'modelRunParameter.json')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+    def test_reused_temp_directory(self):
+        temp_directory = os.path.join(self.directory, 'worker0')
+        for _ in range(2):
+            io_session = iosession.IOSession(None, self.mrp_path, True, temp_directory=temp_directory)
+            input_files = io_session.getSourceInputFiles()
+            assert set(input_files) == {'instrumentReference', 'propertyReference'}
+            io_session.deleteTempDirectories(mode='sync')
+            assert os.listdir(temp_directory) == []
+
+
+    def test_owned_temp_directory_is_removed(self):
+        io_session = iosession.IOSession(None, self.mrp_path, True)
+        io_session.deleteTempDirectories(mode='sync')
+        assert not os.path.exists(io_session.local_temp_directory)
+
+
+    def test_initialize_directory_clears_contents(self):
+        io_session = iosession.IOSession(None, self.mrp_path, True)
+        directory = io_session.local_directories['logPath']
+        with open(os.path.join(directory, 'old.log'), 'w') as f:
+            f.write('old')
+        assert io_session.initializeDirectory(directory) == directory
+        assert os.listdir(directory) == []
+        io_session.deleteTempDirectories(mode='sync')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import pandas as pd
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+TEST_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIRECTORY = os.path.dirname(TEST_DIRECTORY)
+MODEL_DIRECTORY = os.path.join(PACKAGE_DIRECTORY, 'cap', 'model')
+SAMPLE_TEST_DIRECTORY = os.path.join(TEST_DIRECTORY, 'sample-test')
+sys.path.extend([TEST_DIRECTORY, PACKAGE_DIRECTORY, MODEL_DIRECTORY])
+from mapping import ddlookup
+from mapping import validation
+import instrumenterror
+import run
+import sessionpool
+from test_sessionpool import FakeCappy
+
+
+class TestInstrumentValidator(unittest.TestCase):
+
+
+    def setUp(self):
+        self.instruments = pd.DataFrame({
+            'PortfolioIdentifier': ['CMM_1'] * 6,
+            'InstrumentIdentifier': [f'Loan{i}' for i in range(6)],
+            'TTCAnnualizedPDOneYear': ['0.01', '', 'high', '0.02', '0.03', None],
+            'PrivateFirmModelName': ['USA 4.0', 'USA 4.0', 'USA 4.0', 'XYZ 1.0', 'CHN 3.1', ' ']
+        })
+
+
+    def test_masks(self):
+        validator = validation.InstrumentValidator(['USA 4.0', 'CHN 3.1'])
+        valid, errors = validator.validate(self.instruments)
+        assert [*valid['InstrumentIdentifier']] == ['Loan0', 'Loan4']
+        assert [*errors['instrumentIdentifier']] == ['Loan1', 'Loan2', 'Loan3', 'Loan5']
+        assert [*errors['errorMessage']] == ['TTC PD is required; ', 'TTC PD is not a number; ', 'Model Code XYZ 1.0 is not supported; ',
+                                             'TTC PD is required; Model Code is required; ']
+        assert (errors['portfolioIdentifier'] == 'CMM_1').all() and (errors['errorCode'] == '100').all()
+
+
+    def test_missing_attributes(self):
+        valid, errors = validation.InstrumentValidator(['USA 4.0']).validate(self.instruments[['InstrumentIdentifier']])
+        assert valid.empty and len(errors.index) == 6
+        assert errors['portfolioIdentifier'].isna().all()
+
+
+    def test_dd_date_range(self):
+        assert validation.ddYearmonth(pd.Timestamp('2018-02-28')) == 201712
+        directory = tempfile.mkdtemp()
+        try:
+            dd_data = pd.DataFrame({'yearmonth': [201701, 201712], 'sector': ['Unassigned'] * 2, 'dma36mdd1': [1.0, 2.0]})
+            ddlookup.compileDDLookup({'dd_meanUS40': dd_data}, {'USA 4.0': 'dd_meanUS40'}, directory)
+            lookup = ddlookup.loadDDLookup(directory)
+            _, errors = validation.InstrumentValidator(['USA 4.0', 'CHN 3.1'], lookup, pd.Timestamp('2018-02-28')).validate(self.instruments)
+            assert "'Current Date'" not in ''.join(errors['errorMessage'])
+            valid, errors = validation.InstrumentValidator(['USA 4.0', 'CHN 3.1'], lookup, pd.Timestamp('2018-03-31')).validate(self.instruments)
+            assert [*valid['InstrumentIdentifier']] == ['Loan4']  # CHN 3.1 has no compiled DD table, so it is left to the engine
+            assert errors.set_index('instrumentIdentifier').loc['Loan0', 'errorMessage'] == "'Current Date': Current Date Range is invalid;"
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+    def test_model_codes_from_data_directory(self):
+        validator = validation.loadInstrumentValidator(os.path.join(PACKAGE_DIRECTORY, 'data'))
+        assert 'USA 4.0' in validator.model_codes and 'XYZ 1.0' not in validator.model_codes
+
+
+    def test_errors_join_instrument_error(self):
+        handler = instrumenterror.InstrumentErrorHandler('validation')
+        _, errors = validation.InstrumentValidator(['USA 4.0', 'CHN 3.1']).validate(self.instruments)
+        handler.joinDataFrame(errors)
+        assert [*handler._df['instrumentIdentifier']] == ['Loan1', 'Loan2', 'Loan3', 'Loan5']
+        assert [*handler._df['moduleCode'].unique()] == ['PIT Coverter']
+
+
+class TestAllInvalidShard(unittest.TestCase):
+
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.test_folder = os.path.join(self.directory, 'sample-test')
+        shutil.copytree(SAMPLE_TEST_DIRECTORY, self.test_folder, ignore=shutil.ignore_patterns('benchmark', 'output'))
+        self.environment = mock.patch.dict(os.environ, {'MOODYS_TEMP_CLEANUP': 'sync', 'MOODYS_CHECKPOINT_DIRECTORY': ''})
+        self.environment.start()
+
+
+    def tearDown(self):
+        self.environment.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+    def test_outputs_without_engine(self):
+        # No sample instrument has a TTC PD, so the only shard fails validation and never reaches the engine
+        mrp_path = os.path.join(self.test_folder, 'modelRunParameter.json')
+        run.runModel(mrp_path, True, {'jwt': 'token'}, {}, session_pool=sessionpool.SessionPool(session_factory=FakeCappy), run_id='invalid')
+        output_folder = os.path.join(self.test_folder, 'output')
+        benchmark = pd.read_csv(os.path.join(SAMPLE_TEST_DIRECTORY, 'benchmark', 'instrumentReference', 'data.csv'), dtype=str)
+        pd.testing.assert_frame_equal(pd.read_csv(os.path.join(output_folder, 'instrumentReference', 'data.csv'), dtype=str), benchmark)
+        risk_metric = pd.read_csv(os.path.join(output_folder, 'instrumentRiskMetric', 'data.csv'))
+        assert risk_metric.empty and 'annualizedcumulativepd' in risk_metric.columns
+        errors = pd.read_csv(os.path.join(output_folder, 'instrumentError', 'data.csv'), dtype=str)
+        validation_errors = errors[errors['moduleCode'] == validation.MODULE_CODE]
+        assert len(validation_errors.index) == len(benchmark.index)
+        assert validation_errors['portfolioIdentifier'].notna().all()
+
+
+if __name__ == '__main__':
+    unittest.main()